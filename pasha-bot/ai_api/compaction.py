@@ -0,0 +1,121 @@
+import logging
+import re
+from config import COMPACTION_MAX_MESSAGE_CHARS, EXCLUDED_BOTS, PROMPT_COMPACTION_STEPS
+from utils.metrics import COMPACTION_SAVED_CHARS, COMPACTION_SAVED_TOKENS
+from utils.tokens import CHARS_PER_TOKEN
+
+# Compaction runs between fetching the rows and building a prompt and drops what
+# costs tokens without telling Gemini anything. Every step takes and returns
+# message rows (id, thread_id, username, date, message_content), newest first,
+# and is registered in COMPACTION_STEPS under the name PROMPT_COMPACTION_STEPS uses.
+
+logger = logging.getLogger(__name__)
+
+# Text stored for messages without text (stickers, photos), see handlers/message_handler.py
+NO_TEXT_PLACEHOLDER = "No text content"
+
+# Replies that only acknowledge, compared after normalization
+ACKNOWLEDGEMENTS = {"+", "+1", "ок", "ok", "okay", "да", "ага", "угу", "понял", "спасибо", "спс", "thanks", "thx"}
+
+# Joins merged messages so they read as continuation lines under the first one
+MERGED_MESSAGE_SEPARATOR = "\n    "
+
+_NON_WORD = re.compile(r"[^\w+]+")
+
+def normalize_text(text):
+    """Lower-case the text and drop punctuation, emoji and extra spaces, for comparing messages."""
+    return _NON_WORD.sub(" ", (text or "").lower()).strip()
+
+def exclude_bots(messages):
+    return [row for row in messages if row[2] not in EXCLUDED_BOTS]
+
+def drop_noise(messages):
+    """Drop placeholders of non-text messages, bare acknowledgements and emoji-only messages."""
+    kept = []
+    for row in messages:
+        text = normalize_text(row[4])
+        if row[4] == NO_TEXT_PLACEHOLDER or not text or text in ACKNOWLEDGEMENTS:
+            continue
+        kept.append(row)
+    return kept
+
+def truncate_pastes(messages, max_chars=None):
+    """Cut messages longer than COMPACTION_MAX_MESSAGE_CHARS, e.g. pasted logs."""
+    max_chars = max_chars or COMPACTION_MAX_MESSAGE_CHARS
+    compacted = []
+    for row in messages:
+        content = row[4] or ""
+        if len(content) > max_chars:
+            row = (*row[:4], f"{content[:max_chars]} … [{len(content) - max_chars} characters cut]")
+        compacted.append(row)
+    return compacted
+
+def dedup(messages):
+    """Keep only the first message of each thread with the same normalized text, e.g. a reposted link."""
+    seen = set()
+    kept = []
+    for row in reversed(messages):  # Oldest first, so the first occurrence is kept
+        key = (row[1], normalize_text(row[4]))
+        if key in seen:
+            continue
+        seen.add(key)
+        kept.append(row)
+    return kept[::-1]
+
+def merge_consecutive(messages):
+    """Merge messages a user sent in a row within a thread into one, saving a line prefix each.
+
+    The merged row takes the id and date of the user's last message.
+    """
+    merged = []
+    last_in_thread = {}  # thread_id -> index into merged of the thread's latest row
+    for row in reversed(messages):  # Oldest first
+        index = last_in_thread.get(row[1])
+        if index is not None and merged[index][2] == row[2]:
+            previous = merged[index]
+            merged[index] = (row[0], row[1], row[2], row[3], f"{previous[4]}{MERGED_MESSAGE_SEPARATOR}{row[4]}")
+            continue
+        last_in_thread[row[1]] = len(merged)
+        merged.append(row)
+    # The merged rows take the ids of their last message, keep the newest-first order by id
+    return sorted(merged, key=lambda row: row[0], reverse=True)
+
+COMPACTION_STEPS = {
+    "exclude_bots": exclude_bots,
+    "drop_noise": drop_noise,
+    "truncate": truncate_pastes,
+    "dedup": dedup,
+    "merge_consecutive": merge_consecutive,
+}
+
+def _rendered_chars(messages):
+    # Characters the rows take in a prompt, including the "  - username: " prefix of write_messages
+    return sum(len(row[2] or "") + len(row[4] or "") + 6 for row in messages)
+
+def compact_messages(messages, steps=None):
+    """Run the compaction steps over the rows and return (compacted rows, stats).
+
+    ``steps`` are step names, PROMPT_COMPACTION_STEPS by default. The stats
+    hold the message count and the characters and estimated tokens saved.
+    """
+    steps = PROMPT_COMPACTION_STEPS if steps is None else steps
+    compacted = list(messages)
+    for name in steps:
+        step = COMPACTION_STEPS.get(name)
+        if step is None:
+            logger.warning(f"Unknown compaction step {name}, skipping it.")
+            continue
+        compacted = step(compacted)
+
+    chars_before, chars_after = _rendered_chars(messages), _rendered_chars(compacted)
+    stats = {
+        "messages_before": len(messages),
+        "messages_after": len(compacted),
+        "chars_saved": chars_before - chars_after,
+        "tokens_saved": (chars_before - chars_after) // CHARS_PER_TOKEN,
+    }
+    COMPACTION_SAVED_CHARS.inc(stats["chars_saved"])
+    COMPACTION_SAVED_TOKENS.inc(stats["tokens_saved"])
+    logger.info(f"Compacted {stats['messages_before']} messages to {stats['messages_after']}, "
+                f"saving {stats['chars_saved']} characters (~{stats['tokens_saved']} tokens).")
+    return compacted, stats
@@ -1,46 +1,55 @@
+import asyncio
+import functools
+import importlib
 import logging
-import os
-import google.generativeai as genai
-from google.generativeai.types import GenerationConfig
+import time
+import uuid
+from collections import defaultdict
 from ai_api.gemini.prompt_builder import build_prompt
-from config import GEMINI_API_KEY
-from datetime import datetime
-
-# Load the Gemini API key
-genai.configure(api_key=GEMINI_API_KEY)
-
-# Create a log folder if it doesn't exist
-LOG_FOLDER = "log"
-os.makedirs(LOG_FOLDER, exist_ok=True)
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler(os.path.join(LOG_FOLDER, "api_debug.log")),  # Main debug log file
-        logging.StreamHandler()  # Output logs to the console
-    ]
-)
-
-def log_request(prompt: str):
-    """Log the request to a separate file."""
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    with open(os.path.join(LOG_FOLDER, f"gemini_request_{timestamp}.log"), "w", encoding="utf-8") as request_log:
-        request_log.write(f"Sent to Gemini API at {timestamp}:\n\n{prompt}\n")
-
-def log_response(response: str):
-    """Log the response to a separate file."""
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    with open(os.path.join(LOG_FOLDER, f"gemini_response_{timestamp}.log"), "w", encoding="utf-8") as response_log:
-        response_log.write(f"Received from Gemini API at {timestamp}:\n\n{response}\n")
-
-def get_gemini_summary(message_block: str) -> str:
-    # Replace thread IDs with names in the message block before building the prompt
-    prompt = build_prompt(message_block)
+from ai_api.gemini.resilience import GeminiError, LatencyTracker, SummaryResult, call_with_fallback
+from ai_api.rate_limiter import GeminiScheduler
+from config import (GEMINI_API_KEY, GEMINI_FALLBACK_MODELS, GEMINI_HEDGE, GEMINI_HEDGE_PERCENTILE,
+                    GEMINI_KEEPALIVE_SECONDS, GEMINI_MODEL, GEMINI_TIMEOUT, GEMINI_WARM_UP)
+from utils.log_setup import ARCHIVE_LOGGER_NAME
+from utils.metrics import (ERRORS, GEMINI_PROMPT_CHARS, GEMINI_PROMPT_TOKENS, GEMINI_QUEUE_DEPTH,
+                           GEMINI_REQUEST_SECONDS, GEMINI_RESPONSE_CHARS, GEMINI_RESPONSE_TOKENS)
+from utils.tokens import estimate_tokens
+
+# The Gemini SDK (google.generativeai and its gRPC stack) takes most of a second
+# to import. It is imported where a client is built, not when the bot starts.
+
+# Full prompts and responses go to the compressed JSONL archive, see utils/log_setup.py
+archive_logger = logging.getLogger(ARCHIVE_LOGGER_NAME)
+
+def log_request(prompt: str) -> str:
+    """Archive the request and return the id that ties it to its response."""
+    request_id = uuid.uuid4().hex
+    archive_logger.info(prompt, extra={"kind": "request", "request_id": request_id})
+    return request_id
+
+def log_response(request_id: str, response: str):
+    """Archive the response under the id of its request."""
+    archive_logger.info(response, extra={"kind": "response", "request_id": request_id})
 
-    # Define the model configuration
-    generation_config = GenerationConfig(
+# Admits calls by priority within the concurrency limit and the shared per-minute quota
+gemini_scheduler = GeminiScheduler()
+GEMINI_QUEUE_DEPTH.set_function(lambda: gemini_scheduler.queue_depth)
+
+def _observe_call(mode, outcome, started, prompt, response_text=""):
+    GEMINI_REQUEST_SECONDS.observe(time.perf_counter() - started, mode=mode, outcome=outcome)
+    GEMINI_PROMPT_CHARS.observe(len(prompt))
+    GEMINI_PROMPT_TOKENS.observe(estimate_tokens(prompt))
+    if outcome == "ok":
+        GEMINI_RESPONSE_CHARS.observe(len(response_text))
+        GEMINI_RESPONSE_TOKENS.observe(estimate_tokens(response_text))
+    else:
+        ERRORS.inc(source=f"gemini.{outcome}")
+
+# Generation settings per kind of call. Every profile gets its own model handle,
+# built once by GeminiClient and reused for all calls.
+GENERATION_PROFILES = {
+    # Summaries, map-reduce merges and topic summaries
+    "summary": dict(
         candidate_count=1,
         stop_sequences=["\nThread"],  # Stops output generation at thread breaks.
         max_output_tokens=3500,       # Increased to allow for larger responses.
@@ -50,33 +59,252 @@ def get_gemini_summary(message_block: str) -> str:
         response_mime_type="text/plain",
         presence_penalty=0.3,
         frequency_penalty=0.6
-    )
+    ),
+    # Rolling thread summaries are kept under 150 words
+    "rolling": dict(
+        candidate_count=1,
+        max_output_tokens=600,
+        temperature=0.2,
+        top_p=0.9,
+        top_k=40,
+        response_mime_type="text/plain",
+    ),
+    # Replies to messages that mention the bot
+    "mention": dict(
+        candidate_count=1,
+        max_output_tokens=1500,
+        temperature=0.5,
+        top_p=0.95,
+        top_k=40,
+        response_mime_type="text/plain",
+    ),
+}
 
-    try:
-        # Log the request before sending it
-        logging.info("Sending request to Gemini API:")
-        log_request(prompt)  # Log the request to the separate file
+def _keepalive_channel(host, options=(), **kwargs):
+    # gRPC channel (one HTTP/2 connection shared by all calls) that pings the
+    # server while idle, so the connection is still open for the next summary
+    from google.ai.generativelanguage_v1beta.services.generative_service.transports import GenerativeServiceGrpcAsyncIOTransport
+    keepalive_ms = int(GEMINI_KEEPALIVE_SECONDS * 1000)
+    return GenerativeServiceGrpcAsyncIOTransport.create_channel(host, options=list(options) + [
+        ("grpc.keepalive_time_ms", keepalive_ms),
+        ("grpc.keepalive_timeout_ms", 10000),
+        ("grpc.keepalive_permit_without_calls", 1),
+        ("grpc.http2.max_pings_without_data", 0),
+    ], **kwargs)
+
+class GeminiClient:
+    """Long-lived Gemini client: one model handle per generation profile over one persistent connection.
+
+    The application creates it at startup (see main.on_startup), warms it up and
+    installs it with set_gemini_client. ``models`` maps profile names to ready
+    model objects instead, e.g. a local fake in tests and benchmarks; anything
+    with ``generate_content_async(prompt, stream=...)`` works.
+    """
 
-        # Create the model
+    def __init__(self, api_key=GEMINI_API_KEY, model_name=GEMINI_MODEL, models=None):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.models = dict(models or {})
+        self._injected = models is not None  # Ready models answer for every model name
+        self._transport_client = None
+
+    def model(self, profile="summary", model_name=None):
+        """Return the handle for ``profile`` on ``model_name`` (the primary model by default)."""
+        if self._injected:
+            return self.models[profile]
+        model_name = model_name or self.model_name
+        key = profile if model_name == self.model_name else f"{profile}:{model_name}"
+        if key not in self.models:
+            self.models[key] = self._build_model(profile, model_name)
+        return self.models[key]
+
+    def _build_model(self, profile, model_name):
+        import google.generativeai as genai
+        from google.ai import generativelanguage_v1beta as glm
+        from google.ai.generativelanguage_v1beta.services.generative_service.transports import GenerativeServiceGrpcAsyncIOTransport
+        from google.generativeai.types import GenerationConfig
+
+        if self._transport_client is None:
+            # The async gRPC client is bound to the running event loop, so it is built on first use
+            genai.configure(api_key=self.api_key)
+            self._transport_client = glm.GenerativeServiceAsyncClient(
+                client_options={"api_key": self.api_key},
+                transport=functools.partial(GenerativeServiceGrpcAsyncIOTransport, channel=_keepalive_channel),
+            )
         model = genai.GenerativeModel(
-            model_name="gemini-1.5-flash",
-            generation_config=generation_config,
+            model_name=model_name,
+            generation_config=GenerationConfig(**GENERATION_PROFILES[profile]),
         )
+        # Share one connection between the profiles instead of the SDK's per-process default client.
+        # _async_client is private SDK state, requirements.txt pins the version this was checked against.
+        model._async_client = self._transport_client
+        return model
+
+    async def start(self, warm_up=GEMINI_WARM_UP):
+        """Build the model handles and open the connection before the first summary needs it."""
+        if not self.models:
+            # Import the SDK on a worker thread, the event loop keeps handling updates meanwhile
+            await asyncio.to_thread(importlib.import_module, "google.generativeai")
+        for profile in GENERATION_PROFILES:
+            self.model(profile)
+        if not warm_up:
+            return
+        started = time.perf_counter()
+        try:
+            # Counting tokens opens the connection (DNS, TLS, HTTP/2) without using generation quota
+            await asyncio.wait_for(self.model("summary").count_tokens_async("ping"), GEMINI_TIMEOUT)
+            logging.info(f"Gemini client warmed up in {time.perf_counter() - started:.2f} seconds.")
+        except Exception as e:
+            logging.warning(f"Gemini warm-up failed, the first call will connect instead: {str(e)}")
+
+    async def close(self):
+        if self._transport_client is not None:
+            await self._transport_client.transport.close()
+            self._transport_client = None
+        self.models.clear()
+
+    async def generate(self, prompt, profile="summary", stream=False, model_name=None):
+        return await self.model(profile, model_name).generate_content_async(prompt, stream=stream)
+
+_gemini_client = None
+
+def set_gemini_client(client):
+    """Install the client every Gemini call goes through. Returns the previous one."""
+    global _gemini_client
+    previous, _gemini_client = _gemini_client, client
+    return previous
+
+def get_gemini_client():
+    global _gemini_client
+    if _gemini_client is None:
+        # Scripts and tools that never started the application get a lazily connected client
+        _gemini_client = GeminiClient()
+    return _gemini_client
+
+# Primary model first, then the fallbacks for calls it doesn't answer in time
+MODEL_CHAIN = [GEMINI_MODEL] + [name for name in GEMINI_FALLBACK_MODELS if name != GEMINI_MODEL]
+
+# Latencies of recent first-attempt successes per profile, the hedging delay is their percentile
+_latencies = defaultdict(LatencyTracker)
+
+async def get_gemini_summary(message_block: str, timeout: float = GEMINI_TIMEOUT) -> SummaryResult:
+    """Summarize a message block without blocking the event loop."""
+    # Replace thread IDs with names in the message block before building the prompt
+    prompt = build_prompt(message_block)
+    return await generate_result(prompt, timeout, profile="mention")
+
+async def generate_text(prompt: str, timeout: float = GEMINI_TIMEOUT, profile: str = "summary") -> str:
+    """Like generate_result, but return the text and raise GeminiError when the call failed."""
+    result = await generate_result(prompt, timeout, profile)
+    if not result.ok:
+        raise GeminiError(result) from result.error
+    return result.text
+
+async def generate_result(prompt: str, timeout: float = GEMINI_TIMEOUT, profile: str = "summary") -> SummaryResult:
+    """Send a ready-made prompt to Gemini and return a SummaryResult with the response text.
+
+    Calls are admitted by gemini_scheduler: at most GEMINI_MAX_CONCURRENCY run at
+    once and the rest wait in priority order (see rate_limiter.request_context)
+    until the per-minute quota allows them. Once admitted the call gets ``timeout``
+    seconds across retries and the MODEL_CHAIN fallbacks, see resilience.call_with_fallback.
+    With GEMINI_HEDGE a second request is sent when the first one takes longer than
+    usual for the profile. Only cancelling the calling task raises.
+    ``profile`` picks the generation settings, see GENERATION_PROFILES.
+    """
+    started = time.perf_counter()
+    tokens = estimate_tokens(prompt)
+    client = get_gemini_client()
+
+    async def call(model_name):
+        return await client.generate(prompt, profile, model_name=model_name)
+
+    async def hedge_call(model_name):
+        # The hedge is a request of its own against the quota
+        async with gemini_scheduler.slot(tokens):
+            return await call(model_name)
+
+    def can_hedge():
+        # The first request keeps its slot, so a hedge needs a second one free right now;
+        # with GEMINI_MAX_CONCURRENCY=1 calls are never hedged
+        return gemini_scheduler.can_admit_now(tokens)
+
+    async with gemini_scheduler.slot(tokens):
+        # Log the request before sending it
+        request_id = log_request(prompt)  # Archive the full request
+        logging.info(f"Sending request {request_id} to Gemini API ({len(prompt)} characters).")
+
+        hedge_delay = _latencies[profile].percentile(GEMINI_HEDGE_PERCENTILE) if GEMINI_HEDGE else None
+        response, result = await call_with_fallback(call, MODEL_CHAIN, timeout, hedge_delay, hedge_call, can_hedge,
+                                                    latencies=_latencies[profile])
+
+    if result.ok:
+        try:
+            # The SDK raises ValueError here when the answer was blocked or has no candidates
+            result.text = response.text if response else ""
+        except Exception as e:
+            result.error = e
+
+    if not result.ok:
+        _observe_call("generate", "timeout" if result.timed_out else "error", started, prompt)
+        logging.error(f"Gemini API call failed after {result.attempts} attempts: {result.error!r}")
+        return result
+
+    _observe_call("generate", "ok", started, prompt, result.text)
+    if result.text:
+        # Log the final response after receiving it
+        log_response(request_id, result.text)  # Archive the full response
+        logging.info(f"Response to request {request_id} received from {result.model} "
+                     f"({len(result.text)} characters, {result.attempts} attempts).")
+    else:
+        logging.warning("No response from the Gemini API.")
+    return result
+
+async def stream_text(prompt: str, timeout: float = GEMINI_TIMEOUT, profile: str = "summary"):
+    """Send a ready-made prompt to Gemini and yield the response text as it is generated.
+
+    Holds one of gemini_scheduler's slots until the stream is finished. Opening the
+    stream is retried and falls back through MODEL_CHAIN like generate_result; once
+    text was yielded a failure is final. The whole stream is cancelled after
+    ``timeout`` seconds (asyncio.TimeoutError), other failures raise GeminiError.
+    """
+    started = time.perf_counter()
+    async with gemini_scheduler.slot(estimate_tokens(prompt)):
+        request_id = log_request(prompt)  # Archive the full request
+        logging.info(f"Streaming request {request_id} to Gemini API ({len(prompt)} characters).")
+        deadline = asyncio.get_running_loop().time() + timeout
+        parts = []
+        result = None
+        try:
+            client = get_gemini_client()
+            response, result = await call_with_fallback(
+                lambda model_name: client.generate(prompt, profile, stream=True, model_name=model_name),
+                MODEL_CHAIN, timeout)
+            if not result.ok:
+                raise result.error if result.timed_out else GeminiError(result)
+            chunks = response.__aiter__()
+            while True:
+                remaining = deadline - asyncio.get_running_loop().time()
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(remaining, 0))
+                except StopAsyncIteration:
+                    break
+                if chunk.text:
+                    parts.append(chunk.text)
+                    yield chunk.text
+        except asyncio.TimeoutError:
+            _observe_call("stream", "timeout", started, prompt)
+            logging.error(f"Gemini API stream timed out after {timeout} seconds.")
+            raise
+        except Exception as e:
+            _observe_call("stream", "error", started, prompt)
+            logging.error(f"Error in Gemini API stream: {str(e)}")
+            if isinstance(e, GeminiError):
+                raise
+            # Broke off after the stream was opened, e.g. the connection dropped
+            raise GeminiError(SummaryResult(error=e, model=result.model if result else None,
+                                            attempts=result.attempts if result else 0)) from e
+        finally:
+            log_response(request_id, "".join(parts))  # Archive whatever was received
 
-        # Start a conversation and send the prompt
-        chat_session = model.start_chat()
-
-        # Send the message (request)
-        response = chat_session.send_message(f"{prompt}")
-
-        if response:
-            # Log the final response after receiving it
-            log_response(response.text)  # Log the response to a separate file
-            logging.info("Response received from Gemini API.")
-            return response.text
-        else:
-            logging.warning("No response from the Gemini API.")
-            return "No response from the Gemini API."
-    except Exception as e:
-        logging.error(f"Error in Gemini API call: {str(e)}")
-        return "An error occurred while calling the Gemini API."
+    _observe_call("stream", "ok", started, prompt, "".join(parts))
+    logging.info(f"Stream for request {request_id} finished ({sum(map(len, parts))} characters).")
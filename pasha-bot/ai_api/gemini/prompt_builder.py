@@ -1,22 +1,84 @@
-from utils.formaters.message_formatter import replace_thread_ids_with_names
+import io
+from utils.formaters.message_formatter import write_messages
+
+# Bump whenever the prompt text or the summary of a window changes so cached summaries built before are not reused
+PROMPT_VERSION = 4
+
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the following conversations grouped by thread (sub-chats). "
+    "Sort the threads by the volume of messages, from the most to the least active. "
+    "For each thread, extract key points, insights, or decisions in the conversation, ensuring the summary is concise and focused.\n\n"
+    "Format the summary as follows for each thread:\n\n"
+    "[thread name]\n"
+    "Summary of the thread.\n\n"
+    "Ensure there is an empty line between each thread block. Threads with no significant points should be omitted entirely.\n\n"
+    "Make sure to summarize in Russian, without using any formatting like bold, italics, or headers. "
+    "Keep it simple and focused. Ensure that all threads with substantial information are included in the summary.\n\n"
+    "Here is the data to summarize:\n\n"
+)
 
 def build_prompt(message_block):
-    # Replace thread IDs with names in the message block before building the prompt
-    message_block = replace_thread_ids_with_names(message_block)
+    # Create the final prompt for the Gemini API from an already formatted message block
+    return SUMMARY_INSTRUCTIONS + message_block
+
+def build_summary_prompt(messages, thread_summaries=None):
+    """Build the summary prompt straight from message rows.
+
+    The rows are streamed once into a single buffer behind the instructions,
+    with thread names resolved while writing, so no step re-scans the text.
+    """
+    buffer = io.StringIO()
+    buffer.write(SUMMARY_INSTRUCTIONS)
+    write_messages(buffer, messages, thread_summaries)
+    return buffer.getvalue()
+
+def build_topic_prompt(topic, messages):
+    """Build the prompt for summarizing what a chat said about ``topic``.
+
+    ``messages`` are the rows matching the topic plus the messages around them.
+    """
+    buffer = io.StringIO()
+    buffer.write(
+        f"Below are excerpts from a group chat, grouped by thread (sub-chats), that mention \"{topic}\". "
+        "Summarize what was said about this topic: opinions, facts, questions, and decisions. "
+        "Ignore parts of the excerpts that are not related to the topic. "
+        "If the excerpts say nothing meaningful about it, say so in one sentence.\n\n"
+        "Make sure to summarize in Russian, without using any formatting like bold, italics, or headers. "
+        "Mention the thread names where the topic came up.\n\n"
+        "Here are the excerpts:\n\n"
+    )
+    write_messages(buffer, messages)
+    return buffer.getvalue()
 
-    # Create the final prompt for the Gemini API
+def build_rolling_update_prompt(thread_name, previous_summary, message_block):
+    # Prompt for folding newly arrived messages of one thread into its running summary
+    previous = previous_summary if previous_summary else "(no summary yet)"
     prompt = (
-        "Summarize the following conversations grouped by thread ID (sub-chats). "
-        "Sort the threads by the volume of messages, from the most to the least active. "
-        "For each thread, extract key points, insights, or decisions in the conversation, ensuring the summary is concise and focused.\n\n"
+        f"You maintain a running summary of the chat thread \"{thread_name}\". "
+        "Update the current summary with the new messages below. Keep key points, insights and decisions, "
+        "drop small talk, and keep the result under 150 words.\n\n"
+        "Write in Russian, without using any formatting like bold, italics, or headers. "
+        "Return only the updated summary text.\n\n"
+        f"Current summary:\n{previous}\n\n"
+        f"New messages:\n{message_block}"
+    )
+
+    return prompt
+
+def build_reduce_prompt(partial_summaries):
+    # Prompt for merging summaries of separate parts of one chat into the final digest
+    partials_block = "\n\n".join(partial_summaries)
+    prompt = (
+        "Below are summaries of consecutive parts of the same group chat, each grouped by thread. "
+        "Merge them into one summary: combine the entries for the same thread into a single block and drop repetitions. "
+        "Sort the threads by how much was discussed, from the most to the least active.\n\n"
         "Format the summary as follows for each thread:\n\n"
-        "[thread_id]\n"
+        "[thread name]\n"
         "Summary of the thread.\n\n"
         "Ensure there is an empty line between each thread block. Threads with no significant points should be omitted entirely.\n\n"
-        "Make sure to summarize in Russian, without using any formatting like bold, italics, or headers. "
-        "Keep it simple and focused. Ensure that all threads with substantial information are included in the summary.\n\n"
-        "Here is the data to summarize:\n\n"
-        f"{message_block}"  # Use the processed message block
+        "Make sure to summarize in Russian, without using any formatting like bold, italics, or headers.\n\n"
+        "Here are the summaries to merge:\n\n"
+        f"{partials_block}"
     )
 
     return prompt
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import random
+from collections import deque
+from config import (GEMINI_HEDGE_MIN_SAMPLES, GEMINI_MODEL_DEADLINE, GEMINI_RETRIES, GEMINI_RETRY_BASE_DELAY,
+                    GEMINI_RETRY_MAX_DELAY)
+from utils.metrics import GEMINI_ATTEMPTS, GEMINI_HEDGES
+
+# Tail-latency control for Gemini calls. A call is tried on each model of the
+# chain in turn: retryable errors are retried with jittered backoff, a model
+# that doesn't answer within its deadline is given up for the next one, and
+# a hedged second request can race a slow first one. Callers get a
+# SummaryResult instead of an exception or a placeholder text.
+
+logger = logging.getLogger(__name__)
+
+# HTTP status of google.api_core errors worth another try: quota, overload and server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class SummaryResult:
+    """Outcome of a Gemini call: ``text`` on success, the last ``error`` otherwise."""
+
+    def __init__(self, text=None, error=None, model=None, attempts=0, hedged=False):
+        self.text = text
+        self.error = error
+        self.model = model
+        self.attempts = attempts
+        self.hedged = hedged
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def timed_out(self):
+        return isinstance(self.error, asyncio.TimeoutError)
+
+    def __repr__(self):
+        outcome = "ok" if self.ok else f"error={self.error!r}"
+        return f"SummaryResult({outcome}, model={self.model}, attempts={self.attempts}, hedged={self.hedged})"
+
+class GeminiError(Exception):
+    """Raised by api_client.generate_text when a call failed; ``result`` holds the details."""
+
+    def __init__(self, result):
+        super().__init__(str(result.error) or type(result.error).__name__)
+        self.result = result
+
+def is_retryable(error):
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    return getattr(error, "code", None) in RETRYABLE_STATUS_CODES
+
+class LatencyTracker:
+    """Latencies of the last calls that succeeded on their first attempt, for the hedging delay.
+
+    Retries, backoff and fallbacks are left out, they would push the delay up
+    exactly when the service is failing.
+    """
+
+    def __init__(self, size=200, min_samples=GEMINI_HEDGE_MIN_SAMPLES):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+
+    def observe(self, seconds):
+        self._samples.append(seconds)
+
+    def percentile(self, fraction):
+        """Return the given percentile, or None until enough calls were observed."""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+async def hedged(call, delay, timeout, hedge_call=None, can_hedge=None):
+    """Await ``call()``; if it hasn't answered after ``delay`` seconds, race ``hedge_call()`` against it.
+
+    The first successful response wins and the other request is cancelled.
+    ``can_hedge()`` is asked when the delay passed; if it returns False the
+    first request is simply awaited. Returns (response, whether a hedge was
+    sent). Raises the first error if both fail and asyncio.TimeoutError after
+    ``timeout`` seconds.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    pending = {asyncio.ensure_future(call())}
+    errors = []
+    hedge_due, hedge_task = False, None
+    try:
+        while pending:
+            remaining = deadline - loop.time()
+            wait = min(delay, remaining) if not hedge_due else remaining
+            done, pending = await asyncio.wait(pending, timeout=max(wait, 0), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if hedge_task is not None:
+                        GEMINI_HEDGES.inc(winner="hedge" if task is hedge_task else "first")
+                    return task.result(), hedge_task is not None
+                errors.append(task.exception())
+            if not done and not hedge_due and loop.time() < deadline:
+                # The first request is slower than usual: send the same request again
+                hedge_due = True
+                if can_hedge is None or can_hedge():
+                    hedge_task = asyncio.ensure_future((hedge_call or call)())
+                    pending.add(hedge_task)
+            elif not done:
+                raise asyncio.TimeoutError()
+        raise errors[0]
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def call_with_fallback(call, models, timeout, hedge_delay=None, hedge_call=None, can_hedge=None,
+                             latencies=None):
+    """Run ``call(model_name)`` through the model chain ``models`` within ``timeout`` seconds.
+
+    Each model but the last gets at most GEMINI_MODEL_DEADLINE seconds including
+    retries; a timeout moves on to the next model right away. With ``hedge_delay``
+    every attempt is hedged after that many seconds, see hedged(). A call that
+    succeeds on its first, unhedged attempt is observed in the ``latencies``
+    LatencyTracker. Returns (response, SummaryResult); the response is None
+    when every attempt failed.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    attempts, sent_hedge, error = 0, False, None
+
+    for index, model_name in enumerate(models):
+        is_last = index == len(models) - 1
+        model_deadline = deadline if is_last else min(deadline, loop.time() + GEMINI_MODEL_DEADLINE)
+        for retry in range(GEMINI_RETRIES + 1):
+            remaining = model_deadline - loop.time()
+            if remaining <= 0:
+                break
+            attempts += 1
+            attempt_started = loop.time()
+            try:
+                if hedge_delay is not None and hedge_delay < remaining:
+                    response, attempt_hedged = await hedged(
+                        lambda: call(model_name), hedge_delay, remaining,
+                        hedge_call=(lambda: hedge_call(model_name)) if hedge_call else None, can_hedge=can_hedge)
+                    sent_hedge = sent_hedge or attempt_hedged
+                else:
+                    response = await asyncio.wait_for(call(model_name), remaining)
+                GEMINI_ATTEMPTS.inc(model=model_name, outcome="ok")
+                if latencies is not None and attempts == 1 and not sent_hedge:
+                    latencies.observe(loop.time() - attempt_started)
+                return response, SummaryResult(model=model_name, attempts=attempts, hedged=sent_hedge)
+            except asyncio.TimeoutError as e:
+                # Deadline of this model exceeded: fall back instead of retrying
+                error = e
+                GEMINI_ATTEMPTS.inc(model=model_name, outcome="timeout")
+                break
+            except Exception as e:
+                error = e
+                if not is_retryable(e):
+                    # An invalid request fails on every model as well
+                    GEMINI_ATTEMPTS.inc(model=model_name, outcome="error")
+                    return None, SummaryResult(error=e, model=model_name, attempts=attempts, hedged=sent_hedge)
+                GEMINI_ATTEMPTS.inc(model=model_name, outcome="retryable_error")
+                if retry == GEMINI_RETRIES:
+                    break
+                # Full jitter: spread the retries of concurrent calls over the backoff window
+                backoff = random.uniform(0, min(GEMINI_RETRY_MAX_DELAY, GEMINI_RETRY_BASE_DELAY * 2 ** retry))
+                logger.warning(f"Gemini call to {model_name} failed ({str(e)}), retrying in {backoff:.1f} seconds.")
+                await asyncio.sleep(min(backoff, max(model_deadline - loop.time(), 0)))
+
+        if not is_last:
+            logger.warning(f"Gemini model {model_name} gave no answer in time, falling back to {models[index + 1]}.")
+
+    return None, SummaryResult(error=error or asyncio.TimeoutError(), model=models[-1], attempts=attempts, hedged=sent_hedge)
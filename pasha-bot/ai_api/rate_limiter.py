@@ -0,0 +1,206 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from config import (GEMINI_MAX_CONCURRENCY, GEMINI_REQUESTS_PER_MINUTE, GEMINI_TOKENS_PER_MINUTE,
+                    RATE_LIMIT_MAX_USERS)
+
+logger = logging.getLogger(__name__)
+
+# Gemini request priorities, lower values are served first
+PRIORITY_SCHEDULED = 0  # Scheduled digests
+PRIORITY_ON_DEMAND = 1  # "Get summary" requests
+PRIORITY_MENTION = 2  # Replies to mentions in the group
+PRIORITY_BACKGROUND = 3  # Rolling summary updates
+
+BUDGET_WINDOW = 60  # Seconds covered by the per-minute budgets
+
+
+class TokenBucket:
+    """Allows ``capacity`` requests at once, refilled evenly over ``period`` seconds."""
+
+    __slots__ = ("capacity", "refill_rate", "tokens", "updated_at")
+
+    def __init__(self, capacity, period, now):
+        self.capacity = capacity
+        self.refill_rate = capacity / period
+        self.tokens = capacity
+        self.updated_at = now
+
+    def try_consume(self, now) -> bool:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class UserRateLimiter:
+    """Per-user token buckets; only the ``max_users`` most recently seen users are kept."""
+
+    def __init__(self, capacity, period, max_users=RATE_LIMIT_MAX_USERS, clock=time.monotonic):
+        self.capacity = capacity
+        self.period = period
+        self.max_users = max_users
+        self.clock = clock
+        self._buckets = OrderedDict()
+
+    def allow(self, user_id) -> bool:
+        now = self.clock()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.capacity, self.period, now)
+            # A dropped user starts over with a full bucket, which is the state it would have refilled to
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+        return bucket.try_consume(now)
+
+
+class RequestContext:
+    """Priority and queue notification for the Gemini calls made inside request_context()."""
+
+    def __init__(self, priority, on_queued=None):
+        self.priority = priority
+        self.on_queued = on_queued
+        self.notified = False
+
+_request_context = contextvars.ContextVar("gemini_request_context", default=None)
+
+@contextmanager
+def request_context(priority, on_queued=None):
+    """Run the enclosed Gemini calls with ``priority``.
+
+    ``on_queued`` is awaited with the queue position the first time one of the
+    calls has to wait, e.g. to tell the user where their request stands.
+    """
+    token = _request_context.set(RequestContext(priority, on_queued))
+    try:
+        yield
+    finally:
+        _request_context.reset(token)
+
+
+class GeminiScheduler:
+    """Admits Gemini calls in priority order within the concurrency and per-minute budgets.
+
+    Calls wait in a priority queue (FIFO within a priority) until a slot is
+    free and both the requests-per-minute and tokens-per-minute budgets of the
+    shared API quota allow another call.
+    """
+
+    def __init__(self, max_concurrency=GEMINI_MAX_CONCURRENCY, requests_per_minute=GEMINI_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=GEMINI_TOKENS_PER_MINUTE, clock=time.monotonic):
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.clock = clock
+
+        self.in_flight = 0
+        self._waiters = []  # Heap of (priority, sequence, tokens, future)
+        self._sequence = itertools.count()
+        self._admitted = deque()  # (time, tokens) admitted within the budget window
+        self._admitted_tokens = 0
+        self._wakeup = None
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for *_, future in self._waiters if not future.done())
+
+    @asynccontextmanager
+    async def slot(self, tokens):
+        await self.acquire(tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, tokens):
+        context = _request_context.get() or RequestContext(PRIORITY_ON_DEMAND)
+        if not self._waiters and self._can_admit(tokens):
+            self._admit(tokens)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (context.priority, next(self._sequence), tokens, future)
+        heapq.heappush(self._waiters, entry)
+        self._dispatch()
+
+        if not future.done() and context.on_queued is not None and not context.notified:
+            context.notified = True
+            try:
+                await context.on_queued(self._position(entry))
+            except Exception as e:
+                logger.error(f"Failed to report the queue position: {str(e)}")
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just before the cancellation arrived, give the slot back
+                self.release()
+            else:
+                self._dispatch()
+            raise
+
+    def set_quota(self, requests_per_minute, tokens_per_minute):
+        """Change the per-minute budgets, e.g. a summary worker's share of the API quota."""
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._dispatch()
+
+    def can_admit_now(self, tokens) -> bool:
+        """Whether a call of ``tokens`` would be admitted right away, without queueing."""
+        return not self.queue_depth and self._can_admit(tokens)
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _position(self, entry) -> int:
+        return 1 + sum(1 for waiter in self._waiters if waiter[:2] < entry[:2] and not waiter[3].done())
+
+    def _expire(self, now):
+        while self._admitted and now - self._admitted[0][0] >= BUDGET_WINDOW:
+            self._admitted_tokens -= self._admitted.popleft()[1]
+
+    def _can_admit(self, tokens) -> bool:
+        if self.in_flight >= self.max_concurrency:
+            return False
+        self._expire(self.clock())
+        if len(self._admitted) >= self.requests_per_minute:
+            return False
+        # A prompt bigger than the whole budget is let through once the window is empty
+        return not self._admitted or self._admitted_tokens + tokens <= self.tokens_per_minute
+
+    def _admit(self, tokens):
+        self.in_flight += 1
+        self._admitted.append((self.clock(), tokens))
+        self._admitted_tokens += tokens
+
+    def _dispatch(self):
+        while self._waiters:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)  # Cancelled while waiting
+                continue
+            if not self._can_admit(tokens):
+                break
+            heapq.heappop(self._waiters)
+            self._admit(tokens)
+            future.set_result(None)
+
+        # Blocked by the per-minute budget: retry when the oldest admission leaves the window
+        if self._waiters and self.in_flight < self.max_concurrency and self._admitted and self._wakeup is None:
+            delay = max(BUDGET_WINDOW - (self.clock() - self._admitted[0][0]), 0)
+            self._wakeup = asyncio.get_running_loop().call_later(delay, self._on_wakeup)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
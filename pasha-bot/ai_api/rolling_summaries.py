@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from collections import Counter
+from ai_api.compaction import compact_messages
+from ai_api.gemini.api_client import generate_text
+from ai_api.gemini.prompt_builder import build_rolling_update_prompt
+from ai_api.rate_limiter import PRIORITY_BACKGROUND, request_context
+from config import DIGEST_MAX_MESSAGES, ROLLING_SUMMARY_MAX_DELTA, ROLLING_SUMMARY_THRESHOLD
+from db.chat_store import load_digest_chats
+from db.fetchers import (count_thread_messages_after, fetch_active_thread_ids, fetch_last_message_id,
+                         fetch_thread_messages_after)
+from db.thread_summary_store import load_thread_summaries, reset_thread_summaries, save_thread_summary
+from db.watermark_store import load_watermark
+from utils.formaters.message_formatter import format_messages
+from utils.mappers.thread_name_mappings import get_thread_name
+from utils.metrics import ERRORS
+
+# Incremental summarization: every active thread of a digest chat keeps a rolling
+# summary that is updated in small deltas once enough new messages arrived.
+# Digests and on-demand summaries then send the stored summaries plus the
+# unsummarized tail instead of the whole raw window.
+
+logger = logging.getLogger(__name__)
+
+def rolling_thread_ids(chat_id, summary_thread_id, states):
+    """Threads to keep summaries for: the tracked ones plus those active since the last digest."""
+    # Bounded like a digest: at most the chat's last DIGEST_MAX_MESSAGES rows are scanned
+    watermark = load_watermark(chat_id)
+    after_id = max(fetch_last_message_id(chat_id, DIGEST_MAX_MESSAGES), watermark[0] if watermark else 0)
+    thread_ids = set(states) | set(fetch_active_thread_ids(chat_id, after_id))
+    thread_ids.discard(summary_thread_id)
+    return sorted(thread_ids)
+
+async def update_thread_summary(chat_id, thread_id, summary, first_id, last_id) -> bool:
+    """Fold the messages after ``last_id`` into the thread's summary once there are enough of them."""
+    pending = count_thread_messages_after(chat_id, thread_id, last_id)
+    if pending < ROLLING_SUMMARY_THRESHOLD:
+        return False
+
+    messages = fetch_thread_messages_after(chat_id, thread_id, last_id, ROLLING_SUMMARY_MAX_DELTA)
+    # format_messages expects the newest message first, like the other fetchers return them
+    compacted, _ = compact_messages(messages[::-1])
+    if not compacted:
+        # Only noise, e.g. stickers and "+1": move past it without a Gemini call
+        save_thread_summary(chat_id, thread_id, summary, first_id, messages[-1][0])
+        logger.info(f"Skipped {len(messages)} messages of thread {thread_id} that compacted to nothing.")
+        return False
+
+    prompt = build_rolling_update_prompt(get_thread_name(thread_id), summary, format_messages(compacted))
+    updated_summary = await generate_text(prompt, profile="rolling")
+    if not updated_summary:
+        logger.warning(f"Empty rolling summary update for thread {thread_id}, keeping the previous one.")
+        return False
+
+    save_thread_summary(chat_id, thread_id, updated_summary.strip(), first_id or messages[0][0], messages[-1][0])
+    logger.info(f"Updated rolling summary of thread {thread_id} with {len(messages)} messages ({pending} pending).")
+    return True
+
+async def update_rolling_summaries(context=None):
+    """Job callback: update every thread whose unsummarized tail passed the threshold."""
+    updates = []
+    for chat_id, summary_thread_id in load_digest_chats():
+        states = load_thread_summaries(chat_id)
+        for thread_id in rolling_thread_ids(chat_id, summary_thread_id, states):
+            if thread_id not in states:
+                # Start tracking the thread from the chat's newest message
+                save_thread_summary(chat_id, thread_id, "", None, fetch_last_message_id(chat_id))
+                continue
+            updates.append(update_thread_summary(chat_id, thread_id, *states[thread_id]))
+
+    # Background work: digests and user requests go first when the Gemini quota is tight
+    with request_context(PRIORITY_BACKGROUND):
+        results = await asyncio.gather(*updates, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            ERRORS.inc(source="rolling_summary")
+            logger.error(f"Failed to update a rolling summary: {str(result)}")
+
+def apply_thread_summaries(chat_id, messages):
+    """Replace the rows a stored summary already covers with that summary.
+
+    A summary is only used when its whole range lies inside the fetched window.
+    Returns the remaining rows and {thread_id: (summary, covered_count)} for
+    format_messages.
+    """
+    if not messages:
+        return messages, {}
+
+    ids = [row[0] for row in messages]
+    window_start, window_end = min(ids), max(ids)
+    usable = {
+        thread_id: (summary, first_id, last_id)
+        for thread_id, (summary, first_id, last_id) in load_thread_summaries(chat_id).items()
+        if summary and first_id is not None and window_start <= first_id and last_id <= window_end
+    }
+    if not usable:
+        return messages, {}
+
+    remaining = []
+    covered = Counter()
+    for row in messages:
+        row_id, thread_id = row[0], row[1]
+        if thread_id in usable and usable[thread_id][1] <= row_id <= usable[thread_id][2]:
+            covered[thread_id] += 1
+        else:
+            remaining.append(row)
+
+    logger.info(f"Replaced {sum(covered.values())} messages with {len(usable)} rolling thread summaries.")
+    return remaining, {thread_id: (usable[thread_id][0], covered[thread_id]) for thread_id in usable}
+
+def consume_thread_summaries(chat_id, messages):
+    """Start the rolling summaries over after a digest covered ``messages``."""
+    consumed_ids = {}
+    for row_id, thread_id, *_ in messages:
+        consumed_ids[thread_id] = max(row_id, consumed_ids.get(thread_id, 0))
+    reset_thread_summaries(chat_id, consumed_ids)
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+from ai_api.compaction import compact_messages
+from ai_api.gemini.api_client import generate_text, stream_text
+from ai_api.gemini.prompt_builder import build_reduce_prompt, build_summary_prompt, build_topic_prompt
+from config import MAP_REDUCE_CHUNK_TOKENS, MAP_REDUCE_CONCURRENCY
+from utils.mappers.thread_name_mappings import get_thread_name
+from utils.metrics import SUMMARY_STAGE_SECONDS
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Tokens for the "  - username: " prefix and line break around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def _message_tokens(row) -> int:
+    _, _, username, _, message_content = row
+    return estimate_tokens(username or "") + estimate_tokens(message_content or "") + MESSAGE_OVERHEAD_TOKENS
+
+def chunk_messages(messages, token_budget=MAP_REDUCE_CHUNK_TOKENS):
+    """Split rows into chunks of about ``token_budget`` estimated tokens along thread boundaries.
+
+    Threads are kept whole when they fit into a chunk; a thread larger than the
+    budget is cut into consecutive pieces.
+    """
+    threads = {}
+    for row in messages:
+        threads.setdefault(row[1], []).append(row)
+
+    chunks = []
+    current, current_tokens = [], 0
+    for rows in threads.values():
+        if current and current_tokens + sum(map(_message_tokens, rows)) > token_budget:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        for row in rows:
+            row_tokens = _message_tokens(row)
+            if current and current_tokens + row_tokens > token_budget:
+                chunks.append(current)
+                current, current_tokens = [], 0
+            current.append(row)
+            current_tokens += row_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _pack_partials(partials, token_budget):
+    """Group partial summaries so that each group fits into one reduce prompt."""
+    groups = []
+    current, current_tokens = [], 0
+    for partial in partials:
+        partial_tokens = estimate_tokens(partial)
+        if current and current_tokens + partial_tokens > token_budget:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(partial)
+        current_tokens += partial_tokens
+    if current:
+        groups.append(current)
+    return groups
+
+async def summarize_window(messages, thread_summaries=None):
+    """Summarize fetched rows, switching to map-reduce when they don't fit into one prompt.
+
+    ``thread_summaries`` are the rolling summaries returned by apply_thread_summaries.
+    Returns None without calling Gemini when every row is noise and no summary is reused.
+    """
+    thread_summaries = thread_summaries or {}
+    messages = _compact(messages)
+    if not messages and not thread_summaries:
+        return None
+    if _fits_single_prompt(messages):
+        return await generate_text(_timed_summary_prompt(messages, thread_summaries))
+
+    return await summarize_map_reduce(messages, thread_summaries)
+
+async def stream_window(messages, thread_summaries=None):
+    """Like summarize_window, but yield the final summary text as Gemini generates it.
+
+    For map-reduce only the final merge is streamed, the chunk summaries are awaited first.
+    Yields nothing when there is nothing to summarize, see summarize_window.
+    """
+    thread_summaries = thread_summaries or {}
+    messages = _compact(messages)
+    if not messages and not thread_summaries:
+        return
+    if _fits_single_prompt(messages):
+        prompt = _timed_summary_prompt(messages, thread_summaries)
+    else:
+        partials = await map_partial_summaries(messages, thread_summaries)
+        if len(partials) <= 1:
+            yield partials[0] if partials else ""
+            return
+        prompt = build_reduce_prompt(partials)
+
+    async for text in stream_text(prompt):
+        yield text
+
+async def summarize_topic(topic, messages) -> str:
+    """Summarize what the fetched rows say about ``topic``, see db.fetchers.fetch_topic_messages.
+
+    The rows are bounded by TOPIC_MAX_MATCHES and their context, so one prompt always fits.
+    Returns None without calling Gemini when every row is noise.
+    """
+    messages = _compact(messages)
+    if not messages:
+        return None
+    with SUMMARY_STAGE_SECONDS.time(stage="prompt"):
+        prompt = build_topic_prompt(topic, messages)
+    return await generate_text(prompt)
+
+def _compact(messages):
+    # Drop noise before the size check, so compacted windows more often fit one prompt
+    with SUMMARY_STAGE_SECONDS.time(stage="compact"):
+        return compact_messages(messages)[0]
+
+def _timed_summary_prompt(messages, thread_summaries=None) -> str:
+    # Formatting, thread names and instructions are built in one pass, timed as one stage
+    with SUMMARY_STAGE_SECONDS.time(stage="prompt"):
+        return build_summary_prompt(messages, thread_summaries)
+
+def _fits_single_prompt(messages) -> bool:
+    return sum(map(_message_tokens, messages)) <= MAP_REDUCE_CHUNK_TOKENS
+
+async def summarize_map_reduce(messages, thread_summaries=None, token_budget=MAP_REDUCE_CHUNK_TOKENS) -> str:
+    """Summarize token-budgeted chunks concurrently, then merge the partial summaries."""
+    partials = await map_partial_summaries(messages, thread_summaries, token_budget)
+    if len(partials) <= 1:
+        return partials[0] if partials else ""
+    return await generate_text(build_reduce_prompt(partials))
+
+async def map_partial_summaries(messages, thread_summaries=None, token_budget=MAP_REDUCE_CHUNK_TOKENS) -> list:
+    """Summarize the chunks concurrently and merge partials until they fit into one reduce prompt."""
+    thread_summaries = thread_summaries or {}
+    chunks = chunk_messages(messages, token_budget)
+    semaphore = asyncio.Semaphore(MAP_REDUCE_CONCURRENCY)
+    logger.info(f"Map-reduce summary of {len(messages)} messages in {len(chunks)} chunks.")
+
+    async def summarize_chunk(chunk):
+        async with semaphore:
+            return await generate_text(_timed_summary_prompt(chunk))
+
+    partials = [partial for partial in await asyncio.gather(*map(summarize_chunk, chunks)) if partial]
+    # Rolling summaries already are per-thread summaries, they only need merging
+    partials += [f"{get_thread_name(thread_id)}\n{summary}" for thread_id, (summary, _) in thread_summaries.items()]
+
+    async def reduce_group(group):
+        async with semaphore:
+            return await generate_text(build_reduce_prompt(group))
+
+    # Reduce in rounds until the partials fit into the final merge
+    while len(partials) > 1:
+        groups = _pack_partials(partials, token_budget)
+        if len(groups) == 1 or len(groups) == len(partials):
+            # Everything fits, or no group can be merged further
+            break
+        logger.info(f"Reducing {len(partials)} partial summaries in {len(groups)} groups.")
+        partials = [partial for partial in await asyncio.gather(*map(reduce_group, groups)) if partial]
+
+    return partials
@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from ai_api.gemini.prompt_builder import PROMPT_VERSION
+from config import SUMMARY_CACHE_PERSIST, SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL
+from db.summary_cache_store import delete_expired_summaries, load_cached_summary, store_cached_summary
+
+logger = logging.getLogger(__name__)
+
+
+def message_window_fingerprint(messages, chat_id=None, topic=None) -> str:
+    """Identify a window of fetched rows by its id bounds, size and the prompt version.
+
+    Topic summaries also include the topic, their prompt differs for the same rows.
+    """
+    ids = [row[0] for row in messages]
+    raw = f"{chat_id}:{min(ids)}:{max(ids)}:{len(ids)}:{PROMPT_VERSION}"
+    if topic is not None:
+        raw += f":topic:{topic}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """LRU + TTL cache of summaries with single-flight request coalescing.
+
+    Concurrent requests for the same key share one in-flight call. Entries can
+    also be written through to SQLite so they survive restarts.
+    """
+
+    def __init__(self, max_entries=SUMMARY_CACHE_SIZE, ttl=SUMMARY_CACHE_TTL, persist=SUMMARY_CACHE_PERSIST,
+                 clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist = persist
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (summary, created_at)
+        self._in_flight = {}  # key -> asyncio.Future
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "in_flight": len(self._in_flight),
+        }
+
+    async def get(self, key):
+        """Return the cached summary for ``key`` or None, counting the hit or miss."""
+        summary = await self._lookup(key)
+        if summary is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return summary
+
+    async def put(self, key, summary):
+        """Remember a summary that was produced outside get_or_create, e.g. streamed."""
+        if summary:
+            await self._store(key, summary)
+
+    async def get_or_create(self, key, factory):
+        """Return the cached summary for ``key`` or await ``factory()`` to produce it."""
+        summary = await self._lookup(key)
+        if summary is not None:
+            self.hits += 1
+            logger.info(f"Summary cache hit for {key}.")
+            return summary
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            logger.info(f"Joining in-flight summary for {key}.")
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            summary = await factory()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # Mark as retrieved when nobody else is waiting
+            raise
+        else:
+            future.set_result(summary)
+            # Empty summaries are failures, don't remember them
+            if summary:
+                await self._store(key, summary)
+            return summary
+        finally:
+            del self._in_flight[key]
+
+    async def _lookup(self, key):
+        now = self.clock()
+        entry = self._entries.get(key)
+        if entry is not None:
+            summary, created_at = entry
+            if now - created_at < self.ttl:
+                self._entries.move_to_end(key)
+                return summary
+            del self._entries[key]
+
+        if self.persist:
+            row = await asyncio.to_thread(load_cached_summary, key, int(now - self.ttl))
+            if row is not None:
+                self._remember(key, *row)
+                return row[0]
+        return None
+
+    async def _store(self, key, summary):
+        created_at = int(self.clock())
+        self._remember(key, summary, created_at)
+        if self.persist:
+            try:
+                await asyncio.to_thread(self._write_through, key, summary, created_at)
+            except Exception as e:
+                logger.error(f"Failed to persist cached summary: {str(e)}")
+
+    def _write_through(self, key, summary, created_at):
+        store_cached_summary(key, summary, created_at)
+        delete_expired_summaries(created_at - self.ttl)
+
+    def _remember(self, key, summary, created_at):
+        self._entries[key] = (summary, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+# Shared cache for on-demand summaries
+summary_cache = SummaryCache()
+
+def get_cache_stats() -> dict:
+    return summary_cache.stats()
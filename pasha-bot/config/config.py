@@ -6,4 +6,119 @@ load_dotenv()
 TG_TOKEN = os.getenv("TG_TOKEN")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 DB_PATH = os.getenv("DB_PATH")
-DAILY_SUMMARY_CHAT_ID = "-1002261651604"
+DAILY_SUMMARY_CHAT_ID = "-1002261651604"  # Seeds the chats table and serves private "Get summary" requests
+DAILY_SUMMARY_THREAD_ID = 20284  # Summary thread of DAILY_SUMMARY_CHAT_ID
+
+# Message ingestion (write-behind queue flushed by a dedicated writer thread)
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "200"))  # Max messages per transaction
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "0.5"))  # Max seconds a message waits in the queue
+INGEST_MAX_QUEUE_SIZE = int(os.getenv("INGEST_MAX_QUEUE_SIZE", "0"))  # 0 means unbounded
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+# Gemini API calls
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+GEMINI_WARM_UP = os.getenv("GEMINI_WARM_UP", "true").lower() == "true"  # Open the connection at startup
+GEMINI_KEEPALIVE_SECONDS = float(os.getenv("GEMINI_KEEPALIVE_SECONDS", "30"))  # Keep-alive pings on an idle connection
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))  # Summaries in flight at once
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "90"))  # Seconds before a call is cancelled
+GEMINI_REQUESTS_PER_MINUTE = int(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "15"))  # Shared API quota
+GEMINI_TOKENS_PER_MINUTE = int(os.getenv("GEMINI_TOKENS_PER_MINUTE", "1000000"))  # Shared API quota (prompt tokens)
+RATE_LIMIT_MAX_USERS = int(os.getenv("RATE_LIMIT_MAX_USERS", "10000"))  # Per-user limiter entries kept in memory
+
+# Gemini tail latency: retries, model fallback and hedged requests, see ai_api/gemini/resilience.py
+GEMINI_FALLBACK_MODELS = [name.strip() for name in os.getenv("GEMINI_FALLBACK_MODELS", "gemini-1.5-flash-8b").split(",") if name.strip()]
+GEMINI_MODEL_DEADLINE = float(os.getenv("GEMINI_MODEL_DEADLINE", "45"))  # Seconds a model gets before falling back to the next
+GEMINI_RETRIES = int(os.getenv("GEMINI_RETRIES", "2"))  # Retries per model on quota, overload and server errors
+GEMINI_RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "1"))  # Backoff before the first retry, doubled per retry
+GEMINI_RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "8"))
+GEMINI_HEDGE = os.getenv("GEMINI_HEDGE", "false").lower() == "true"  # Send a second request when the first one is slow and a slot is free
+GEMINI_HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "0.95"))  # Hedge after this percentile of recent latencies
+GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20"))  # Calls observed before hedging starts
+
+# Prompt compaction: steps applied to the fetched messages before a prompt is built, see ai_api/compaction.py
+PROMPT_COMPACTION_STEPS = [step.strip() for step in os.getenv(
+    "PROMPT_COMPACTION_STEPS", "exclude_bots,drop_noise,truncate,dedup,merge_consecutive").split(",") if step.strip()]
+COMPACTION_MAX_MESSAGE_CHARS = int(os.getenv("COMPACTION_MAX_MESSAGE_CHARS", "1500"))  # Longer messages are cut
+EXCLUDED_BOTS = ['SummaryProBot', 'NokolayDevBot']  # Never deleted from summary threads and left out of prompts
+
+# Summary cache for repeated requests over the same message window
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "128"))  # Entries kept in memory (LRU)
+SUMMARY_CACHE_TTL = int(os.getenv("SUMMARY_CACHE_TTL", "900"))  # Seconds a summary stays valid
+SUMMARY_CACHE_PERSIST = os.getenv("SUMMARY_CACHE_PERSIST", "true").lower() == "true"  # Keep entries in SQLite across restarts
+
+# Rolling per-thread summaries, updated in the background as messages accumulate
+ROLLING_SUMMARY_INTERVAL = int(os.getenv("ROLLING_SUMMARY_INTERVAL", "600"))  # Seconds between update checks
+ROLLING_SUMMARY_THRESHOLD = int(os.getenv("ROLLING_SUMMARY_THRESHOLD", "50"))  # New messages needed to update a thread
+ROLLING_SUMMARY_MAX_DELTA = int(os.getenv("ROLLING_SUMMARY_MAX_DELTA", "500"))  # Max messages folded in per update
+
+# Map-reduce summarization for windows too large for a single prompt
+MAP_REDUCE_CHUNK_TOKENS = int(os.getenv("MAP_REDUCE_CHUNK_TOKENS", "24000"))  # Estimated prompt tokens per chunk
+MAP_REDUCE_CONCURRENCY = int(os.getenv("MAP_REDUCE_CONCURRENCY", "4"))  # Chunks summarized in parallel per request
+
+# Logging (all handlers run on a background listener thread)
+LOG_FOLDER = os.getenv("LOG_FOLDER", "log")
+LOG_ARCHIVE_MAX_BYTES = int(os.getenv("LOG_ARCHIVE_MAX_BYTES", str(10 * 1024 * 1024)))  # Rotate the Gemini archive at this size
+LOG_ARCHIVE_BACKUP_COUNT = int(os.getenv("LOG_ARCHIVE_BACKUP_COUNT", "20"))  # Compressed archive files to keep
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))  # Longer log messages are truncated
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1.0"))  # Share of message/prompt log lines kept
+
+# Streaming delivery of on-demand summaries through progressive message edits
+STREAM_SUMMARIES = os.getenv("STREAM_SUMMARIES", "true").lower() == "true"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))  # Min seconds between edits of one message
+
+# Scheduled digests continue from a persisted per-chat watermark (last summarized row id)
+DIGEST_MAX_MESSAGES = int(os.getenv("DIGEST_MAX_MESSAGES", "10000"))  # Max messages per digest, the rest go in the next one
+DIGEST_CATCH_UP_DELAY = int(os.getenv("DIGEST_CATCH_UP_DELAY", "60"))  # Seconds after startup to send a digest missed during downtime
+DIGEST_CONCURRENCY = int(os.getenv("DIGEST_CONCURRENCY", "4"))  # Chats whose digest is prepared at once
+DIGEST_CHAT_TIMEOUT = float(os.getenv("DIGEST_CHAT_TIMEOUT", "600"))  # Seconds before one chat's digest is given up
+
+# Adaptive digests: the scheduled times stay, but a large backlog is digested early and a small one waits
+DIGEST_ADAPTIVE = os.getenv("DIGEST_ADAPTIVE", "false").lower() == "true"
+DIGEST_EARLY_MESSAGES = int(os.getenv("DIGEST_EARLY_MESSAGES", "2000"))  # Backlog that triggers a digest before the next scheduled time
+DIGEST_EARLY_TOKENS = int(os.getenv("DIGEST_EARLY_TOKENS", "24000"))  # Same, in estimated prompt tokens
+DIGEST_MIN_MESSAGES = int(os.getenv("DIGEST_MIN_MESSAGES", "30"))  # Smaller backlogs skip a scheduled time and go into the next digest
+DIGEST_MAX_SKIP = int(os.getenv("DIGEST_MAX_SKIP", "86400"))  # Seconds after the last digest when a small backlog is sent anyway
+DIGEST_BACKLOG_CHECK_INTERVAL = int(os.getenv("DIGEST_BACKLOG_CHECK_INTERVAL", "300"))  # Seconds between backlog checks
+
+# Topic summaries: messages matching a search in the full-text index, with the messages around them
+TOPIC_MAX_MATCHES = int(os.getenv("TOPIC_MAX_MATCHES", "50"))  # Most recent matching messages used
+TOPIC_CONTEXT_MESSAGES = int(os.getenv("TOPIC_CONTEXT_MESSAGES", "3"))  # Messages of the same thread before and after each match
+
+# /stats: thread activity answered from the per-hour aggregates, no Gemini call
+STATS_DEFAULT_HOURS = int(os.getenv("STATS_DEFAULT_HOURS", "24"))  # Period when /stats gets no argument
+STATS_MAX_HOURS = int(os.getenv("STATS_MAX_HOURS", str(24 * 30)))
+STATS_TOP_THREADS = int(os.getenv("STATS_TOP_THREADS", "10"))  # Busiest threads listed
+
+# Summary workers: separate processes run the Gemini work from a durable SQLite job queue
+SUMMARY_WORKERS = os.getenv("SUMMARY_WORKERS", "true").lower() == "true"  # false runs summaries in the bot process
+SUMMARY_WORKERS_MIN = int(os.getenv("SUMMARY_WORKERS_MIN", "1"))  # Workers kept running when the queue is empty
+SUMMARY_WORKERS_MAX = int(os.getenv("SUMMARY_WORKERS_MAX", "4"))  # The Gemini quota is split between the running workers
+JOBS_PER_WORKER = int(os.getenv("JOBS_PER_WORKER", "2"))  # Waiting jobs per running worker before another one starts
+WORKER_SCALE_INTERVAL = int(os.getenv("WORKER_SCALE_INTERVAL", "5"))  # Seconds between worker pool checks
+WORKER_IDLE_EXIT = int(os.getenv("WORKER_IDLE_EXIT", "300"))  # Seconds without a job before a worker above the minimum exits
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))  # A job is re-delivered when its worker stops renewing this long
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))  # Seconds an idle worker waits before looking again
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # Deliveries of a job before it is marked failed
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", "86400"))  # Seconds finished jobs are kept
+
+# Update delivery: "polling" (getUpdates) or "webhook" (embedded HTTP server, needs WEBHOOK_URL)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))  # Updates handled at once, in order within a chat
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Public base URL Telegram posts updates to, e.g. https://bot.example.com
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")  # Checked against the X-Telegram-Bot-Api-Secret-Token header
+
+# Retention: messages older than RETENTION_DAYS move from the hot table to the archive database
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "180"))  # 0 keeps everything in the hot table
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH")  # Defaults to messages_archive.db next to DB_PATH
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))  # Rows moved per transaction
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.2"))  # Seconds between batches, leaves room for ingestion
+RETENTION_MAX_BATCHES = int(os.getenv("RETENTION_MAX_BATCHES", "500"))  # Per run, the rest is moved by the next run
+RETENTION_VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "2000"))  # Free pages returned per batch
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "3600"))  # Seconds between retention runs
+
+# Prometheus-style metrics endpoint (GET /metrics), only reachable from this host unless METRICS_HOST says otherwise
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))  # 0 disables the endpoint
@@ -1,18 +1,28 @@
+import asyncio
 import logging
 import datetime
+import time
+from collections import defaultdict
 from telegram.ext import CallbackContext
 from pytz import timezone
-from config import DAILY_SUMMARY_CHAT_ID
-from db.fetchers import fetch_messages_by_date_range
-from ai_api.gemini.prompt_builder import build_prompt
-from ai_api.gemini.api_client import get_gemini_summary
-from utils.formaters.message_formatter import format_messages, replace_thread_ids_with_names
-
-# Set up logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+from config import (DIGEST_ADAPTIVE, DIGEST_BACKLOG_CHECK_INTERVAL, DIGEST_CATCH_UP_DELAY, DIGEST_CHAT_TIMEOUT,
+                    DIGEST_CONCURRENCY, DIGEST_EARLY_MESSAGES, DIGEST_EARLY_TOKENS, DIGEST_MAX_MESSAGES, DIGEST_MAX_SKIP,
+                    DIGEST_MIN_MESSAGES, JOB_RETENTION,
+                    RETENTION_BATCH_PAUSE, RETENTION_BATCH_SIZE, RETENTION_DAYS, RETENTION_INTERVAL,
+                    RETENTION_MAX_BATCHES, ROLLING_SUMMARY_INTERVAL)
+from db.chat_store import load_digest_chats
+from db.job_queue import delete_finished_jobs
+from db.retention import archive_batch, retention_cutoff
+from db.fetchers import fetch_backlog_size, fetch_last_message_id_before, fetch_messages_after
+from db.watermark_store import load_watermark, save_watermark
+from ai_api.rate_limiter import PRIORITY_BACKGROUND, PRIORITY_SCHEDULED, request_context
+from ai_api.summarizer import summarize_window
+from ai_api.rolling_summaries import apply_thread_summaries, consume_thread_summaries, update_rolling_summaries
+from utils.formaters.message_formatter import replace_thread_ids_with_names
+from utils.log_setup import PAYLOAD
+from utils.metrics import ARCHIVED_MESSAGES, DIGEST_TRIGGERS, ERRORS, SUMMARY_STAGE_SECONDS
+from workers.dispatch import submit_job, use_workers
+
 logger = logging.getLogger(__name__)
 
 # Define the specific times to send summaries (24-hour format)
@@ -26,94 +36,220 @@ scheduled_times = [
 LOCAL_TZ = timezone('Europe/Zurich')
 UTC_TZ = timezone('UTC')
 
-# Store the last run time in memory
-last_run_time = None
+# One digest per chat at a time, so a catch-up run and a scheduled run never cover the same rows
+_digest_locks = defaultdict(asyncio.Lock)
+
+def previous_scheduled_time(now):
+    """Return the latest scheduled time before ``now`` (today's or yesterday's last one)."""
+    local_now = now.astimezone(LOCAL_TZ)
+    candidates = [
+        LOCAL_TZ.localize(datetime.datetime.combine(day, datetime.time(hour, minute)))
+        for day in (local_now.date() - datetime.timedelta(days=1), local_now.date())
+        for hour, minute in scheduled_times
+    ]
+    return max(time for time in candidates if time <= local_now)
+
+def _load_or_seed_watermark(chat_id):
+    watermark = load_watermark(chat_id)
+    if watermark is not None:
+        return watermark[0]
+
+    # First digest for this chat: start from the previous scheduled time, as the time-based digests did
+    since = previous_scheduled_time(datetime.datetime.now(LOCAL_TZ) - datetime.timedelta(seconds=1))
+    last_id = fetch_last_message_id_before(chat_id, since)
+    logger.info(f"No digest watermark for chat {chat_id}, starting after message {last_id} ({since.isoformat()}).")
+    return last_id
+
+def _format_utc_plus_one(date):
+    return (datetime.datetime.fromisoformat(date).astimezone(UTC_TZ) + datetime.timedelta(hours=1)).strftime('%Y-%m-%d %H:%M')
 
 async def send_summary(context: CallbackContext):
-    global last_run_time  # Use the global variable to track the last run time
+    """Job callback: send the digest of every chat with digests enabled.
 
-    now = datetime.datetime.now(LOCAL_TZ)
-    today = now.date()
-    yesterday = today - datetime.timedelta(days=1)
+    A catch-up job passes the chats it is for as the job data. In adaptive
+    mode a chat with only a few new messages waits for the next scheduled time.
+    """
+    chats = context.job.data if context.job and context.job.data else load_digest_chats()
+    if DIGEST_ADAPTIVE:
+        chats = [(chat_id, summary_thread_id) for chat_id, summary_thread_id in chats
+                 if due_at_scheduled_time(chat_id, summary_thread_id)]
+    DIGEST_TRIGGERS.inc(len(chats), trigger="scheduled")
+    await dispatch_digests(context.bot, chats)
 
-    # Create datetime objects for today’s scheduled times
-    scheduled_datetimes_today = [
-        datetime.datetime.combine(today, datetime.time(hour, minute), LOCAL_TZ)
-        for hour, minute in scheduled_times
-    ]
-    
-    # Include only the last scheduled time from yesterday
-    last_scheduled_yesterday = datetime.datetime.combine(
-        yesterday, datetime.time(*scheduled_times[-1]), LOCAL_TZ
-    )
+async def check_digest_backlog(context: CallbackContext):
+    """Job callback (adaptive mode): digest the chats whose backlog outgrew the early limits.
+
+    A chat is digested before its next scheduled time once DIGEST_EARLY_MESSAGES
+    messages or DIGEST_EARLY_TOKENS estimated prompt tokens are waiting, so no
+    digest prompt grows much beyond that.
+    """
+    chats = []
+    for chat_id, summary_thread_id in load_digest_chats():
+        if _digest_locks[chat_id].locked():
+            continue  # Being digested right now
+        messages, tokens = fetch_backlog_size(chat_id, _load_or_seed_watermark(chat_id), DIGEST_MAX_MESSAGES, summary_thread_id)
+        if messages >= DIGEST_EARLY_MESSAGES or tokens >= DIGEST_EARLY_TOKENS:
+            logger.info(f"Chat {chat_id}: {messages} messages (~{tokens} tokens) waiting, sending the digest early.")
+            chats.append((chat_id, summary_thread_id))
 
-    # Full schedule: yesterday's last scheduled time + today's scheduled times
-    full_schedule = [last_scheduled_yesterday] + scheduled_datetimes_today
-    full_schedule = sorted(full_schedule)
-
-    # Set `current_time` to the exact execution time
-    current_time = now
-
-    if last_run_time is None:
-        # If there's no last run time, it means this is the first run
-        if current_time == scheduled_datetimes_today[0]:
-            # If it's the first scheduled time of the day (e.g., 7:10 AM), use yesterday's last scheduled time
-            previous_time = full_schedule[-1]  # Last element from the previous day
-            logger.info(f"First run. Using yesterday's last scheduled time: {previous_time}")
-        else:
-            # For subsequent times (not the first run), use the last scheduled time for today
-            previous_time = max((time for time in full_schedule if time < current_time), default=None)
-            logger.info(f"First run, but not at scheduled time. Using previous scheduled time: {previous_time}")
-    else:
-        # If there is a last run time (i.e., not the first execution), use the previous run time
-        previous_time = last_run_time
-        logger.info(f"Subsequent run. Using previous run time: {previous_time}")
-
-    if previous_time is None:
-        logger.warning("No previous scheduled time found. Exiting.")
+    if chats:
+        DIGEST_TRIGGERS.inc(len(chats), trigger="early")
+        await dispatch_digests(context.bot, chats)
+
+def due_at_scheduled_time(chat_id, summary_thread_id) -> bool:
+    """Whether an adaptive chat gets its digest now, or its few new messages go into the next one.
+
+    A small backlog is still sent once the last digest is DIGEST_MAX_SKIP seconds old.
+    """
+    watermark = load_watermark(chat_id)
+    if watermark is None:
+        return True
+    last_id, last_digest_at = watermark
+    messages, _ = fetch_backlog_size(chat_id, last_id, DIGEST_MAX_MESSAGES, summary_thread_id)
+    if messages >= DIGEST_MIN_MESSAGES or time.time() - last_digest_at >= DIGEST_MAX_SKIP:
+        return True
+
+    DIGEST_TRIGGERS.inc(trigger="skipped")
+    logger.info(f"Chat {chat_id}: only {messages} new messages, merging them into the next digest.")
+    return False
+
+async def dispatch_digests(bot, chats):
+    """Send the digests of ``chats``, from this process or from the summary workers.
+
+    With summary workers every chat becomes a job; a chat whose digest is still open is skipped.
+    """
+    if use_workers():
+        for chat_id, summary_thread_id in chats:
+            await asyncio.to_thread(submit_job, "digest", {"chat_id": chat_id, "summary_thread_id": summary_thread_id},
+                                    PRIORITY_SCHEDULED, dedupe_key=f"digest:{chat_id}")
+        logger.info(f"Queued digests for {len(chats)} chats.")
         return
+    await send_digests(bot, chats)
 
-    # Ensure both times are in UTC timezone for the database query
-    previous_time_utc = previous_time.astimezone(UTC_TZ)
-    current_time_utc = current_time.astimezone(UTC_TZ)
+async def send_digests(bot, chats):
+    """Prepare the digests of ``chats`` concurrently, at most DIGEST_CONCURRENCY at once.
 
-    # Log the times being used for fetching messages
-    logger.info(f"Fetching messages from {previous_time_utc.strftime('%Y-%m-%d %H:%M:%S')} UTC to {current_time_utc.strftime('%Y-%m-%d %H:%M:%S')} UTC")
+    Every chat runs on its own: a failing chat is logged and a slow one is
+    cancelled after DIGEST_CHAT_TIMEOUT, neither holds up the others.
+    """
+    semaphore = asyncio.Semaphore(DIGEST_CONCURRENCY)
 
-    try:
-        # Fetch messages from the database using the UTC time range
-        messages = fetch_messages_by_date_range(previous_time_utc, current_time_utc)
-        logger.info(f"Fetched {len(messages)} messages from the database.")
-
-        if not messages:
-            logger.warning("No messages found for the specified period. Exiting.")
-            return
-
-        # Format and process the messages
-        message_block = format_messages(messages)
-        prompt = build_prompt(message_block)
-        summary = get_gemini_summary(prompt)
-
-        if not summary:
-            logger.error("Received an empty summary from the Gemini API.")
-            return
-
-        formatted_summary = replace_thread_ids_with_names(summary)
-        logger.info(f"Formatted summary: {formatted_summary}")
-
-        # Send the summary via bot
-        await context.bot.send_message(
-            chat_id=DAILY_SUMMARY_CHAT_ID,
-            text=f"📋 Summary from {(previous_time_utc + datetime.timedelta(hours=1)).strftime('%Y-%m-%d %H:%M')} UTC+1 to {(current_time_utc + datetime.timedelta(hours=1)).strftime('%Y-%m-%d %H:%M')} UTC+1:\n\n{formatted_summary}",
-            message_thread_id=20284
-        )
-        logger.info("Successfully sent the summary")
+    async def send_one(chat_id, summary_thread_id):
+        async with semaphore:
+            try:
+                await asyncio.wait_for(send_chat_summary(bot, chat_id, summary_thread_id), DIGEST_CHAT_TIMEOUT)
+            except asyncio.TimeoutError:
+                ERRORS.inc(source="digest")
+                logger.error(f"Digest for chat {chat_id} timed out after {DIGEST_CHAT_TIMEOUT} seconds.")
+
+    logger.info(f"Sending digests to {len(chats)} chats.")
+    await asyncio.gather(*(send_one(chat_id, summary_thread_id) for chat_id, summary_thread_id in chats))
+
+async def send_chat_summary(bot, chat_id, summary_thread_id):
+    """Summarize every message stored since the chat's watermark and post the digest.
+
+    The watermark only moves after the digest was sent, so a failed run is
+    retried by the next one and no message is summarized twice.
+    """
+    async with _digest_locks[chat_id]:
+        try:
+            watermark = _load_or_seed_watermark(chat_id)
+            with SUMMARY_STAGE_SECONDS.time(stage="fetch"):
+                messages, last_id = fetch_messages_after(chat_id, watermark, DIGEST_MAX_MESSAGES, summary_thread_id)
+            logger.info(f"Chat {chat_id}: fetched {len(messages)} messages after message {watermark} (up to {last_id}).")
+            if len(messages) >= DIGEST_MAX_MESSAGES:
+                logger.warning(f"Chat {chat_id}: digest capped at {DIGEST_MAX_MESSAGES} messages, the rest follow in the next digest.")
+
+            if not messages:
+                logger.warning(f"Chat {chat_id}: no messages found since the last digest. Exiting.")
+                return
 
-        # Update the last run time for future reference
-        last_run_time = current_time
+            # Format and process the messages, reusing the rolling thread summaries
+            remaining_messages, thread_summaries = apply_thread_summaries(chat_id, messages)
+            with request_context(PRIORITY_SCHEDULED), SUMMARY_STAGE_SECONDS.time(stage="summarize"):
+                summary = await summarize_window(remaining_messages, thread_summaries)
 
+            if summary is None:
+                # Only noise since the last digest: nothing to post, but these messages are done
+                logger.info(f"Chat {chat_id}: only noise messages since the last digest, skipping it.")
+                save_watermark(chat_id, last_id)
+                consume_thread_summaries(chat_id, messages)
+                return
+
+            if not summary:
+                logger.error(f"Chat {chat_id}: received an empty summary from the Gemini API.")
+                return
+
+            with SUMMARY_STAGE_SECONDS.time(stage="name_replace"):
+                formatted_summary = replace_thread_ids_with_names(summary)
+            logger.info(f"Formatted summary for chat {chat_id}: {formatted_summary}", extra=PAYLOAD)
+
+            # Send the summary via bot
+            with SUMMARY_STAGE_SECONDS.time(stage="send"):
+                await bot.send_message(
+                    chat_id=chat_id,
+                    text=f"📋 Summary from {_format_utc_plus_one(messages[-1][3])} UTC+1 to {_format_utc_plus_one(messages[0][3])} UTC+1:\n\n{formatted_summary}",
+                    message_thread_id=summary_thread_id
+                )
+            logger.info(f"Successfully sent the summary to chat {chat_id}")
+
+            # The digest covered these messages: move the watermark and start the rolling summaries over
+            save_watermark(chat_id, last_id)
+            consume_thread_summaries(chat_id, messages)
+
+        except Exception as e:
+            ERRORS.inc(source="digest")
+            logger.error(f"Failed to send summary to chat {chat_id} due to error: {str(e)}")
+
+async def refresh_rolling_summaries(context: CallbackContext):
+    """Job callback: update the rolling thread summaries, in a summary worker if there are any."""
+    if use_workers():
+        await asyncio.to_thread(submit_job, "rolling", {}, PRIORITY_BACKGROUND, dedupe_key="rolling")
+        return
+    await update_rolling_summaries(context)
+
+def schedule_missed_digest(application):
+    """Send a digest shortly after startup to the chats that missed one while the bot was down."""
+    missed = previous_scheduled_time(datetime.datetime.now(LOCAL_TZ))
+    chats = []
+    for chat_id, summary_thread_id in load_digest_chats():
+        watermark = load_watermark(chat_id)
+        if watermark is not None and datetime.datetime.fromtimestamp(watermark[1], LOCAL_TZ) < missed:
+            chats.append((chat_id, summary_thread_id))
+
+    if chats:
+        application.job_queue.run_once(callback=send_summary, when=DIGEST_CATCH_UP_DELAY, data=chats, name="missed_digest")
+        logger.info(f"Digest scheduled for {missed.isoformat()} was missed by {len(chats)} chats, catching up in {DIGEST_CATCH_UP_DELAY} seconds")
+
+async def run_retention(context: CallbackContext):
+    """Job callback: move messages older than RETENTION_DAYS to the archive database.
+
+    Rows move in batches of RETENTION_BATCH_SIZE on a worker thread with a pause
+    in between, so the ingestion writer never waits long for the database.
+    At most RETENTION_MAX_BATCHES run at once, the next run continues.
+    """
+    cutoff = retention_cutoff(RETENTION_DAYS)
+    archived = 0
+    try:
+        for _ in range(RETENTION_MAX_BATCHES):
+            moved = await asyncio.to_thread(archive_batch, cutoff, RETENTION_BATCH_SIZE)
+            archived += moved
+            ARCHIVED_MESSAGES.inc(moved)
+            if moved < RETENTION_BATCH_SIZE:
+                break
+            await asyncio.sleep(RETENTION_BATCH_PAUSE)
     except Exception as e:
-        logger.error(f"Failed to send summary due to error: {str(e)}")
+        ERRORS.inc(source="retention")
+        logger.error(f"Failed to archive old messages due to error: {str(e)}")
+
+    if archived:
+        logger.info(f"Archived {archived} messages older than {RETENTION_DAYS} days.")
+
+async def clean_up_summary_jobs(context: CallbackContext):
+    """Job callback: remove summary jobs that finished more than JOB_RETENTION seconds ago."""
+    deleted = await asyncio.to_thread(delete_finished_jobs, time.time() - JOB_RETENTION)
+    if deleted:
+        logger.info(f"Removed {deleted} finished summary jobs.")
 
 # Function to schedule jobs
 def schedule_jobs(application):
@@ -125,3 +261,41 @@ def schedule_jobs(application):
             name=f"daily_summary_{hour}_{minute}",
         )
         logger.info(f"Scheduled job to run daily at {job_time.isoformat()} in timezone {LOCAL_TZ.zone}")
+    schedule_missed_digest(application)
+
+    # Digest a chat early when its backlog grows past the limits of one prompt
+    if DIGEST_ADAPTIVE:
+        application.job_queue.run_repeating(
+            callback=check_digest_backlog,
+            interval=DIGEST_BACKLOG_CHECK_INTERVAL,
+            first=DIGEST_BACKLOG_CHECK_INTERVAL,
+            name="digest_backlog_check",
+        )
+        logger.info(f"Scheduled digest backlog checks every {DIGEST_BACKLOG_CHECK_INTERVAL} seconds")
+
+    # Keep the rolling thread summaries up to date between digests
+    application.job_queue.run_repeating(
+        callback=refresh_rolling_summaries,
+        interval=ROLLING_SUMMARY_INTERVAL,
+        name="rolling_thread_summaries",
+    )
+    logger.info(f"Scheduled rolling thread summary updates every {ROLLING_SUMMARY_INTERVAL} seconds")
+
+    # Move old messages out of the hot table
+    if RETENTION_DAYS > 0:
+        application.job_queue.run_repeating(
+            callback=run_retention,
+            interval=RETENTION_INTERVAL,
+            first=RETENTION_INTERVAL,
+            name="message_retention",
+        )
+        logger.info(f"Scheduled archiving of messages older than {RETENTION_DAYS} days every {RETENTION_INTERVAL} seconds")
+
+    # Drop finished jobs of the summary workers
+    if use_workers():
+        application.job_queue.run_repeating(
+            callback=clean_up_summary_jobs,
+            interval=JOB_RETENTION,
+            first=JOB_RETENTION,
+            name="summary_job_cleanup",
+        )
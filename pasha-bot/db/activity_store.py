@@ -0,0 +1,55 @@
+# Per-thread activity aggregates kept up to date by the messages_activity_insert
+# trigger, see _create_thread_activity_tables in db/migrations.py
+from db.db_manager import connect
+
+HOUR = 3600
+
+BUSIEST_THREADS_QUERY = """
+    SELECT activity.thread_id, activity.messages, COUNT(DISTINCT posters.username)
+    FROM (
+        SELECT thread_id, SUM(message_count) AS messages
+        FROM thread_activity
+        WHERE chat_id = :chat_id AND hour >= :since
+        GROUP BY thread_id
+        ORDER BY messages DESC
+        LIMIT :limit
+    ) AS activity
+    JOIN thread_activity_posters AS posters
+        ON posters.chat_id = :chat_id AND posters.hour >= :since AND posters.thread_id = activity.thread_id
+    GROUP BY activity.thread_id
+    ORDER BY activity.messages DESC
+"""
+
+TOTALS_QUERY = """
+    SELECT
+        (SELECT COALESCE(SUM(message_count), 0) FROM thread_activity WHERE chat_id = :chat_id AND hour >= :since),
+        (SELECT COUNT(DISTINCT username) FROM thread_activity_posters WHERE chat_id = :chat_id AND hour >= :since)
+"""
+
+BUSIEST_HOUR_QUERY = """
+    SELECT hour, SUM(message_count) AS messages
+    FROM thread_activity
+    WHERE chat_id = ? AND hour >= ?
+    GROUP BY hour
+    ORDER BY messages DESC, hour DESC
+    LIMIT 1
+"""
+
+def hour_bucket(ts) -> int:
+    return int(ts) // HOUR * HOUR
+
+def fetch_activity_stats(chat_id, since_ts, top_threads):
+    """Activity of a chat since ``since_ts``, rounded down to the hour, for the /stats command.
+
+    Returns a dict with the message and distinct poster totals, the busiest hour
+    as (hour_ts, message_count) or None, and the ``top_threads`` busiest threads
+    as (thread_id, message_count, poster_count).
+    """
+    since = hour_bucket(since_ts)
+    parameters = {"chat_id": chat_id, "since": since, "limit": top_threads}
+    conn = connect()
+    messages, posters = conn.execute(TOTALS_QUERY, parameters).fetchone()
+    threads = conn.execute(BUSIEST_THREADS_QUERY, parameters).fetchall()
+    busiest_hour = conn.execute(BUSIEST_HOUR_QUERY, (chat_id, since)).fetchone()
+    conn.close()
+    return {"messages": messages, "posters": posters, "busiest_hour": busiest_hour, "threads": threads}
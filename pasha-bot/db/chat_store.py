@@ -0,0 +1,39 @@
+# Per-chat settings. The message handler looks them up for every message, so
+# they are kept in memory and only read from the database once.
+import time
+from db.db_manager import connect
+
+# chat_id -> (summary_thread_id, digest_enabled)
+_chats = None
+
+def _load_chats():
+    global _chats
+    if _chats is None:
+        conn = connect()
+        rows = conn.execute("SELECT chat_id, summary_thread_id, digest_enabled FROM chats").fetchall()
+        conn.close()
+        _chats = {chat_id: (summary_thread_id, bool(digest_enabled)) for chat_id, summary_thread_id, digest_enabled in rows}
+    return _chats
+
+def get_summary_thread_id(chat_id):
+    """Return the thread a chat's digests are posted to, or None for chats without one."""
+    config = _load_chats().get(chat_id)
+    return config[0] if config else None
+
+def load_digest_chats():
+    """Return [(chat_id, summary_thread_id)] for every chat with digests enabled."""
+    return [(chat_id, summary_thread_id) for chat_id, (summary_thread_id, enabled) in _load_chats().items() if enabled]
+
+def save_chat(chat_id, summary_thread_id, digest_enabled=True):
+    conn = connect()
+    with conn:
+        conn.execute('''INSERT OR REPLACE INTO chats (chat_id, summary_thread_id, digest_enabled, updated_at)
+                        VALUES (?, ?, ?, ?)''',
+                     (chat_id, summary_thread_id, int(digest_enabled), int(time.time())))
+    conn.close()
+    _load_chats()[chat_id] = (summary_thread_id, digest_enabled)
+
+def reset_chat_cache():
+    """Forget the cached settings, e.g. after switching databases."""
+    global _chats
+    _chats = None
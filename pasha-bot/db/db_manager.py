@@ -1,34 +1,42 @@
 import sqlite3
 import os
-from config import DB_PATH
+from datetime import datetime
+from config import DB_PATH, DB_BUSY_TIMEOUT_MS
+from db.migrations import AUTO_VACUUM_INCREMENTAL, migrate
 
-# Function to set up the database (create tables if not exist)
-def setup_database():
-    # Ensure the directory for the database file exists
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+# Function to open a connection with the pragmas every connection should use.
+# `path` opens another database than DB_PATH, e.g. one generated by the benchmarks.
+def connect(check_same_thread=True, path=None):
+    conn = sqlite3.connect(path or DB_PATH, check_same_thread=check_same_thread)
+    # WAL lets readers (fetchers) run while the ingestion writer holds a transaction
+    conn.execute("PRAGMA journal_mode=WAL")
+    # In WAL mode NORMAL only syncs on checkpoints, not on every commit
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    return conn
 
-    # Create a table for storing messages
-    cursor.execute('''CREATE TABLE IF NOT EXISTS messages (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        message_id INTEGER,
-                        date TEXT,
-                        username TEXT,
-                        message_content TEXT,
-                        thread_id INTEGER
-                    )''')
-    conn.commit()
+# Function to set up the database (create or upgrade the schema)
+def setup_database(path=None):
+    # Ensure the directory for the database file exists
+    os.makedirs(os.path.dirname(path or DB_PATH), exist_ok=True)
+    conn = connect(path=path)
+    # Before the first table is created the mode is set for free, so new files
+    # never need the VACUUM of the _enable_incremental_vacuum migration
+    if conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0:
+        conn.execute(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
+    migrate(conn)
     conn.close()
 
 # Function to insert message data into the SQLite database
-def insert_message(message_id, date, username, message_content, thread_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def insert_message(message_id, date, username, message_content, thread_id, chat_id, ts=None, path=None):
+    if ts is None:
+        ts = int(datetime.fromisoformat(date).timestamp())
+    conn = connect(path=path)
+    insert_messages(conn, [(message_id, date, username, message_content, thread_id, chat_id, ts)])
+    conn.close()
 
-    # Insert message details into the table
-    cursor.execute('''INSERT INTO messages (message_id, date, username, message_content, thread_id)
-                      VALUES (?, ?, ?, ?, ?)''',
-                   (message_id, date, username, message_content, thread_id))
-    conn.commit()
-    conn.close()
\ No newline at end of file
+# Function to insert a batch of messages in a single transaction on an open connection
+def insert_messages(conn, rows):
+    with conn:
+        conn.executemany('''INSERT INTO messages (message_id, date, username, message_content, thread_id, chat_id, ts)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
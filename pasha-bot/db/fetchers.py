@@ -1,39 +1,259 @@
-# Fetch the last N messages ordered by date
-import sqlite3
-from config import DB_PATH
+# Fetchers return rows as (id, thread_id, username, date, message_content).
+# Both queries are range scans on idx_messages_chat_ts, see db/migrations.py.
+import re
+from config import DAILY_SUMMARY_CHAT_ID, DAILY_SUMMARY_THREAD_ID, RETENTION_DAYS, TOPIC_CONTEXT_MESSAGES, TOPIC_MAX_MATCHES
+from db.db_manager import connect
+from db.retention import fetch_archived_messages_by_date_range, retention_cutoff
+from utils.metrics import DB_FETCH_SECONDS
+from utils.tokens import CHARS_PER_TOKEN
 
-def fetch_last_n_messages(n):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+# Thread the default chat's summaries are posted to, never summarized itself.
+# Other chats keep theirs in the chats table, see db/chat_store.py.
+SUMMARY_THREAD_ID = DAILY_SUMMARY_THREAD_ID
 
-    # Fetch the last N messages ordered by date, including thread_id = None
-    cursor.execute("""
-        SELECT thread_id, username, date, message_content
+LAST_N_MESSAGES_QUERY = """
+    SELECT id, thread_id, username, date, message_content
+    FROM messages
+    WHERE chat_id = ?
+    ORDER BY ts DESC
+    LIMIT ?
+"""
+
+DATE_RANGE_QUERY = """
+    SELECT id, thread_id, username, date, message_content
+    FROM messages
+    WHERE chat_id = ?
+    AND ts BETWEEN ? AND ?
+    AND thread_id IS NOT ?
+    ORDER BY ts DESC
+"""
+
+def _resolve_chat_id(chat_id):
+    return int(DAILY_SUMMARY_CHAT_ID) if chat_id is None else chat_id
+
+# Fetch the last N messages of a chat ordered by date, including thread_id = None
+def fetch_last_n_messages(n, chat_id=None, path=None):
+    conn = connect(path=path)
+    with DB_FETCH_SECONDS.time(query="last_n"):
+        messages = conn.execute(LAST_N_MESSAGES_QUERY, (_resolve_chat_id(chat_id), n)).fetchall()
+    conn.close()
+
+    return messages
+
+# Fetch messages of a chat within the given date range, excluding the chat's thread for summaries
+# Ranges reaching back past the retention cutoff continue in the archive database
+def fetch_messages_by_date_range(start_time, end_time, chat_id=None, summary_thread_id=SUMMARY_THREAD_ID, path=None):
+    chat_id = _resolve_chat_id(chat_id)
+    conn = connect(path=path)
+    with DB_FETCH_SECONDS.time(query="date_range"):
+        messages = conn.execute(DATE_RANGE_QUERY, (
+            chat_id, int(start_time.timestamp()), int(end_time.timestamp()), summary_thread_id
+        )).fetchall()
+    conn.close()
+
+    # Without retention nothing is ever archived
+    if RETENTION_DAYS > 0 and start_time.timestamp() < retention_cutoff(RETENTION_DAYS):
+        with DB_FETCH_SECONDS.time(query="archived_date_range"):
+            archived = fetch_archived_messages_by_date_range(start_time, end_time, chat_id, summary_thread_id, path)
+        # Archived rows are older than the hot ones; a batch cut short by a crash can be in both
+        hot_ids = {row[0] for row in messages}
+        messages += [row for row in archived if row[0] not in hot_ids]
+
+    return messages
+
+# The unary + keeps SQLite off the thread index: the tail after a recent row id
+# is cheapest to read as a primary-key range, already in id order.
+THREAD_TAIL_QUERY = """
+    SELECT id, thread_id, username, date, message_content
+    FROM messages
+    WHERE id > ?
+    AND +thread_id = ?
+    AND +chat_id = ?
+    ORDER BY id
+    LIMIT ?
+"""
+
+THREAD_TAIL_COUNT_QUERY = """
+    SELECT COUNT(*)
+    FROM messages
+    WHERE id > ?
+    AND +thread_id = ?
+    AND +chat_id = ?
+"""
+
+# Messages a digest has not covered yet. Like the thread tail this is a
+# primary-key range; the oldest rows come first so a capped pass never skips any.
+DIGEST_BACKLOG_QUERY = """
+    SELECT id, thread_id, username, date, message_content
+    FROM messages
+    WHERE id > ?
+    AND +chat_id = ?
+    ORDER BY id
+    LIMIT ?
+"""
+
+# Size of the same rows DIGEST_BACKLOG_QUERY would fetch, without reading them into Python
+DIGEST_BACKLOG_SIZE_QUERY = """
+    SELECT COUNT(*), COALESCE(SUM(LENGTH(username) + LENGTH(message_content)), 0)
+    FROM (
+        SELECT thread_id, username, message_content
         FROM messages
-        ORDER BY date DESC
+        WHERE id > ?
+        AND +chat_id = ?
+        ORDER BY id
         LIMIT ?
-    """, (n,))
+    )
+    WHERE thread_id IS NOT ?
+"""
+
+LAST_ID_BEFORE_QUERY = """
+    SELECT MAX(id)
+    FROM messages
+    WHERE chat_id = ?
+    AND ts < ?
+"""
 
-    messages = cursor.fetchall()
+# Fetch the oldest messages of a thread stored after the given row id
+def fetch_thread_messages_after(chat_id, thread_id, after_id, limit):
+    conn = connect()
+    with DB_FETCH_SECONDS.time(query="thread_tail"):
+        messages = conn.execute(THREAD_TAIL_QUERY, (after_id, thread_id, chat_id, limit)).fetchall()
     conn.close()
 
     return messages
 
-# Fetch messages within the given date range
-def fetch_messages_by_date_range(start_time, end_time):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Exclude 20284 as this is the thread for summaries
-    cursor.execute("""
-        SELECT thread_id, username, date, message_content
-        FROM messages
-        WHERE date BETWEEN ? AND ?
-        AND thread_id != 20284
-        ORDER BY date DESC
-    """, (start_time.isoformat(), end_time.isoformat()))
+# Count the messages of a thread stored after the given row id
+def count_thread_messages_after(chat_id, thread_id, after_id):
+    conn = connect()
+    count = conn.execute(THREAD_TAIL_COUNT_QUERY, (after_id, thread_id, chat_id)).fetchone()[0]
+    conn.close()
+
+    return count
+
+# The row id of a chat's newest message after skipping `skip` of them. Walks
+# idx_messages_chat_ts backwards, its entries end with the row id.
+CHAT_LAST_ID_QUERY = """
+    SELECT id
+    FROM messages
+    WHERE chat_id = ?
+    ORDER BY ts DESC, id DESC
+    LIMIT 1 OFFSET ?
+"""
+
+# Return the row id of the chat's newest message (or the one `skip` messages older), 0 when there is none
+def fetch_last_message_id(chat_id, skip=0):
+    conn = connect()
+    row = conn.execute(CHAT_LAST_ID_QUERY, (chat_id, skip)).fetchone()
+    conn.close()
+
+    return row[0] if row else 0
+
+# Fetch up to `limit` messages of a chat stored after the given row id, newest first.
+# Also returns the highest row id read, which includes the summary thread's messages.
+def fetch_messages_after(chat_id, after_id, limit, summary_thread_id=SUMMARY_THREAD_ID):
+    conn = connect()
+    with DB_FETCH_SECONDS.time(query="digest_backlog"):
+        rows = conn.execute(DIGEST_BACKLOG_QUERY, (after_id, chat_id, limit)).fetchall()
+    conn.close()
+
+    last_id = rows[-1][0] if rows else after_id
+    messages = [row for row in reversed(rows) if row[1] != summary_thread_id]
+    return messages, last_id
+
+# Count the messages fetch_messages_after would return and estimate their prompt tokens
+def fetch_backlog_size(chat_id, after_id, limit, summary_thread_id=SUMMARY_THREAD_ID):
+    conn = connect()
+    with DB_FETCH_SECONDS.time(query="digest_backlog_size"):
+        count, chars = conn.execute(DIGEST_BACKLOG_SIZE_QUERY, (after_id, chat_id, limit, summary_thread_id)).fetchone()
+    conn.close()
+
+    return count, chars // CHARS_PER_TOKEN
+
+ACTIVE_THREADS_QUERY = """
+    SELECT DISTINCT thread_id
+    FROM messages
+    WHERE id > ?
+    AND +chat_id = ?
+"""
+
+# Return the threads of a chat with messages stored after the given row id
+def fetch_active_thread_ids(chat_id, after_id):
+    conn = connect()
+    thread_ids = [row[0] for row in conn.execute(ACTIVE_THREADS_QUERY, (after_id, chat_id))]
+    conn.close()
+
+    return thread_ids
+
+# Return the highest row id of a chat stored before the given time, 0 when there is none
+def fetch_last_message_id_before(chat_id, before_time):
+    conn = connect()
+    last_id = conn.execute(LAST_ID_BEFORE_QUERY, (chat_id, int(before_time.timestamp()))).fetchone()[0]
+    conn.close()
+
+    return last_id or 0
+
+# Most recent messages of a chat matching a full-text query, see messages_fts in db/migrations.py
+TOPIC_MATCHES_QUERY = """
+    SELECT m.id, m.thread_id, m.username, m.date, m.message_content, m.ts
+    FROM messages_fts
+    JOIN messages AS m ON m.id = messages_fts.rowid
+    WHERE messages_fts MATCH ?
+    AND m.chat_id = ?
+    AND m.thread_id IS NOT ?
+    ORDER BY m.id DESC
+    LIMIT ?
+"""
+
+# The messages of the same thread right before and after a match, range scans on idx_messages_thread_ts
+CONTEXT_BEFORE_QUERY = """
+    SELECT id, thread_id, username, date, message_content
+    FROM messages
+    WHERE thread_id IS ?
+    AND ts <= ?
+    AND id < ?
+    AND +chat_id = ?
+    ORDER BY ts DESC
+    LIMIT ?
+"""
+
+CONTEXT_AFTER_QUERY = """
+    SELECT id, thread_id, username, date, message_content
+    FROM messages
+    WHERE thread_id IS ?
+    AND ts >= ?
+    AND id > ?
+    AND +chat_id = ?
+    ORDER BY ts
+    LIMIT ?
+"""
+
+# Turn free text into an FTS5 query: every word must occur, as a prefix so
+# inflected forms ("бюджет" finds "бюджета") match too. None if there are no words.
+def build_topic_match_query(topic):
+    words = re.findall(r"\w+", topic.lower())
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+# Fetch the most recent messages of a chat about a topic with `context` messages of
+# the same thread around each match, newest first, excluding the chat's thread for summaries
+def fetch_topic_messages(topic, chat_id=None, summary_thread_id=SUMMARY_THREAD_ID, max_matches=TOPIC_MAX_MATCHES,
+                         context=TOPIC_CONTEXT_MESSAGES):
+    match_query = build_topic_match_query(topic)
+    if match_query is None:
+        return []
 
-    messages = cursor.fetchall()
+    chat_id = _resolve_chat_id(chat_id)
+    conn = connect()
+    with DB_FETCH_SECONDS.time(query="topic"):
+        matches = conn.execute(TOPIC_MATCHES_QUERY, (match_query, chat_id, summary_thread_id, max_matches)).fetchall()
+        rows = {}
+        for row_id, thread_id, username, date, message_content, ts in matches:
+            rows[row_id] = (row_id, thread_id, username, date, message_content)
+            if context:
+                for query in (CONTEXT_BEFORE_QUERY, CONTEXT_AFTER_QUERY):
+                    for row in conn.execute(query, (thread_id, ts, row_id, chat_id, context)):
+                        rows[row[0]] = row
     conn.close()
 
-    return messages
\ No newline at end of file
+    return [rows[row_id] for row_id in sorted(rows, reverse=True)]
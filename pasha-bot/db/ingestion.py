@@ -0,0 +1,150 @@
+import logging
+import queue
+import threading
+import time
+from config import INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL, INGEST_MAX_QUEUE_SIZE
+from db.db_manager import connect, insert_messages
+from utils.metrics import DB_INSERT_BATCH_SIZE, DB_INSERT_SECONDS, ERRORS, INGEST_QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+# Marker put on the queue to tell the writer thread to flush and exit
+_STOP = object()
+
+
+class MessageWriter:
+    """Write-behind queue for incoming messages.
+
+    Handlers only put rows on an in-process queue. A dedicated thread owns a
+    long-lived connection and flushes the queue in batched transactions,
+    either when ``batch_size`` rows are waiting or ``flush_interval`` seconds
+    after the first row of a batch arrived.
+    """
+
+    def __init__(self, batch_size=INGEST_BATCH_SIZE, flush_interval=INGEST_FLUSH_INTERVAL,
+                 max_queue_size=INGEST_MAX_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+
+        # Counters, only written by the writer thread
+        self.flushed_messages = 0
+        self.failed_messages = 0
+        self.flush_count = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"Message writer started (batch size {self.batch_size}, flush interval {self.flush_interval}s).")
+
+    def submit(self, row):
+        """Queue a row for insertion. Never touches the disk."""
+        self._queue.put(row)
+
+    def stop(self, timeout=None):
+        """Flush everything that is queued and stop the writer thread."""
+        if not self.running:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        logger.info(f"Message writer stopped. Stats: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "flushed_messages": self.flushed_messages,
+            "failed_messages": self.failed_messages,
+            "flush_count": self.flush_count,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+            "avg_flush_latency": self.total_flush_latency / self.flush_count if self.flush_count else 0.0,
+        }
+
+    def _run(self):
+        conn = connect(check_same_thread=False)
+        try:
+            stopping = False
+            while not stopping:
+                batch, stopping = self._collect_batch()
+                if batch:
+                    self._flush(conn, batch)
+        finally:
+            conn.close()
+
+    def _collect_batch(self):
+        """Block for the first row, then gather more until the batch is full or the interval passed."""
+        item = self._queue.get()
+        if item is _STOP:
+            return self._drain(), True
+
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                batch.extend(self._drain())
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _drain(self):
+        """Take whatever is left on the queue without waiting."""
+        rows = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return rows
+            if item is not _STOP:
+                rows.append(item)
+
+    def _flush(self, conn, batch):
+        started = time.perf_counter()
+        try:
+            insert_messages(conn, batch)
+            self.flushed_messages += len(batch)
+        except Exception as e:
+            self.failed_messages += len(batch)
+            ERRORS.inc(source="ingestion")
+            logger.error(f"Failed to write a batch of {len(batch)} messages: {str(e)}")
+            return
+        latency = time.perf_counter() - started
+        DB_INSERT_SECONDS.observe(latency)
+        DB_INSERT_BATCH_SIZE.observe(len(batch))
+        self.flush_count += 1
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self.total_flush_latency += latency
+
+
+# Shared writer used by the Telegram handlers
+message_writer = MessageWriter()
+INGEST_QUEUE_DEPTH.set_function(lambda: message_writer.stats()["queue_depth"])
+
+def start_ingestion():
+    message_writer.start()
+
+def stop_ingestion():
+    message_writer.stop()
+
+def enqueue_message(message_id, date, username, message_content, thread_id, chat_id, ts):
+    message_writer.submit((message_id, date, username, message_content, thread_id, chat_id, ts))
+
+def get_ingestion_stats() -> dict:
+    return message_writer.stats()
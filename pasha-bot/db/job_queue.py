@@ -0,0 +1,111 @@
+# Durable SQLite-backed queue of summary jobs. The Telegram process enqueues,
+# worker processes claim jobs under a lease they keep extending while the job
+# runs. A job whose worker crashed is claimed again once its lease expired.
+import json
+import time
+from config import JOB_MAX_ATTEMPTS
+from db.db_manager import connect
+
+# Jobs that can be claimed: queued ones and running ones whose worker stopped renewing the lease.
+# Lower priority values are claimed first, see ai_api/rate_limiter.py.
+CLAIMABLE = "(status = 'queued' OR (status = 'running' AND lease_expires_at < :now))"
+
+CLAIM_QUERY = f"""
+    UPDATE summary_jobs
+    SET status = 'running', lease_owner = :worker, lease_expires_at = :now + :lease,
+        attempts = attempts + 1, updated_at = :now
+    WHERE id = (
+        SELECT id FROM summary_jobs
+        WHERE {CLAIMABLE}
+        ORDER BY priority, id
+        LIMIT 1
+    )
+    RETURNING id, kind, payload, attempts
+"""
+
+class Job:
+    def __init__(self, job_id, kind, payload, attempts):
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f"Job({self.id}, {self.kind}, attempt {self.attempts})"
+
+def enqueue_job(kind, payload, priority, dedupe_key=None):
+    """Add a job and return its id, or None if an open job with the same dedupe key exists."""
+    now = int(time.time())
+    conn = connect()
+    with conn:
+        cursor = conn.execute('''INSERT OR IGNORE INTO summary_jobs (kind, payload, priority, dedupe_key, created_at, updated_at)
+                                 VALUES (?, ?, ?, ?, ?, ?)''', (kind, json.dumps(payload), priority, dedupe_key, now, now))
+    conn.close()
+    return cursor.lastrowid if cursor.rowcount else None
+
+def claim_job(worker_id, lease_seconds):
+    """Claim the next job for ``worker_id``, or return None when there is nothing to do.
+
+    A job that was already claimed JOB_MAX_ATTEMPTS times is marked failed instead.
+    """
+    conn = connect()
+    try:
+        while True:
+            with conn:
+                row = conn.execute(CLAIM_QUERY, {"worker": worker_id, "now": time.time(), "lease": lease_seconds}).fetchone()
+            if row is None:
+                return None
+            job_id, kind, payload, attempts = row
+            if attempts <= JOB_MAX_ATTEMPTS:
+                return Job(job_id, kind, json.loads(payload), attempts)
+            # Crashed its worker every time, don't let it take down the next one
+            with conn:
+                conn.execute("UPDATE summary_jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                             ("Too many attempts", int(time.time()), job_id))
+    finally:
+        conn.close()
+
+def extend_lease(job_id, worker_id, lease_seconds):
+    """Renew the lease of a running job. Returns False if the worker no longer holds it."""
+    conn = connect()
+    with conn:
+        renewed = conn.execute('''UPDATE summary_jobs SET lease_expires_at = ?
+                                  WHERE id = ? AND lease_owner = ? AND status = 'running' ''',
+                               (time.time() + lease_seconds, job_id, worker_id)).rowcount
+    conn.close()
+    return bool(renewed)
+
+def finish_job(job_id, worker_id, error=None):
+    """Mark a job done, or failed with ``error``. Ignored if another worker took the job over."""
+    conn = connect()
+    with conn:
+        conn.execute('''UPDATE summary_jobs SET status = ?, error = ?, lease_owner = NULL, lease_expires_at = NULL,
+                                                updated_at = ?
+                        WHERE id = ? AND lease_owner = ?''',
+                     ("failed" if error else "done", error, int(time.time()), job_id, worker_id))
+    conn.close()
+
+def count_claimable_jobs():
+    conn = connect()
+    count = conn.execute(f"SELECT COUNT(*) FROM summary_jobs WHERE {CLAIMABLE}", {"now": time.time()}).fetchone()[0]
+    conn.close()
+    return count
+
+def queue_position(job_id):
+    """1-based position of a queued job among the jobs claimed before it."""
+    conn = connect()
+    position = conn.execute('''SELECT COUNT(*) FROM summary_jobs
+                               WHERE status = 'queued'
+                               AND (priority, id) <= (SELECT priority, id FROM summary_jobs WHERE id = ?)''',
+                            (job_id,)).fetchone()[0]
+    conn.close()
+    return position
+
+def delete_finished_jobs(before):
+    """Remove done and failed jobs last updated before the given time."""
+    conn = connect()
+    with conn:
+        deleted = conn.execute("DELETE FROM summary_jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                               (before,)).rowcount
+    conn.close()
+    return deleted
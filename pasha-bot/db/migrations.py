@@ -0,0 +1,210 @@
+import logging
+import time
+from config import DAILY_SUMMARY_CHAT_ID, DAILY_SUMMARY_THREAD_ID
+
+logger = logging.getLogger(__name__)
+
+# PRAGMA auto_vacuum value that lets the retention job return freed pages in small steps
+AUTO_VACUUM_INCREMENTAL = 2
+
+# Each migration upgrades the schema by one version. The version a database
+# file is at is kept in PRAGMA user_version, so existing files are upgraded
+# in place and new migrations must only ever be appended to MIGRATIONS.
+
+def _create_messages_table(conn):
+    # Original schema. IF NOT EXISTS keeps it a no-op for files created before versioning.
+    conn.execute('''CREATE TABLE IF NOT EXISTS messages (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        message_id INTEGER,
+                        date TEXT,
+                        username TEXT,
+                        message_content TEXT,
+                        thread_id INTEGER
+                    )''')
+
+def _add_timestamps_and_chat_id(conn):
+    # Integer epoch timestamps sort and compare without parsing ISO strings
+    conn.execute("ALTER TABLE messages ADD COLUMN ts INTEGER")
+    conn.execute("ALTER TABLE messages ADD COLUMN chat_id INTEGER")
+
+    # Rows stored before this migration all come from the single configured group
+    conn.execute("UPDATE messages SET ts = CAST(strftime('%s', date) AS INTEGER), chat_id = ?",
+                 (int(DAILY_SUMMARY_CHAT_ID),))
+
+    conn.execute("CREATE INDEX idx_messages_chat_ts ON messages (chat_id, ts)")
+    conn.execute("CREATE INDEX idx_messages_thread_ts ON messages (thread_id, ts)")
+
+def _create_summary_cache_table(conn):
+    conn.execute('''CREATE TABLE summary_cache (
+                        key TEXT PRIMARY KEY,
+                        summary TEXT NOT NULL,
+                        created_at INTEGER NOT NULL
+                    )''')
+
+def _create_thread_summaries_table(conn):
+    # Rolling summary per thread covering message rows first_id..last_id.
+    # last_id is kept when the summary is consumed so updates continue from there.
+    conn.execute('''CREATE TABLE thread_summaries (
+                        chat_id INTEGER NOT NULL,
+                        thread_id INTEGER NOT NULL,
+                        summary TEXT NOT NULL DEFAULT '',
+                        first_id INTEGER,
+                        last_id INTEGER NOT NULL,
+                        updated_at INTEGER NOT NULL,
+                        PRIMARY KEY (chat_id, thread_id)
+                    )''')
+
+def _create_digest_watermarks_table(conn):
+    # Last message row id a scheduled digest covered, per chat
+    conn.execute('''CREATE TABLE digest_watermarks (
+                        chat_id INTEGER PRIMARY KEY,
+                        last_id INTEGER NOT NULL,
+                        updated_at INTEGER NOT NULL
+                    )''')
+
+def _create_chats_table(conn):
+    # Per-chat settings; the group the bot was built for is the first chat
+    conn.execute('''CREATE TABLE chats (
+                        chat_id INTEGER PRIMARY KEY,
+                        summary_thread_id INTEGER,
+                        digest_enabled INTEGER NOT NULL DEFAULT 1,
+                        updated_at INTEGER NOT NULL
+                    )''')
+    conn.execute("INSERT INTO chats (chat_id, summary_thread_id, digest_enabled, updated_at) VALUES (?, ?, 1, ?)",
+                 (int(DAILY_SUMMARY_CHAT_ID), DAILY_SUMMARY_THREAD_ID, int(time.time())))
+
+def _create_messages_fts(conn):
+    # Full-text index over message_content for topic summaries. It stores no
+    # copy of the text (external content) and the triggers keep it in step
+    # with every insert, edit and delete, including the retention job's.
+    conn.execute('''CREATE VIRTUAL TABLE messages_fts USING fts5(
+                        message_content,
+                        content='messages',
+                        content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2'
+                    )''')
+    conn.execute('''CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+                        INSERT INTO messages_fts (rowid, message_content) VALUES (new.id, new.message_content);
+                    END''')
+    conn.execute('''CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+                        INSERT INTO messages_fts (messages_fts, rowid, message_content) VALUES ('delete', old.id, old.message_content);
+                    END''')
+    conn.execute('''CREATE TRIGGER messages_fts_update AFTER UPDATE OF message_content ON messages BEGIN
+                        INSERT INTO messages_fts (messages_fts, rowid, message_content) VALUES ('delete', old.id, old.message_content);
+                        INSERT INTO messages_fts (rowid, message_content) VALUES (new.id, new.message_content);
+                    END''')
+    # Index the messages stored so far
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+def _create_summary_jobs_table(conn):
+    # Durable queue of Gemini work for the worker processes, see db/job_queue.py.
+    # A running job whose lease expired is claimed again by another worker.
+    conn.execute('''CREATE TABLE summary_jobs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        kind TEXT NOT NULL,
+                        payload TEXT NOT NULL,
+                        priority INTEGER NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'queued',
+                        dedupe_key TEXT,
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        lease_owner TEXT,
+                        lease_expires_at REAL,
+                        error TEXT,
+                        created_at INTEGER NOT NULL,
+                        updated_at INTEGER NOT NULL
+                    )''')
+    conn.execute("CREATE INDEX idx_summary_jobs_status ON summary_jobs (status, priority, id)")
+    # At most one open job per dedupe key, e.g. one digest per chat
+    conn.execute('''CREATE UNIQUE INDEX idx_summary_jobs_dedupe ON summary_jobs (dedupe_key)
+                    WHERE dedupe_key IS NOT NULL AND status IN ('queued', 'running')''')
+
+def _create_thread_activity_tables(conn):
+    # Message and poster counts per thread and hour, kept by a trigger in the
+    # same transaction as every insert. The retention job's deletes leave them
+    # alone, so they cover the archived history as well. See db/activity_store.py.
+    conn.execute('''CREATE TABLE thread_activity (
+                        chat_id INTEGER NOT NULL,
+                        thread_id INTEGER NOT NULL,
+                        hour INTEGER NOT NULL,
+                        message_count INTEGER NOT NULL,
+                        poster_count INTEGER NOT NULL,
+                        PRIMARY KEY (chat_id, hour, thread_id)
+                    ) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE thread_activity_posters (
+                        chat_id INTEGER NOT NULL,
+                        thread_id INTEGER NOT NULL,
+                        hour INTEGER NOT NULL,
+                        username TEXT NOT NULL,
+                        PRIMARY KEY (chat_id, hour, thread_id, username)
+                    ) WITHOUT ROWID''')
+    # changes() is 1 when the poster is new for this thread and hour, 0 when ignored
+    conn.execute('''CREATE TRIGGER messages_activity_insert AFTER INSERT ON messages
+                    WHEN new.chat_id IS NOT NULL AND new.thread_id IS NOT NULL AND new.ts IS NOT NULL BEGIN
+                        INSERT OR IGNORE INTO thread_activity_posters (chat_id, thread_id, hour, username)
+                        VALUES (new.chat_id, new.thread_id, new.ts / 3600 * 3600, COALESCE(new.username, ''));
+                        INSERT INTO thread_activity (chat_id, thread_id, hour, message_count, poster_count)
+                        VALUES (new.chat_id, new.thread_id, new.ts / 3600 * 3600, 1, changes())
+                        ON CONFLICT (chat_id, hour, thread_id) DO UPDATE
+                        SET message_count = message_count + 1, poster_count = poster_count + excluded.poster_count;
+                    END''')
+    # Count the messages stored so far
+    conn.execute('''INSERT INTO thread_activity_posters (chat_id, thread_id, hour, username)
+                    SELECT DISTINCT chat_id, thread_id, ts / 3600 * 3600, COALESCE(username, '') FROM messages
+                    WHERE chat_id IS NOT NULL AND thread_id IS NOT NULL AND ts IS NOT NULL''')
+    conn.execute('''INSERT INTO thread_activity (chat_id, thread_id, hour, message_count, poster_count)
+                    SELECT chat_id, thread_id, ts / 3600 * 3600, COUNT(*), COUNT(DISTINCT COALESCE(username, ''))
+                    FROM messages
+                    WHERE chat_id IS NOT NULL AND thread_id IS NOT NULL AND ts IS NOT NULL
+                    GROUP BY chat_id, thread_id, ts / 3600''')
+
+def _enable_incremental_vacuum(conn):
+    # The mode of an existing file only changes with a full VACUUM, which rewrites it once
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+        logger.info("Rebuilding the database file to enable incremental vacuum, this can take a while.")
+        conn.execute(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
+        conn.execute("VACUUM")
+
+# VACUUM cannot run inside a transaction
+_enable_incremental_vacuum.transactional = False
+
+def _create_worker_metrics_table(conn):
+    # Metric deltas the summary workers queue for the bot process, see db/worker_metrics_store.py
+    conn.execute('''CREATE TABLE worker_metrics (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        deltas TEXT NOT NULL
+                    )''')
+
+MIGRATIONS = [
+    _create_messages_table,
+    _add_timestamps_and_chat_id,
+    _create_summary_cache_table,
+    _create_thread_summaries_table,
+    _create_digest_watermarks_table,
+    _create_chats_table,
+    _create_messages_fts,
+    _create_summary_jobs_table,
+    _create_thread_activity_tables,
+    _enable_incremental_vacuum,
+    _create_worker_metrics_table,
+]
+
+def get_schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    """Apply every migration the database has not seen yet, each in its own transaction."""
+    version = get_schema_version(conn)
+    for target_version, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info(f"Migrating database schema to version {target_version} ({migration.__name__}).")
+        if not getattr(migration, "transactional", True):
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {target_version}")
+            continue
+        conn.execute("BEGIN")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {target_version}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
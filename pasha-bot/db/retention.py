@@ -0,0 +1,93 @@
+# Retention: old rows move from the hot messages table into an attached archive
+# database in small batches, so the hot table and its indexes stay small. The
+# archive keeps the original row ids and stays queryable for historical summaries.
+import os
+import time
+from config import ARCHIVE_DB_PATH, RETENTION_VACUUM_PAGES
+from db import db_manager
+from db.db_manager import connect
+
+ARCHIVE_SCHEMA = '''CREATE TABLE IF NOT EXISTS archive.messages (
+                        id INTEGER PRIMARY KEY,
+                        message_id INTEGER,
+                        date TEXT,
+                        username TEXT,
+                        message_content TEXT,
+                        thread_id INTEGER,
+                        chat_id INTEGER,
+                        ts INTEGER
+                    )'''
+
+ARCHIVE_INDEX = "CREATE INDEX IF NOT EXISTS archive.idx_archive_chat_ts ON messages (chat_id, ts)"
+
+# The oldest rows have the lowest ids, so the next batch is the head of a
+# primary-key scan; the unary + keeps SQLite from picking the chat/ts index.
+OLD_ROWS_QUERY = """
+    SELECT id
+    FROM messages
+    WHERE +ts < ?
+    ORDER BY id
+    LIMIT ?
+"""
+
+ARCHIVED_DATE_RANGE_QUERY = """
+    SELECT id, thread_id, username, date, message_content
+    FROM archive.messages
+    WHERE chat_id = ?
+    AND ts BETWEEN ? AND ?
+    AND thread_id IS NOT ?
+    ORDER BY ts DESC
+"""
+
+# The archive sits next to the hot database unless ARCHIVE_DB_PATH says otherwise
+def archive_db_path(path=None):
+    if ARCHIVE_DB_PATH:
+        return ARCHIVE_DB_PATH
+    return os.path.join(os.path.dirname(path or db_manager.DB_PATH), "messages_archive.db")
+
+def _connect_with_archive(path=None):
+    conn = connect(path=path)
+    conn.execute("ATTACH DATABASE ? AS archive", (archive_db_path(path),))
+    conn.execute(ARCHIVE_SCHEMA)
+    conn.execute(ARCHIVE_INDEX)
+    conn.commit()
+    return conn
+
+def archive_batch(cutoff_ts, batch_size):
+    """Move up to ``batch_size`` rows older than ``cutoff_ts`` into the archive.
+
+    Returns the number of rows moved. Copy and delete share one transaction.
+    With WAL it is atomic per database file only, so the copy uses INSERT OR
+    IGNORE and a batch interrupted by a crash is simply moved again.
+    """
+    conn = _connect_with_archive()
+    try:
+        ids = [row[0] for row in conn.execute(OLD_ROWS_QUERY, (cutoff_ts, batch_size))]
+        if not ids:
+            return 0
+        first_id, last_id = ids[0], ids[-1]
+        with conn:
+            conn.execute('''INSERT OR IGNORE INTO archive.messages
+                            SELECT id, message_id, date, username, message_content, thread_id, chat_id, ts
+                            FROM messages WHERE id BETWEEN ? AND ? AND +ts < ?''', (first_id, last_id, cutoff_ts))
+            moved = conn.execute("DELETE FROM messages WHERE id BETWEEN ? AND ? AND +ts < ?",
+                                 (first_id, last_id, cutoff_ts)).rowcount
+        # Hand the freed pages back to the file system a few at a time
+        conn.execute(f"PRAGMA main.incremental_vacuum({RETENTION_VACUUM_PAGES})").fetchall()
+        return moved
+    finally:
+        conn.close()
+
+def retention_cutoff(retention_days, now=None):
+    return int((now or time.time()) - retention_days * 86400)
+
+# Fetch archived messages of a chat within the given date range, newest first, excluding the summary thread
+def fetch_archived_messages_by_date_range(start_time, end_time, chat_id, summary_thread_id, path=None):
+    if not os.path.exists(archive_db_path(path)):
+        return []
+    conn = _connect_with_archive(path)
+    messages = conn.execute(ARCHIVED_DATE_RANGE_QUERY, (
+        chat_id, int(start_time.timestamp()), int(end_time.timestamp()), summary_thread_id
+    )).fetchall()
+    conn.close()
+    return messages
@@ -0,0 +1,23 @@
+# Persistent storage for the summary cache, see ai_api/summary_cache.py
+from db.db_manager import connect
+
+def load_cached_summary(key, min_created_at):
+    conn = connect()
+    row = conn.execute("SELECT summary, created_at FROM summary_cache WHERE key = ? AND created_at >= ?",
+                       (key, min_created_at)).fetchone()
+    conn.close()
+    return row
+
+def store_cached_summary(key, summary, created_at):
+    conn = connect()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO summary_cache (key, summary, created_at) VALUES (?, ?, ?)",
+                     (key, summary, created_at))
+    conn.close()
+
+def delete_expired_summaries(min_created_at):
+    conn = connect()
+    with conn:
+        deleted = conn.execute("DELETE FROM summary_cache WHERE created_at < ?", (min_created_at,)).rowcount
+    conn.close()
+    return deleted
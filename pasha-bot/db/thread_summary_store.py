@@ -0,0 +1,33 @@
+# Persistent storage for rolling thread summaries, see ai_api/rolling_summaries.py
+import time
+from db.db_manager import connect
+
+def load_thread_summaries(chat_id):
+    """Return {thread_id: (summary, first_id, last_id)} for a chat."""
+    conn = connect()
+    rows = conn.execute("SELECT thread_id, summary, first_id, last_id FROM thread_summaries WHERE chat_id = ?",
+                        (chat_id,)).fetchall()
+    conn.close()
+    return {thread_id: (summary, first_id, last_id) for thread_id, summary, first_id, last_id in rows}
+
+def save_thread_summary(chat_id, thread_id, summary, first_id, last_id):
+    conn = connect()
+    with conn:
+        conn.execute('''INSERT OR REPLACE INTO thread_summaries (chat_id, thread_id, summary, first_id, last_id, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?)''',
+                     (chat_id, thread_id, summary, first_id, last_id, int(time.time())))
+    conn.close()
+
+def reset_thread_summaries(chat_id, consumed_ids):
+    """Clear the summaries of a chat once a digest used them.
+
+    ``consumed_ids`` maps thread_id to the last message id the digest covered,
+    so later updates never fold in messages that were already summarized.
+    """
+    conn = connect()
+    with conn:
+        conn.execute("UPDATE thread_summaries SET summary = '', first_id = NULL, updated_at = ? WHERE chat_id = ?",
+                     (int(time.time()), chat_id))
+        conn.executemany("UPDATE thread_summaries SET last_id = MAX(last_id, ?) WHERE chat_id = ? AND thread_id = ?",
+                         [(last_id, chat_id, thread_id) for thread_id, last_id in consumed_ids.items()])
+    conn.close()
@@ -0,0 +1,20 @@
+# Persistent digest watermarks: the last message row id each chat's scheduled digest covered
+import time
+from db.db_manager import connect
+
+def load_watermark(chat_id):
+    """Return (last_id, updated_at) for a chat, or None before its first digest."""
+    conn = connect()
+    row = conn.execute("SELECT last_id, updated_at FROM digest_watermarks WHERE chat_id = ?", (chat_id,)).fetchone()
+    conn.close()
+    return row
+
+def save_watermark(chat_id, last_id):
+    conn = connect()
+    with conn:
+        # Never move backwards, e.g. if an older run finishes late
+        conn.execute('''INSERT INTO digest_watermarks (chat_id, last_id, updated_at) VALUES (?, ?, ?)
+                        ON CONFLICT (chat_id) DO UPDATE SET last_id = MAX(last_id, excluded.last_id),
+                                                            updated_at = excluded.updated_at''',
+                     (chat_id, last_id, int(time.time())))
+    conn.close()
@@ -0,0 +1,20 @@
+# Hands the metrics of the summary worker processes to the bot process, which
+# serves /metrics. See take_metric_deltas in utils/metrics.py.
+import json
+from db.db_manager import connect
+
+def save_metric_deltas(deltas):
+    if not deltas:
+        return
+    conn = connect()
+    with conn:
+        conn.execute("INSERT INTO worker_metrics (deltas) VALUES (?)", (json.dumps(deltas),))
+    conn.close()
+
+def drain_metric_deltas():
+    """Remove and return the deltas the workers queued so far."""
+    conn = connect()
+    with conn:
+        rows = conn.execute("DELETE FROM worker_metrics RETURNING deltas").fetchall()
+    conn.close()
+    return [json.loads(deltas) for deltas, in rows]
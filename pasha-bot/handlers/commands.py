@@ -1,5 +1,15 @@
-from telegram import Update
+import datetime
+import logging
+import time
+from telegram import ChatMember, Update
+from config import DAILY_SUMMARY_CHAT_ID, STATS_DEFAULT_HOURS, STATS_MAX_HOURS, STATS_TOP_THREADS
+from db.activity_store import fetch_activity_stats
+from db.chat_store import get_summary_thread_id, save_chat
 from keyboards.buttons import get_start_buttons
+from utils.mappers.thread_name_mappings import get_thread_name
+
+# Times in /stats replies, like the digests
+UTC_PLUS_ONE = datetime.timezone(datetime.timedelta(hours=1))
 
 # Function to handle the /start command
 async def start(update: Update, context):
@@ -24,9 +34,80 @@ async def help_command(update: Update, context):
         await update.message.reply_text(
             "Here are the available commands:\n"
             "/start - Start the bot\n"
-            "/help - Get help\n\n"
-            "To get a summary of recent discussions, use the '🚀 Get summary' button."
+            "/help - Get help\n"
+            "/digest_here - Post scheduled digests to this group thread (admins, '/digest_here off' to stop)\n"
+            f"/stats [hours] - Busiest threads of the last {STATS_DEFAULT_HOURS} hours (or the given number)\n\n"
+            "To get a summary of recent discussions, use the '🚀 Get summary' button.\n"
+            "To find out what was said about one topic, use the '🔎 Summary by topic' button."
         )
     except Exception as e:
         logging.error(f"Error sending /help message: {str(e)}")
         await update.message.reply_text("An error occurred while fetching help. Please try again later.")
+
+# Function to handle the /digest_here command: choose where a group's digests are posted
+async def digest_here(update: Update, context):
+    chat = update.effective_chat
+    if chat.type not in (chat.GROUP, chat.SUPERGROUP):
+        await update.message.reply_text("Эта команда работает только в группах.")
+        return
+
+    try:
+        member = await context.bot.get_chat_member(chat.id, update.effective_user.id)
+        if member.status not in (ChatMember.ADMINISTRATOR, ChatMember.OWNER):
+            await update.message.reply_text("Только администраторы могут настраивать сводки.")
+            return
+
+        if context.args and context.args[0].lower() == "off":
+            save_chat(chat.id, get_summary_thread_id(chat.id), digest_enabled=False)
+            await update.message.reply_text("Сводки для этой группы отключены.")
+            logging.info(f"Digests disabled for chat {chat.id}")
+            return
+
+        thread_id = update.message.message_thread_id if update.message.is_topic_message else None
+        save_chat(chat.id, thread_id)
+        await update.message.reply_text("Сводки будут публиковаться здесь. Другие сообщения в этой теме удаляются."
+                                        if thread_id is not None else "Сводки будут публиковаться здесь.")
+        logging.info(f"Digests enabled for chat {chat.id} in thread {thread_id}")
+    except Exception as e:
+        logging.error(f"Error handling /digest_here: {str(e)}")
+        await update.message.reply_text("An error occurred while saving the settings. Please try again later.")
+
+# Function to handle the /stats command: thread activity straight from the aggregates
+async def stats(update: Update, context):
+    chat = update.effective_chat
+    # In private chats, like "Get summary", report on the configured group
+    chat_id = chat.id if chat.type in (chat.GROUP, chat.SUPERGROUP) else int(DAILY_SUMMARY_CHAT_ID)
+
+    hours = STATS_DEFAULT_HOURS
+    if context.args:
+        try:
+            hours = int(context.args[0])
+        except ValueError:
+            hours = 0
+        if not 1 <= hours <= STATS_MAX_HOURS:
+            await update.message.reply_text(f"Укажите количество часов от 1 до {STATS_MAX_HOURS}.")
+            return
+
+    try:
+        activity = fetch_activity_stats(chat_id, time.time() - hours * 3600, STATS_TOP_THREADS)
+        await update.message.reply_text(format_stats(activity, hours))
+    except Exception as e:
+        logging.error(f"Error handling /stats: {str(e)}")
+        await update.message.reply_text("An error occurred while fetching the statistics. Please try again later.")
+
+def format_stats(activity, hours) -> str:
+    if not activity["messages"]:
+        return f"За последние {hours} ч. сообщений не было."
+
+    lines = [
+        f"📊 Активность за последние {hours} ч.",
+        f"Сообщений: {activity['messages']}, участников: {activity['posters']}",
+    ]
+    hour, hour_messages = activity["busiest_hour"]
+    started = datetime.datetime.fromtimestamp(hour, UTC_PLUS_ONE).strftime('%Y-%m-%d %H:%M')
+    lines.append(f"Самый активный час: {started} UTC+1 ({hour_messages} сообщений)")
+    lines.append("")
+    lines.append("Самые активные темы:")
+    for position, (thread_id, messages, posters) in enumerate(activity["threads"], start=1):
+        lines.append(f"{position}. {get_thread_name(thread_id)}: {messages} сообщений, {posters} участников")
+    return "\n".join(lines)
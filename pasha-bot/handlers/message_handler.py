@@ -1,57 +1,74 @@
+import asyncio
 import logging
 from telegram import Update
 from telegram.ext import ContextTypes
-from db.db_manager import insert_message
+from db.ingestion import enqueue_message
+from utils.log_setup import PAYLOAD
+from utils.metrics import ERRORS, SUMMARY_THREAD_DELETIONS
 from ai_api.gemini.api_client import get_gemini_summary  # Import the existing Gemini integration
+from ai_api.rate_limiter import PRIORITY_MENTION, request_context
+from db.chat_store import get_summary_thread_id
+from config import EXCLUDED_BOTS
+from workers.dispatch import submit_job, use_workers
 
 # Set up logging for this module
 logger = logging.getLogger(__name__)
 
-# List of bot usernames to exclude from deletion
-EXCLUDED_BOTS = ['SummaryProBot', 'NokolayDevBot']  # Replace with actual bot usernames
-
-# Specify the thread ID from which you want to delete messages
-TARGET_THREAD_ID = 20284  # Replace with your specific thread ID
 
 # Bot mention keyword
 BOT_NICKNAME = '@NokolayDevBot'  # The nickname of the bot to look for in messages
 
+# Replies to a mention when Gemini gave no answer
+MENTION_EMPTY_REPLY = "Sorry, I didn't get a proper response from the Gemini API."
+MENTION_TIMEOUT_REPLY = "Gemini is taking too long to answer right now. Please try again in a few minutes."
+MENTION_ERROR_REPLY = "An error occurred while processing your request. Please try again later."
+
 async def handle_and_clean_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Ensure the update contains a message before proceeding
     if update.message:
         username = update.effective_user.username if update.effective_user else "Unknown User"
         message_text = update.message.text or "No text content"
         thread_id = update.message.message_thread_id if update.message.is_topic_message else 10000
-        
-        logger.info(f"Handling message from {username}: {message_text} in thread {thread_id}")
+        # Messages in the chat's summary thread are deleted to keep it for digests only
+        target_thread_id = get_summary_thread_id(update.effective_chat.id)
+
+        logger.info(f"Handling message from {username}: {message_text} in thread {thread_id}", extra=PAYLOAD)
 
         # Store the message in the database
         if message_text:
             message_details = extract_message_details(update)
-            insert_message(*message_details)  # Store the message in the database
-            logger.info(f"Stored message from {message_details[2]} (ID: {message_details[0]}) in the database.")
+            enqueue_message(*message_details)  # Queue the message for the database writer
+            logger.info(f"Queued message from {message_details[2]} (ID: {message_details[0]}) for the database.")
         
-        # Check if the message contains the bot's nickname
+        # Check if the message contains the bot's nickname. The reply is made by a summary
+        # worker, or by a background task, so the Gemini call doesn't hold up the next updates.
         if BOT_NICKNAME in message_text:
-            response_text = await handle_bot_mention(message_text)
-            if response_text:
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text=response_text,
-                    reply_to_message_id=update.message.message_id
+            if use_workers():
+                try:
+                    await asyncio.to_thread(submit_job, "mention", {
+                        "chat_id": update.effective_chat.id, "message_id": update.message.message_id,
+                        "text": message_text, "username": username}, PRIORITY_MENTION)
+                except Exception as e:
+                    ERRORS.inc(source="mention")
+                    logger.error(f"Failed to queue a mention reply: {str(e)}")
+            else:
+                context.application.create_task(
+                    reply_to_mention(context.bot, update.effective_chat.id, update.message.message_id, message_text, username),
+                    update=update
                 )
-                logger.info(f"Replied to mention from {username} with message: {response_text}")
 
         # Check if the message is in the target thread and not from an excluded bot
-        if thread_id == TARGET_THREAD_ID:
+        if target_thread_id is not None and thread_id == target_thread_id:
             if username not in EXCLUDED_BOTS:
                 try:
                     await context.bot.delete_message(
                         chat_id=update.effective_chat.id,
                         message_id=update.message.message_id
                     )
-                    logger.info(f"Deleted message from {username}: {message_text}")
+                    SUMMARY_THREAD_DELETIONS.inc()
+                    logger.info(f"Deleted message from {username}: {message_text}", extra=PAYLOAD)
                 except Exception as e:
+                    ERRORS.inc(source="delete_message")
                     logger.error(
                         f"Error deleting message: {str(e)} - Message ID: {update.message.message_id}, "
                         f"Thread ID: {thread_id}, Chat ID: {update.effective_chat.id}"
@@ -59,30 +76,48 @@ async def handle_and_clean_messages(update: Update, context: ContextTypes.DEFAUL
             else:
                 logger.info(f"Message from excluded bot: {username}. Not deleting.")
         else:
-            logger.info(f"Message not from target thread ID {TARGET_THREAD_ID}. Ignoring.")
+            logger.info(f"Message not from target thread ID {target_thread_id}. Ignoring.")
     else:
         logger.warning("Received an update with no message content. Skipping.")
 
+async def reply_to_mention(bot, chat_id: int, message_id: int, message_text: str, username: str):
+    """Answer a message that mentions the bot with a reply to that message."""
+    with request_context(PRIORITY_MENTION):
+        response_text = await handle_bot_mention(message_text)
+    if response_text:
+        await bot.send_message(
+            chat_id=chat_id,
+            text=response_text,
+            reply_to_message_id=message_id
+        )
+        logger.info(f"Replied to mention from {username} with message: {response_text}", extra=PAYLOAD)
+
 async def handle_bot_mention(message_text: str) -> str:
-    """Send the message content to Gemini API if the bot is mentioned, and return the response text."""
+    """Send the message content to Gemini API if the bot is mentioned, and return the reply text."""
+    # Send the message content to Gemini for a summary or response
     try:
-        # Send the message content to Gemini for a summary or response
-        response_text = get_gemini_summary(message_text)
-
-        # Return the response from Gemini or a fallback message if there is no response
-        return response_text if response_text else "Sorry, I didn't get a proper response from the Gemini API."
-
+        result = await get_gemini_summary(message_text)
     except Exception as e:
-        logger.error(f"Exception when processing bot mention: {str(e)}")
-        return "An error occurred while processing your request. Please try again later."
+        ERRORS.inc(source="mention")
+        logger.error(f"Error answering a mention: {str(e)}")
+        return MENTION_ERROR_REPLY
+    if not result.ok:
+        ERRORS.inc(source="mention")
+        logger.error(f"Gemini failed to answer a mention: {result!r}")
+        return MENTION_TIMEOUT_REPLY if result.timed_out else MENTION_ERROR_REPLY
+
+    # Return the response from Gemini or a fallback message if there is no response
+    return result.text if result.text else MENTION_EMPTY_REPLY
 
 def extract_message_details(update: Update) -> tuple:
     """Extract and return message details as a tuple."""
     message_id = update.message.message_id
     date = update.message.date.isoformat()
+    ts = int(update.message.date.timestamp())
+    chat_id = update.effective_chat.id
     username = update.effective_user.username or update.effective_user.first_name or "Unknown User"
     thread_id = update.message.message_thread_id if update.message.is_topic_message else 10000
     message_text = update.message.text or "No text content"
 
     logger.info(f"Extracted message details from {username} (ID: {message_id}) in thread {thread_id}.")
-    return message_id, date, username, message_text, thread_id
+    return message_id, date, username, message_text, thread_id, chat_id, ts
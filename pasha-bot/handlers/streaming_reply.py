@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time
+from telegram.error import BadRequest, RetryAfter
+from config import STREAM_EDIT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects messages longer than this
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+PLACEHOLDER_TEXT = "⏳ Готовлю сводку..."
+
+
+class StreamingReply:
+    """Deliver a text that is still being generated by editing a Telegram message in place.
+
+    A placeholder is posted first. Appended text is pushed with
+    ``edit_message_text`` at most once per ``min_edit_interval`` seconds, and
+    once the message reaches Telegram's length limit the text continues in a
+    new message.
+    """
+
+    def __init__(self, bot, chat_id, prefix="", min_edit_interval=STREAM_EDIT_INTERVAL,
+                 limit=TELEGRAM_MESSAGE_LIMIT, clock=time.monotonic, **send_kwargs):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.min_edit_interval = min_edit_interval
+        self.limit = limit
+        self.clock = clock
+        self.send_kwargs = send_kwargs
+
+        self.messages = []  # Messages posted so far, the last one is being edited
+        self._text = prefix  # Text of the current message
+        self._shown_text = None  # What Telegram currently shows for it
+        self._next_edit_at = 0.0
+
+    async def start(self):
+        message = await self.bot.send_message(chat_id=self.chat_id, text=PLACEHOLDER_TEXT, **self.send_kwargs)
+        self.messages.append(message)
+        self._shown_text = PLACEHOLDER_TEXT
+
+    async def append(self, text):
+        self._text += text
+        while len(self._text) > self.limit:
+            await self._roll_over()
+        if self.clock() >= self._next_edit_at:
+            await self._edit()
+
+    async def finish(self, final_text=None):
+        """Show the remaining text. ``final_text`` replaces the current message's text if given."""
+        if final_text is not None:
+            self._text = final_text
+        while len(self._text) > self.limit:
+            await self._roll_over()
+        await self._edit(force=True)
+
+    async def _roll_over(self):
+        # Close the current message at the last line break that fits and continue in a new one
+        cut = self._text.rfind("\n", 0, self.limit)
+        if cut <= 0:
+            cut = self.limit
+        head, self._text = self._text[:cut], self._text[cut:].lstrip("\n")
+        await self._edit(text=head, force=True)
+        message = await self.bot.send_message(chat_id=self.chat_id, text=self._text or PLACEHOLDER_TEXT, **self.send_kwargs)
+        self.messages.append(message)
+        self._shown_text = self._text or PLACEHOLDER_TEXT
+        self._next_edit_at = self.clock() + self.min_edit_interval
+
+    async def _edit(self, text=None, force=False):
+        text = self._text if text is None else text
+        if not text.strip() or text == self._shown_text:
+            return
+        try:
+            await self.bot.edit_message_text(text=text, chat_id=self.chat_id, message_id=self.messages[-1].message_id)
+            self._shown_text = text
+        except RetryAfter as e:
+            retry_after = _seconds(e.retry_after)
+            logger.warning(f"Telegram asked to slow down message edits for {retry_after} seconds.")
+            if not force:
+                # Skip this edit, a later append or finish() shows the text
+                self._next_edit_at = self.clock() + retry_after
+                return
+            await asyncio.sleep(retry_after)
+            await self.bot.edit_message_text(text=text, chat_id=self.chat_id, message_id=self.messages[-1].message_id)
+            self._shown_text = text
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self._next_edit_at = self.clock() + self.min_edit_interval
+
+
+def _seconds(retry_after) -> float:
+    # RetryAfter.retry_after is either seconds or a timedelta depending on the library settings
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
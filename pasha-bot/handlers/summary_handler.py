@@ -1,29 +1,44 @@
+import asyncio
 import logging
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
-from db.fetchers import fetch_last_n_messages
-from ai_api.gemini.prompt_builder import build_prompt
-from ai_api.gemini.api_client import get_gemini_summary
+from config import DAILY_SUMMARY_CHAT_ID, STREAM_SUMMARIES
+from db.chat_store import get_summary_thread_id
+from db.fetchers import build_topic_match_query, fetch_last_n_messages, fetch_topic_messages
+from db.job_queue import queue_position
+from ai_api.rate_limiter import PRIORITY_ON_DEMAND, UserRateLimiter, request_context
+from ai_api.rolling_summaries import apply_thread_summaries
+from ai_api.summarizer import stream_window, summarize_topic, summarize_window
+from ai_api.summary_cache import message_window_fingerprint, summary_cache
+from handlers.streaming_reply import StreamingReply
 from keyboards.buttons import get_start_buttons
-from keyboards.buttons import get_numeric_keyboard
-from utils.formaters.message_formatter import format_messages, replace_thread_ids_with_names
-from collections import defaultdict
-import time
+from keyboards.buttons import get_cancel_keyboard, get_numeric_keyboard
+from utils.formaters.message_formatter import replace_thread_ids_with_names
+from utils.log_setup import PAYLOAD
+from utils.metrics import ERRORS, SUMMARY_STAGE_SECONDS
+from workers.dispatch import submit_job, use_workers
 
 # Constants
 ASK_MESSAGE_COUNT = 1
+ASK_TOPIC = 2
 POSITIVE_NUMBER_ERROR = "Пожалуйста, введите положительное число."
 INVALID_INPUT_ERROR = "Пожалуйста, введите действительное число."
 SUMMARY_NOT_FOUND_MESSAGE = "Сообщения для обобщения не найдены."
 PROCESSING_ERROR_MESSAGE = "Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте еще раз."
 REQUEST_SUMMARY_MESSAGE = "Сколько сообщений вы хотите обобщить?"
+REQUEST_TOPIC_MESSAGE = "О какой теме вы хотите узнать? Напишите одно или несколько ключевых слов."
+INVALID_TOPIC_ERROR = "Пожалуйста, введите хотя бы одно слово."
+TOPIC_NOT_FOUND_MESSAGE = "Сообщения на эту тему не найдены."
+TOPIC_RESPONSE_PREFIX = "О теме «{topic}»:\n\n"
+QUEUED_MESSAGE = "Ваш запрос в очереди, позиция: {position}. Сводка появится автоматически."
 SUMMARY_RESPONSE_PREFIX = "Ключевые обсуждения:\n\n"
-MAX_MESSAGE_COUNT = 1000  # Limit the number of messages to 1000
+STREAM_INTERRUPTED_MESSAGE = "⚠️ Сводка прервана из-за ошибки, показана только её часть. Пожалуйста, попробуйте еще раз."
+MAX_MESSAGE_COUNT = 10000  # Limit the number of messages to 10000, larger windows are summarized with map-reduce
 QUERY_LIMIT = 3  # Maximum queries per minute
 QUERY_TIMEOUT = 60  # Time window for query limit (in seconds)
 
-# To keep track of user queries
-user_queries = defaultdict(list)
+# Per-user token buckets, bounded to the most recently active users
+user_rate_limiter = UserRateLimiter(QUERY_LIMIT, QUERY_TIMEOUT)
 
 async def get_summary(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Ask the user how many messages they want summarized, with a numeric keyboard."""
@@ -51,17 +66,114 @@ async def process_message_count(update: Update, context: ContextTypes.DEFAULT_TY
     try:
         # Validate input
         message_count = validate_message_count(user_input)
-
-        # Fetch and handle messages
-        messages = fetch_last_n_messages(message_count)
-        return await handle_fetched_messages(update, messages)
     except ValueError as e:
         await update.message.reply_text(str(e))
         return ASK_MESSAGE_COUNT
+
+    await run_or_submit(update, "summary", {"chat_id": update.effective_chat.id, "message_count": message_count},
+                        lambda on_queued: deliver_summary(update.get_bot(), update.effective_chat.id, message_count, on_queued))
+    return ConversationHandler.END
+
+async def get_topic_summary(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Ask the user which topic they want summarized."""
+    await update.message.reply_text(REQUEST_TOPIC_MESSAGE, reply_markup=get_cancel_keyboard())
+    return ASK_TOPIC
+
+async def process_topic(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Summarize the messages matching the topic, with the messages around them, instead of a whole window."""
+    topic = update.message.text.strip()
+    user_id = update.message.from_user.id
+    logging.info(f"Received topic: {topic} from user {user_id}")
+
+    # Handle "Cancel"
+    if topic.lower() == "cancel":
+        await update.message.reply_text("Запрос отменен.", reply_markup=get_start_buttons())
+        return ConversationHandler.END
+
+    if build_topic_match_query(topic) is None:
+        await update.message.reply_text(INVALID_TOPIC_ERROR)
+        return ASK_TOPIC
+
+    # Check query limits
+    if not is_query_allowed(user_id):
+        await update.message.reply_text("Превышен лимит запросов. Пожалуйста, подождите минуту и попробуйте снова.")
+        return ASK_TOPIC
+
+    await run_or_submit(update, "topic", {"chat_id": update.effective_chat.id, "topic": topic},
+                        lambda on_queued: deliver_topic_summary(update.get_bot(), update.effective_chat.id, topic, on_queued))
+    return ConversationHandler.END
+
+async def run_or_submit(update: Update, kind: str, payload: dict, deliver):
+    """Hand the request to the summary workers, or deliver it from this process when they are disabled.
+
+    Identical windows share one Gemini call only within a process (summary_cache),
+    so two workers may each summarize the same window.
+    """
+    if use_workers():
+        try:
+            # SQLite writes may wait for the database lock, keep them off the event loop
+            job_id = await asyncio.to_thread(submit_job, kind, payload, PRIORITY_ON_DEMAND)
+            position = await asyncio.to_thread(queue_position, job_id)
+        except Exception as e:
+            ERRORS.inc(source="summary")
+            logging.error(f"Failed to queue a {kind} job: {str(e)}")
+            await update.message.reply_text(PROCESSING_ERROR_MESSAGE)
+            return
+        await update.message.reply_text(QUEUED_MESSAGE.format(position=position))
+        return
+
+    # Tell the user their place if Gemini is busy
+    async def report_queue_position(position):
+        await update.message.reply_text(QUEUED_MESSAGE.format(position=position))
+
+    await deliver(report_queue_position)
+
+async def deliver_summary(bot, chat_id: int, message_count: int, on_queued=None):
+    """Summarize the last ``message_count`` messages and send the summary to ``chat_id``.
+
+    Runs in the bot process or in a summary worker, see workers/job_runner.py.
+    """
+    try:
+        with request_context(PRIORITY_ON_DEMAND, on_queued=on_queued):
+            with SUMMARY_STAGE_SECONDS.time(stage="fetch"):
+                messages = fetch_last_n_messages(message_count)
+            await handle_fetched_messages(bot, chat_id, messages)
     except Exception as e:
+        ERRORS.inc(source="summary")
         logging.error(f"An error occurred: {str(e)}")
-        await update.message.reply_text(PROCESSING_ERROR_MESSAGE)
-        return ConversationHandler.END
+        await bot.send_message(chat_id=chat_id, text=PROCESSING_ERROR_MESSAGE)
+
+async def deliver_topic_summary(bot, chat_id: int, topic: str, on_queued=None):
+    """Summarize what was said about ``topic`` and send the summary to ``chat_id``."""
+    try:
+        with request_context(PRIORITY_ON_DEMAND, on_queued=on_queued):
+            with SUMMARY_STAGE_SECONDS.time(stage="fetch"):
+                source_chat_id = int(DAILY_SUMMARY_CHAT_ID)
+                messages = fetch_topic_messages(topic, source_chat_id, get_summary_thread_id(source_chat_id))
+            logging.info(f"Found {len(messages)} messages for topic {topic}.")
+
+            summary_with_names = None
+            if messages:
+                summary_with_names = await summary_cache.get_or_create(
+                    message_window_fingerprint(messages, topic=topic.lower()),
+                    lambda: summarize_topic_messages(topic, messages)
+                )
+            if summary_with_names is None:
+                # No matches, or only noise around them
+                await bot.send_message(chat_id=chat_id, text=TOPIC_NOT_FOUND_MESSAGE)
+            else:
+                with SUMMARY_STAGE_SECONDS.time(stage="send"):
+                    await bot.send_message(chat_id=chat_id, text=f"{TOPIC_RESPONSE_PREFIX.format(topic=topic)}{summary_with_names}")
+    except Exception as e:
+        ERRORS.inc(source="summary")
+        logging.error(f"An error occurred: {str(e)}")
+        await bot.send_message(chat_id=chat_id, text=PROCESSING_ERROR_MESSAGE)
+
+    await bot.send_message(
+        chat_id=chat_id,
+        text="\n\n Используйте кнопку внизу для нового запроса:",
+        reply_markup=get_start_buttons()  # Send the main menu buttons again
+    )
 
 def validate_message_count(user_input: str) -> int:
     """Validate and return the number of messages."""
@@ -72,59 +184,154 @@ def validate_message_count(user_input: str) -> int:
         raise ValueError(f"Максимум {MAX_MESSAGE_COUNT} сообщений. Пожалуйста, введите меньшее количество.")
     return message_count
 
-async def handle_fetched_messages(update: Update, messages: list) -> int:
-    """Handle the messages fetched from the database and respond with a summary."""
+async def handle_fetched_messages(bot, chat_id: int, messages: list):
+    """Handle the messages fetched from the database and send a summary to ``chat_id``."""
     if not messages:
-        await update.message.reply_text("No messages found for summary.")
+        await bot.send_message(chat_id=chat_id, text="No messages found for summary.")
         # Send the start button again after the response
-        await update.message.reply_text(
-            "Main menu:",
+        await bot.send_message(
+            chat_id=chat_id,
+            text="Main menu:",
             reply_markup=get_start_buttons()  # Send the main menu buttons again
         )
-        return ConversationHandler.END
+        return
 
-    # Step 1: Format the messages (Format once, and only here)
-    formatted_message_block = format_messages(messages)
-    logging.info(f"Formatted message block:\n{formatted_message_block}")
+    if STREAM_SUMMARIES:
+        await stream_summary(bot, chat_id, messages)
+    else:
+        # The same window requested again (or concurrently) is answered from the cache
+        summary_with_names = await summary_cache.get_or_create(
+            message_window_fingerprint(messages),
+            lambda: summarize_messages(messages)
+        )
+
+        # Send the summarized message to the user
+        text = SUMMARY_NOT_FOUND_MESSAGE if summary_with_names is None else f"{SUMMARY_RESPONSE_PREFIX}{summary_with_names}"
+        with SUMMARY_STAGE_SECONDS.time(stage="send"):
+            await bot.send_message(chat_id=chat_id, text=text)
 
-    # Step 2: Replace thread IDs with names (optional, done once here)
-    formatted_message_block_with_names = replace_thread_ids_with_names(formatted_message_block)
-    logging.info(f"Formatted message block with names:\n{formatted_message_block_with_names}")
+    # Ensure the "Get summary" button is displayed after the summary response
+    await bot.send_message(
+        chat_id=chat_id,
+        text="\n\n Используйте кнопку внизу для нового запроса:",
+        reply_markup=get_start_buttons()  # Send the main menu buttons again
+    )
+
+async def stream_summary(bot, chat_id: int, messages: list):
+    """Show the summary while Gemini generates it by editing a placeholder message.
+
+    Requests for the same window while one is streaming wait for it and get
+    the finished summary as a plain message, like cache hits.
+    """
+    streamed = False
+
+    async def stream():
+        nonlocal streamed
+        streamed = True
+        return await stream_window_to_chat(bot, chat_id, messages)
+
+    try:
+        summary_with_names = await summary_cache.get_or_create(message_window_fingerprint(messages), stream)
+    except Exception as e:
+        # Only a joined stream can get here, the streaming request handles its own errors
+        ERRORS.inc(source="summary")
+        logging.error(f"Joined streaming summary failed: {str(e)}")
+        summary_with_names = ""
+    if streamed:
+        return
+    if summary_with_names is None:
+        text = SUMMARY_NOT_FOUND_MESSAGE
+    else:
+        text = f"{SUMMARY_RESPONSE_PREFIX}{summary_with_names}" if summary_with_names else PROCESSING_ERROR_MESSAGE
+    await bot.send_message(chat_id=chat_id, text=text)
 
-    # Step 3: Build the final prompt using the formatted message block (Only once)
-    prompt = build_prompt(formatted_message_block_with_names)  # Here, we use the formatted message only once
-    logging.info(f"Generated prompt for Gemini API:\n{prompt}")
+async def stream_window_to_chat(bot, chat_id: int, messages: list) -> str:
+    """Stream the summary of ``messages`` into a new message and return it with thread names.
 
-    # Step 4: Send the prompt to Gemini API (only once)
-    summary = get_gemini_summary(prompt)
-    logging.info(f"Received summary from Gemini API:\n{summary}")
+    Returns "" on failure and None when every message was noise.
+    """
+    remaining_messages, thread_summaries = apply_thread_summaries(int(DAILY_SUMMARY_CHAT_ID), messages)
+    reply = StreamingReply(bot, chat_id, prefix=SUMMARY_RESPONSE_PREFIX)
+    await reply.start()
+
+    parts = []
+    pending = ""  # Text after the last line break, a thread label may still be incomplete
+    try:
+        # Prompt, Gemini and the progressive edits overlap while streaming, timed as one stage
+        with SUMMARY_STAGE_SECONDS.time(stage="summarize"):
+            async for text in stream_window(remaining_messages, thread_summaries):
+                complete, newline, pending = (pending + text).rpartition("\n")
+                if newline:
+                    # Thread labels never span lines, so complete lines get their names right away
+                    named = replace_thread_ids_with_names(complete + newline)
+                    parts.append(named)
+                    await reply.append(named)
+            if pending:
+                parts.append(replace_thread_ids_with_names(pending))
+                await reply.append(parts[-1])
+    except Exception as e:
+        ERRORS.inc(source="summary")
+        logging.error(f"Streaming summary failed: {str(e)}")
+        if parts:
+            # Keep what was shown, but say it is incomplete
+            await reply.append(f"\n\n{STREAM_INTERRUPTED_MESSAGE}")
+            await reply.finish()
+        else:
+            await reply.finish(PROCESSING_ERROR_MESSAGE)
+        return ""
+
+    if not parts:
+        # The whole window was compacted away, Gemini was never asked
+        await reply.finish(SUMMARY_NOT_FOUND_MESSAGE)
+        return None
+
+    with SUMMARY_STAGE_SECONDS.time(stage="send"):
+        await reply.finish()
+    summary_with_names = "".join(parts)
+    logging.info(f"Streamed summary in {len(reply.messages)} messages:\n{summary_with_names}", extra=PAYLOAD)
+    return summary_with_names
+
+async def summarize_messages(messages: list):
+    """Build the prompt for the fetched messages and return Gemini's summary with thread names.
+
+    Returns None when every message was noise, see summarize_window.
+    """
+    # Step 1: Reuse the rolling thread summaries for the rows they already cover
+    remaining_messages, thread_summaries = apply_thread_summaries(int(DAILY_SUMMARY_CHAT_ID), messages)
+
+    # Step 2-4: Format, build the prompt and send it to Gemini (map-reduce for large windows)
+    with SUMMARY_STAGE_SECONDS.time(stage="summarize"):
+        summary = await summarize_window(remaining_messages, thread_summaries)
+    if summary is None:
+        logging.info("Nothing to summarize after dropping noise messages.")
+        return None
+    logging.info(f"Received summary from Gemini API ({len(summary)} characters).")
 
     # Step 5: Replace thread IDs with names in the summary (if needed)
-    summary_with_names = replace_thread_ids_with_names(summary)
-    logging.info(f"Summary with thread names:\n{summary_with_names}")
+    with SUMMARY_STAGE_SECONDS.time(stage="name_replace"):
+        summary_with_names = replace_thread_ids_with_names(summary)
+    logging.info(f"Summary with thread names:\n{summary_with_names}", extra=PAYLOAD)
 
-    # Step 6: Send the summarized message to the user
-    await update.message.reply_text(f"Ключевые обсуждения:\n\n{summary_with_names}")
+    return summary_with_names
 
-    # Ensure the "Get summary" button is displayed after the summary response
-    await update.message.reply_text(
-        "\n\n Используйте кнопку внизу для нового запроса:",
-        reply_markup=get_start_buttons()  # Send the main menu buttons again
-    )
+async def summarize_topic_messages(topic: str, messages: list):
+    """Return Gemini's summary of what the fetched messages say about the topic, with thread names.
 
-    return ConversationHandler.END
+    Returns None when every message was noise, see summarize_topic.
+    """
+    with SUMMARY_STAGE_SECONDS.time(stage="summarize"):
+        summary = await summarize_topic(topic, messages)
+    if summary is None:
+        logging.info("Nothing to summarize for the topic after dropping noise messages.")
+        return None
+    logging.info(f"Received topic summary from Gemini API ({len(summary)} characters).")
+
+    with SUMMARY_STAGE_SECONDS.time(stage="name_replace"):
+        summary_with_names = replace_thread_ids_with_names(summary)
+    logging.info(f"Topic summary with thread names:\n{summary_with_names}", extra=PAYLOAD)
 
+    return summary_with_names
 
 def is_query_allowed(user_id: int) -> bool:
     """Check if the user is allowed to make a request based on query frequency."""
-    current_time = time.time()
-    # Remove timestamps older than 60 seconds
-    user_queries[user_id] = [timestamp for timestamp in user_queries[user_id] if current_time - timestamp < QUERY_TIMEOUT]
-
-    # Allow the query if the user hasn't made 3 queries in the last minute
-    if len(user_queries[user_id]) >= QUERY_LIMIT:
-        return False
-    
-    # Add current timestamp to the list of queries
-    user_queries[user_id].append(current_time)
-    return True
+    return user_rate_limiter.allow(user_id)
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+import sys
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Process updates of different chats concurrently and those of one chat in arrival order.
+
+    Every chat gets a lock while it has updates in flight. asyncio locks are
+    FIFO, so messages of a chat are stored and deleted in the order Telegram
+    sent them, while a slow handler in one chat doesn't hold up the others.
+    Updates without a chat (e.g. some inline queries) run unordered.
+
+    At most ``max_concurrent_updates`` updates run at once. The slot is taken
+    after the chat's lock: PTB's own semaphore is held while waiting for it,
+    so a burst in one chat would fill every slot and stall the other chats.
+    That semaphore is therefore left unbounded.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        super().__init__(sys.maxsize)
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chats = {}  # chat_id -> [lock, updates waiting or running]
+
+    async def do_process_update(self, update, coroutine):
+        chat_id = _chat_id(update)
+        if chat_id is None:
+            async with self._running:
+                await coroutine
+            return
+
+        entry = self._chats.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self._running:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                # Drop idle chats so the table only holds chats with updates in flight
+                del self._chats[chat_id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        # Application.stop() waits for every queued update first, so nothing should be left here
+        if self._chats:
+            logger.warning(f"Update processor shut down with {len(self._chats)} chats still in flight.")
+
+
+def _chat_id(update):
+    if isinstance(update, Update) and update.effective_chat:
+        return update.effective_chat.id
+    return None
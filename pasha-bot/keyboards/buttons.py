@@ -4,6 +4,7 @@ def get_start_buttons():
     """Returns the buttons for the /start command."""
     buttons = [
         [KeyboardButton("🚀 Get summary")],  # Main start button with an icon
+        [KeyboardButton("🔎 Summary by topic")],  # Summary of the messages about one topic
     ]
     return ReplyKeyboardMarkup(
         buttons,
@@ -25,3 +26,15 @@ def get_numeric_keyboard():
         one_time_keyboard=True,  # Hides the keyboard after input
         input_field_placeholder="Введите число или выберите ниже"  # Placeholder text
     )
+
+def get_cancel_keyboard():
+    """Returns a keyboard with only the cancel option, for free text input."""
+    buttons = [
+        [KeyboardButton("Cancel")],
+    ]
+    return ReplyKeyboardMarkup(
+        buttons,
+        resize_keyboard=True,  # Adjusts the keyboard to fit buttons
+        one_time_keyboard=True,  # Hides the keyboard after input
+        input_field_placeholder="Введите тему"  # Placeholder text
+    )
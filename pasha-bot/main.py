@@ -1,52 +1,157 @@
+import asyncio
+import contextlib
 import logging
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ConversationHandler
-from config import TG_TOKEN
-from handlers.commands import start, help_command
+from config import (BOT_MODE, METRICS_HOST, METRICS_PORT, TG_TOKEN, UPDATE_CONCURRENCY, WEBHOOK_LISTEN, WEBHOOK_PATH,
+                    WEBHOOK_PORT, WEBHOOK_SECRET_TOKEN, WEBHOOK_URL, WORKER_SCALE_INTERVAL)
+from handlers.commands import start, help_command, digest_here, stats
 from handlers.message_handler import handle_and_clean_messages
-from handlers.summary_handler import get_summary, process_message_count, ASK_MESSAGE_COUNT
+from handlers.summary_handler import (get_summary, get_topic_summary, process_message_count, process_topic,
+                                      ASK_MESSAGE_COUNT, ASK_TOPIC)
+from handlers.update_processor import ChatOrderedUpdateProcessor
 from db.db_manager import setup_database
+from db.ingestion import start_ingestion, stop_ingestion
+from db.job_queue import count_claimable_jobs
+from ai_api.gemini.api_client import GeminiClient, set_gemini_client
 from cron.scheduler import schedule_jobs
+from utils.log_setup import setup_logging, shutdown_logging
+from utils.metrics import SUMMARY_JOBS_WAITING, SUMMARY_WORKERS_RUNNING, start_metrics_server, timed_handler
+from workers.dispatch import use_workers
+from workers.pool import WorkerPool, collect_worker_metrics, scale_worker_pool
 
-# Set up logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
+# Connect to Gemini and serve the metrics endpoint from the bot's event loop
+async def on_startup(application):
+    # Updates are handled right away; the Gemini SDK import and warm-up run in the background
+    gemini_client = GeminiClient()
+    set_gemini_client(gemini_client)
+    application.bot_data["gemini_client"] = gemini_client
+    if use_workers():
+        # Summaries run in the worker processes, they warm up their own clients
+        start_worker_pool(application)
+    else:
+        application.bot_data["gemini_warm_up"] = asyncio.create_task(gemini_client.start())
+
+    if METRICS_PORT:
+        application.bot_data["metrics_server"] = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+# Start the summary workers and keep the pool sized to the job queue
+def start_worker_pool(application):
+    pool = WorkerPool()
+    pool.scale()
+    application.bot_data["worker_pool"] = pool
+    SUMMARY_JOBS_WAITING.set_function(count_claimable_jobs)
+    SUMMARY_WORKERS_RUNNING.set_function(lambda: pool.size)
+    application.job_queue.run_repeating(
+        callback=scale_worker_pool,
+        interval=WORKER_SCALE_INTERVAL,
+        data=pool,
+        name="summary_worker_pool",
+    )
+    logger.info(f"Started {pool.size} summary workers, checking the queue every {WORKER_SCALE_INTERVAL} seconds")
+
+# Flush queued messages and log records once the bot has stopped processing updates
+async def on_shutdown(application):
+    worker_pool = application.bot_data.pop("worker_pool", None)
+    if worker_pool is not None:
+        # Workers finish the job they are running, unfinished jobs stay queued for the next start
+        await asyncio.to_thread(worker_pool.stop)
+        # Leave no worker reports behind for the next start
+        await asyncio.to_thread(collect_worker_metrics)
+    metrics_server = application.bot_data.pop("metrics_server", None)
+    if metrics_server is not None:
+        metrics_server.close()
+    warm_up = application.bot_data.pop("gemini_warm_up", None)
+    if warm_up is not None:
+        warm_up.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await warm_up
+    gemini_client = application.bot_data.pop("gemini_client", None)
+    if gemini_client is not None:
+        await gemini_client.close()
+    stop_ingestion()
+    shutdown_logging()
+
+# Build the application with all handlers. `request` replaces the HTTP layer for the
+# Bot API (e.g. a fake one in tests/load) and `update_processor` the update concurrency.
+def build_application(token=TG_TOKEN, request=None, update_processor=None):
+    builder = ApplicationBuilder().token(token).post_init(on_startup).post_shutdown(on_shutdown)
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+
+    # Updates of different chats are handled concurrently, in order within a chat
+    builder = builder.concurrent_updates(update_processor or ChatOrderedUpdateProcessor(UPDATE_CONCURRENCY))
+    application = builder.build()
+
+    # Add conversation handler for summarization input in private bot part.
+    # Every callback is wrapped to record its latency in the metrics.
+    conv_handler = ConversationHandler(
+        entry_points=[
+            MessageHandler(filters.TEXT & filters.Regex(r"🚀 Get summary"), timed_handler(get_summary)),
+            MessageHandler(filters.TEXT & filters.Regex(r"🔎 Summary by topic"), timed_handler(get_topic_summary)),
+        ],
+        states={
+            # Non-blocking so other updates keep flowing while the summary is generated
+            ASK_MESSAGE_COUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, timed_handler(process_message_count), block=False)],
+            ASK_TOPIC: [MessageHandler(filters.TEXT & ~filters.COMMAND, timed_handler(process_topic), block=False)],
+        },
+        fallbacks=[]
+    )
+
+    # Add command handlers
+    application.add_handler(CommandHandler("start", timed_handler(start)))
+    application.add_handler(CommandHandler("help", timed_handler(help_command)))
+    application.add_handler(CommandHandler("digest_here", timed_handler(digest_here)))
+    application.add_handler(CommandHandler("stats", timed_handler(stats)))
+    application.add_handler(MessageHandler(filters.TEXT & (filters.ChatType.GROUP | filters.ChatType.SUPERGROUP), timed_handler(handle_and_clean_messages)))
+    application.add_handler(conv_handler)
+
+    return application
+
+# Receive updates through the configured mode. On SIGINT/SIGTERM both modes stop
+# taking new updates, finish the ones in flight and then run on_shutdown.
+def run(application):
+    if BOT_MODE == "webhook":
+        logger.info(f"Starting the webhook server on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}...")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET_TOKEN,
+        )
+    else:
+        application.run_polling()
+
 # Main function to set up and run the bot
 def main():
+    # Set up logging (file and console output run on a background thread)
+    setup_logging()
+
     if not TG_TOKEN:
         logging.error("Bot token not found in .env file")
         return
 
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        logging.error("WEBHOOK_URL is required when BOT_MODE is webhook")
+        return
+
     # Set up the database
     setup_database()
 
+    # Start the background writer that stores group messages in batches
+    start_ingestion()
+
     # Initialize the bot
-    application = ApplicationBuilder().token(TG_TOKEN).build()
+    application = build_application()
 
     # Schedule jobs for sending summaries
     schedule_jobs(application)
 
-    # Add conversation handler for summarization input in private bot part
-    conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.TEXT & filters.Regex(r"🚀 Get summary"), get_summary)],
-        states={
-            ASK_MESSAGE_COUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_message_count)],
-        },
-        fallbacks=[]
-    )
-
-    # Add command handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(MessageHandler(filters.TEXT & (filters.ChatType.GROUP | filters.ChatType.SUPERGROUP), handle_and_clean_messages))
-    application.add_handler(conv_handler)
-
     logger.info("Starting the bot and job scheduler...")
     # Start the bot
-    application.run_polling()
+    run(application)
 
 if __name__ == '__main__':
     main()
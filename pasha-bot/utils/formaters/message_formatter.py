@@ -1,37 +1,54 @@
-import logging
-from utils.mappers.thread_name_mappings import THREAD_MAPPING
+import io
+import re
+from utils.mappers.thread_name_mappings import THREAD_MAPPING, get_thread_name
 
-def format_messages(messages):
-    formatted_messages = []
+# Matches thread labels like "Thread 14133" that Gemini may echo back in a summary
+THREAD_LABEL_PATTERN = re.compile(r"Thread (\d+|None)")
 
-    try:
-        # Group messages by thread_id
-        grouped_messages = {}
-        for thread_id, username, date, message_content in messages:
-            if thread_id not in grouped_messages:
-                grouped_messages[thread_id] = []
-            grouped_messages[thread_id].append((username, date, message_content))
+def write_messages(buffer, messages, thread_summaries=None):
+    """Write message rows into ``buffer`` grouped by thread, newest rows expected first.
 
-        # Sort threads by the number of messages (optional)
-        sorted_threads = sorted(grouped_messages.items(), key=lambda x: len(x[1]), reverse=True)
+    ``messages`` may be any iterable of (id, thread_id, username, date,
+    message_content) rows, e.g. a cursor; it is read exactly once. Threads are
+    labelled with their resolved names and ordered by volume.
 
-        # Format messages for each thread using thread_id
-        for thread_id, msgs in sorted_threads:
-            formatted_messages.append(f"Thread {thread_id}")  # Include thread ID as title
-            for username, date, message_content in reversed(msgs):  # Reverse for chronological order
-                logging.info(f"Formatting message: {username}, {date}, {message_content}")
-                formatted_messages.append(f"  - {username}: {message_content}")  # Removed timestamp
-            formatted_messages.append("")  # Add a blank line between threads
-    except Exception as e:
-        logging.error(f"Error formatting messages: {str(e)}")
-        raise e  # Rethrow the exception after logging it
+    ``thread_summaries`` optionally maps a thread_id to (summary, covered_count)
+    for earlier messages of that thread that were left out of ``messages``.
+    """
+    thread_summaries = thread_summaries or {}
 
-    return "\n".join(formatted_messages)
+    # Group messages by thread_id in a single pass
+    grouped_messages = {thread_id: [] for thread_id in thread_summaries}
+    for _, thread_id, username, _, message_content in messages:
+        thread_messages = grouped_messages.get(thread_id)
+        if thread_messages is None:
+            thread_messages = grouped_messages[thread_id] = []
+        thread_messages.append((username, message_content))
+
+    # Sort threads by the number of messages, counting the ones covered by a summary
+    def thread_volume(item):
+        thread_id, thread_messages = item
+        return len(thread_messages) + thread_summaries.get(thread_id, ("", 0))[1]
+
+    for thread_id, thread_messages in sorted(grouped_messages.items(), key=thread_volume, reverse=True):
+        buffer.write(get_thread_name(thread_id))
+        buffer.write("\n")
+        if thread_id in thread_summaries:
+            buffer.write(f"  Summary of earlier messages: {thread_summaries[thread_id][0]}\n")
+        for username, message_content in reversed(thread_messages):  # Reverse for chronological order
+            buffer.write(f"  - {username}: {message_content}\n")
+        buffer.write("\n")  # Add a blank line between threads
+
+def format_messages(messages, thread_summaries=None):
+    """Format message rows as a block grouped by named threads, see write_messages."""
+    buffer = io.StringIO()
+    write_messages(buffer, messages, thread_summaries)
+    return buffer.getvalue()
 
 
 def replace_thread_ids_with_names(message_block: str) -> str:
-    """Replaces thread IDs with their corresponding names in a message block."""
-    for thread_id, thread_name in THREAD_MAPPING.items():
-        thread_id_str = f"Thread {thread_id}" if thread_id is not None else "Thread None"
-        message_block = message_block.replace(thread_id_str, thread_name)
-    return message_block
+    """Replaces thread IDs with their corresponding names in a message block, in one pass."""
+    def thread_name(match):
+        thread_id = None if match.group(1) == "None" else int(match.group(1))
+        return THREAD_MAPPING.get(thread_id, match.group(0))
+    return THREAD_LABEL_PATTERN.sub(thread_name, message_block)
@@ -0,0 +1,121 @@
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import shutil
+from datetime import datetime, timezone
+from config import (LOG_ARCHIVE_BACKUP_COUNT, LOG_ARCHIVE_MAX_BYTES, LOG_FOLDER,
+                    LOG_PAYLOAD_MAX_CHARS, LOG_PAYLOAD_SAMPLE_RATE)
+
+# Logger for full Gemini prompts and responses; its records only go to the archive
+ARCHIVE_LOGGER_NAME = "gemini.archive"
+
+# Pass as `extra=PAYLOAD` on log lines that carry chat text, prompts or summaries
+PAYLOAD = {"payload": True}
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_listener = None
+
+
+class PayloadFilter(logging.Filter):
+    """Sample lines flagged as payload and truncate long messages in the normal log stream."""
+
+    def __init__(self, max_chars=LOG_PAYLOAD_MAX_CHARS, sample_rate=LOG_PAYLOAD_SAMPLE_RATE):
+        super().__init__()
+        self.max_chars = max_chars
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        if record.name == ARCHIVE_LOGGER_NAME:
+            return False
+        # The same record reaches every handler, decide and truncate only once
+        kept = getattr(record, "log_kept", None)
+        if kept is None:
+            kept = not getattr(record, "payload", False) or random.random() < self.sample_rate
+            record.log_kept = kept
+            message = record.getMessage()
+            if kept and len(message) > self.max_chars:
+                record.msg = f"{message[:self.max_chars]}... [truncated {len(message) - self.max_chars} chars]"
+                record.args = None
+        return kept
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per archived prompt or response."""
+
+    def format(self, record):
+        return json.dumps({
+            "request_id": getattr(record, "request_id", None),
+            "kind": getattr(record, "kind", None),
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "text": record.getMessage(),
+        }, ensure_ascii=False)
+
+
+def _archive_only(record):
+    return record.name == ARCHIVE_LOGGER_NAME
+
+def _gzip_namer(name):
+    return f"{name}.gz"
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as source_file, gzip.open(dest, "wb") as dest_file:
+        shutil.copyfileobj(source_file, dest_file)
+    os.remove(source)
+
+
+def setup_logging(level=logging.INFO, file_suffix=None):
+    """Route every log record through a queue so logging never blocks the event loop.
+
+    A QueueListener thread writes to the console, log/api_debug.log and the
+    size-rotated, gzip-compressed Gemini archive log/gemini_archive.jsonl.
+    Worker processes pass ``file_suffix`` to write files of their own.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    os.makedirs(LOG_FOLDER, exist_ok=True)
+    formatter = logging.Formatter(LOG_FORMAT)
+    payload_filter = PayloadFilter()
+
+    console_handler = logging.StreamHandler()
+    suffix = f"-{file_suffix}" if file_suffix else ""
+    debug_file_handler = logging.FileHandler(os.path.join(LOG_FOLDER, f"api_debug{suffix}.log"), encoding="utf-8")
+    for handler in (console_handler, debug_file_handler):
+        handler.setFormatter(formatter)
+        handler.addFilter(payload_filter)
+
+    archive_handler = logging.handlers.RotatingFileHandler(
+        os.path.join(LOG_FOLDER, f"gemini_archive{suffix}.jsonl"),
+        maxBytes=LOG_ARCHIVE_MAX_BYTES,
+        backupCount=LOG_ARCHIVE_BACKUP_COUNT,
+        encoding="utf-8",
+    )
+    archive_handler.namer = _gzip_namer
+    archive_handler.rotator = _gzip_rotator
+    archive_handler.setFormatter(JsonLinesFormatter())
+    archive_handler.addFilter(_archive_only)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, console_handler, debug_file_handler, archive_handler, respect_handler_level=True
+    )
+    _listener.start()
+
+def shutdown_logging():
+    """Write out everything still queued and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,286 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Minimal Prometheus-style metrics, rendered in the text exposition format by
+# the endpoint below. Metrics may be updated from any thread (the ingestion
+# writer runs on its own), so every metric guards its values with a lock.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+CHARS_BUCKETS = (100, 1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+TOKENS_BUCKETS = tuple(size // 4 for size in CHARS_BUCKETS)  # utils.tokens estimates 4 characters per token
+
+# Metrics rendered by the endpoint; tests pass a list of their own as ``registry``
+_registry = []
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        (_registry if registry is None else registry).append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+    def _take(self):
+        """Return the values gathered so far and start over, see take_metric_deltas."""
+        return {}
+
+    def _merge(self, key, values):
+        pass
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _take(self):
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def _merge(self, key, value):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """A value read when the metrics are rendered, e.g. a queue length."""
+
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, registry=None):
+        super().__init__(name, documentation, registry=registry)
+        self._function = None
+
+    def set_function(self, function):
+        self._function = function
+
+    def _samples(self):
+        if self._function is None:
+            return []
+        try:
+            return [f"{self.name} {_format_value(self._function())}"]
+        except Exception as e:
+            logger.error(f"Failed to read gauge {self.name}: {str(e)}")
+            return []
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds the enclosed block takes, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            values = self._values.get(self._key(labels))
+            return values[-1] if values else 0
+
+    def _take(self):
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def _merge(self, key, values):
+        if len(values) != len(self.buckets) + 2:
+            return  # Observed with other buckets
+        with self._lock:
+            merged = self._values.setdefault(key, [0] * len(values))
+            for index, value in enumerate(values):
+                merged[index] += value
+
+    def _samples(self):
+        lines = []
+        for key, values in self._values.items():
+            for bound, bucket_count in zip(self.buckets, values):
+                labels = _format_labels(self.labelnames, key, [f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.labelnames, key, ['le="+Inf"'])
+            lines.append(f"{self.name}_bucket{labels} {values[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(float(values[-2]))}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {values[-1]}")
+        return lines
+
+
+def render_metrics(registry=None) -> str:
+    lines = []
+    for metric in _registry if registry is None else registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Summary workers run in processes of their own. After every job a worker takes
+# the counter and histogram values it gathered and queues them in SQLite, the
+# bot process adds them to its metrics, see workers/pool.py. Gauges are only
+# read in the bot process.
+
+def take_metric_deltas(registry=None) -> dict:
+    """Return {name: [[label values, values], ...]} of the metrics and reset them."""
+    deltas = {}
+    for metric in _registry if registry is None else registry:
+        taken = metric._take()
+        if taken:
+            deltas[metric.name] = [[list(key), values] for key, values in taken.items()]
+    return deltas
+
+
+def merge_metric_deltas(deltas, registry=None):
+    """Add the deltas another process took with take_metric_deltas to the metrics of the same name."""
+    metrics_by_name = {metric.name: metric for metric in (_registry if registry is None else registry)}
+    for name, entries in deltas.items():
+        metric = metrics_by_name.get(name)
+        if metric is None:
+            continue
+        for key, values in entries:
+            metric._merge(tuple(key), values)
+
+
+# --- Metrics of the bot ---
+
+SUMMARY_STAGE_SECONDS = Histogram(
+    "pasha_summary_stage_seconds", "Time spent in each stage of an on-demand or scheduled summary.", ["stage"])
+DB_INSERT_SECONDS = Histogram("pasha_db_insert_seconds", "Time to write one batch of messages.")
+DB_INSERT_BATCH_SIZE = Histogram(
+    "pasha_db_insert_batch_size", "Messages written per batch.", buckets=(1, 5, 10, 25, 50, 100, 200, 500, 1000))
+DB_FETCH_SECONDS = Histogram("pasha_db_fetch_seconds", "Time to run a message fetch query.", ["query"])
+GEMINI_REQUEST_SECONDS = Histogram(
+    "pasha_gemini_request_seconds", "Gemini call latency, including the wait for a scheduler slot.", ["mode", "outcome"])
+GEMINI_PROMPT_CHARS = Histogram("pasha_gemini_prompt_chars", "Prompt size in characters.", buckets=CHARS_BUCKETS)
+GEMINI_PROMPT_TOKENS = Histogram("pasha_gemini_prompt_tokens", "Estimated prompt size in tokens.", buckets=TOKENS_BUCKETS)
+GEMINI_RESPONSE_CHARS = Histogram("pasha_gemini_response_chars", "Response size in characters.", buckets=CHARS_BUCKETS)
+GEMINI_RESPONSE_TOKENS = Histogram("pasha_gemini_response_tokens", "Estimated response size in tokens.", buckets=TOKENS_BUCKETS)
+GEMINI_ATTEMPTS = Counter(
+    "pasha_gemini_attempts_total", "Gemini attempts by model and outcome, including retries.", ["model", "outcome"])
+GEMINI_HEDGES = Counter("pasha_gemini_hedges_total", "Hedged Gemini requests by which request answered first.", ["winner"])
+HANDLER_SECONDS = Histogram("pasha_handler_seconds", "Time a Telegram update handler took.", ["handler"])
+ERRORS = Counter("pasha_errors_total", "Errors by where they happened.", ["source"])
+SUMMARY_THREAD_DELETIONS = Counter(
+    "pasha_summary_thread_deletions_total", "Messages deleted from a summary thread.")
+COMPACTION_SAVED_CHARS = Counter(
+    "pasha_compaction_saved_chars_total", "Prompt characters removed by message compaction.")
+COMPACTION_SAVED_TOKENS = Counter(
+    "pasha_compaction_saved_tokens_total", "Estimated prompt tokens removed by message compaction.")
+DIGEST_TRIGGERS = Counter(
+    "pasha_digest_triggers_total", "Digest decisions per chat: scheduled, early or skipped.", ["trigger"])
+ARCHIVED_MESSAGES = Counter("pasha_archived_messages_total", "Messages moved from the hot table to the archive.")
+INGEST_QUEUE_DEPTH = Gauge("pasha_ingest_queue_depth", "Messages waiting for the database writer.")
+GEMINI_QUEUE_DEPTH = Gauge("pasha_gemini_queue_depth", "Gemini calls waiting for a scheduler slot.")
+SUMMARY_JOBS_WAITING = Gauge("pasha_summary_jobs_waiting", "Summary jobs waiting for a worker.")
+SUMMARY_WORKERS_RUNNING = Gauge("pasha_summary_workers_running", "Summary worker processes running.")
+
+
+def timed_handler(callback):
+    """Wrap a Telegram handler callback to record its latency and failures under its name."""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        with HANDLER_SECONDS.time(handler=name):
+            try:
+                return await callback(*args, **kwargs)
+            except Exception:
+                ERRORS.inc(source=f"handler.{name}")
+                raise
+
+    return wrapper
+
+
+# --- HTTP endpoint ---
+
+async def _serve_metrics(reader, writer, registry=None):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # Skip the headers, the response doesn't depend on them
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", render_metrics(registry).encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except Exception as e:
+        logger.warning(f"Failed to serve a metrics request: {str(e)}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host, port, registry=None):
+    """Serve GET /metrics on ``host``:``port`` from the running event loop. Returns the asyncio server."""
+    server = await asyncio.start_server(functools.partial(_serve_metrics, registry=registry), host, port)
+    logger.info(f"Metrics endpoint listening on {host}:{port}/metrics")
+    return server
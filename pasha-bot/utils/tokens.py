@@ -0,0 +1,7 @@
+# Rough token estimate used for prompt budgeting. Gemini averages about four
+# characters per token for mixed Russian/English chat text; budgets built on
+# it leave enough headroom that an exact tokenizer is not needed.
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
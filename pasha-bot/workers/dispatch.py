@@ -0,0 +1,14 @@
+# Hands Gemini work from the bot process to the summary workers, see workers/pool.py
+from config import SUMMARY_WORKERS
+from db.job_queue import enqueue_job
+
+def use_workers():
+    """Whether summaries, digests and mention replies run in the worker processes."""
+    return SUMMARY_WORKERS
+
+def submit_job(kind, payload, priority, dedupe_key=None):
+    """Queue a job for the workers, see workers/job_runner.py for the kinds.
+
+    Returns the job id, or None if an open job with the same ``dedupe_key`` exists.
+    """
+    return enqueue_job(kind, payload, priority, dedupe_key)
@@ -0,0 +1,36 @@
+# What a summary worker does for each kind of job. Every handler gets the
+# worker's Bot and the job payload and posts its result to Telegram itself.
+from ai_api.rolling_summaries import update_rolling_summaries
+from cron.scheduler import send_digests
+from handlers.message_handler import reply_to_mention
+from handlers.summary_handler import deliver_summary, deliver_topic_summary
+
+async def run_summary(bot, payload):
+    await deliver_summary(bot, payload["chat_id"], payload["message_count"])
+
+async def run_topic(bot, payload):
+    await deliver_topic_summary(bot, payload["chat_id"], payload["topic"])
+
+async def run_mention(bot, payload):
+    await reply_to_mention(bot, payload["chat_id"], payload["message_id"], payload["text"], payload["username"])
+
+async def run_digest(bot, payload):
+    # send_digests gives up on the chat after DIGEST_CHAT_TIMEOUT
+    await send_digests(bot, [(payload["chat_id"], payload["summary_thread_id"])])
+
+async def run_rolling(bot, payload):
+    await update_rolling_summaries()
+
+JOB_HANDLERS = {
+    "summary": run_summary,
+    "topic": run_topic,
+    "mention": run_mention,
+    "digest": run_digest,
+    "rolling": run_rolling,
+}
+
+async def run_job(bot, job):
+    handler = JOB_HANDLERS.get(job.kind)
+    if handler is None:
+        raise ValueError(f"Unknown job kind: {job.kind}")
+    await handler(bot, job.payload)
@@ -0,0 +1,103 @@
+# Starts summary worker processes as the job queue grows. Workers above the
+# minimum exit on their own once they found nothing to do for WORKER_IDLE_EXIT.
+import asyncio
+import itertools
+import logging
+import math
+import multiprocessing
+import os
+import time
+from config import JOBS_PER_WORKER, SUMMARY_WORKERS_MAX, SUMMARY_WORKERS_MIN, WORKER_IDLE_EXIT
+from db.job_queue import count_claimable_jobs
+from db.worker_metrics_store import drain_metric_deltas
+from utils.metrics import ERRORS, merge_metric_deltas
+from workers.summary_worker import run_worker
+
+logger = logging.getLogger(__name__)
+
+class WorkerPool:
+    def __init__(self, min_workers=SUMMARY_WORKERS_MIN, max_workers=SUMMARY_WORKERS_MAX,
+                 jobs_per_worker=JOBS_PER_WORKER, idle_exit=WORKER_IDLE_EXIT):
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.jobs_per_worker = jobs_per_worker
+        self.idle_exit = idle_exit
+        # Spawned, not forked: a worker must not inherit the bot's event loop, threads and sockets
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = self._context.Event()
+        # Read by the workers to split the Gemini quota between those running
+        self._live_workers = self._context.Value("i", 0)
+        self._workers = []  # (process, kept) where kept workers don't exit when idle
+        self._numbers = itertools.count(1)
+
+    @property
+    def size(self) -> int:
+        return len(self._workers)
+
+    def target_size(self, claimable_jobs) -> int:
+        wanted = math.ceil(claimable_jobs / self.jobs_per_worker)
+        return min(max(wanted, self.min_workers), self.max_workers)
+
+    def scale(self, claimable_jobs=None) -> int:
+        """Replace exited workers and start new ones for the waiting jobs. Returns the pool size."""
+        self._reap()
+        if self._stop_event.is_set():
+            return self.size
+        if claimable_jobs is None:
+            claimable_jobs = count_claimable_jobs()
+        target = self.target_size(claimable_jobs)
+        while self.size < target:
+            kept = sum(1 for _, kept in self._workers if kept) < self.min_workers
+            self._start_worker(kept)
+        self._live_workers.value = self.size
+        return self.size
+
+    def stop(self, timeout=30):
+        """Let every worker finish its current job, then terminate the ones still running after ``timeout``."""
+        self._stop_event.set()
+        deadline = time.monotonic() + timeout
+        for process, _ in self._workers:
+            process.join(max(deadline - time.monotonic(), 0))
+        for process, _ in self._workers:
+            if process.is_alive():
+                logger.warning(f"{process.name} did not stop in time, terminating it.")
+                process.terminate()
+                process.join()
+        self._workers.clear()
+
+    def _start_worker(self, kept):
+        worker_id = f"{os.getpid()}-{next(self._numbers)}"
+        process = self._context.Process(
+            target=run_worker,
+            args=(worker_id, self._stop_event, self._live_workers, None if kept else self.idle_exit),
+            name=f"summary-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        self._workers.append((process, kept))
+        logger.info(f"Started {process.name} (pid {process.pid}), {self.size} workers running.")
+
+    def _reap(self):
+        running = []
+        for process, kept in self._workers:
+            if process.is_alive():
+                running.append((process, kept))
+                continue
+            process.join()
+            if process.exitcode:
+                # Its job is claimed again by another worker once the lease expires
+                ERRORS.inc(source="summary_worker")
+                logger.error(f"{process.name} exited with code {process.exitcode}.")
+        self._workers = running
+        self._live_workers.value = self.size
+
+def collect_worker_metrics():
+    """Add the metrics the workers reported since the last call to this process's, which /metrics serves."""
+    for deltas in drain_metric_deltas():
+        merge_metric_deltas(deltas)
+
+async def scale_worker_pool(context):
+    """Job callback: size the pool passed as the job data to the queue and collect the workers' metrics."""
+    pool = context.job.data
+    await asyncio.to_thread(pool.scale)
+    await asyncio.to_thread(collect_worker_metrics)
@@ -0,0 +1,127 @@
+# A summary worker process: claims jobs from the queue and runs them with its
+# own Bot and Gemini client, see workers/pool.py for how workers are started.
+import asyncio
+import contextlib
+import logging
+import time
+from telegram import Bot
+from config import GEMINI_REQUESTS_PER_MINUTE, GEMINI_TOKENS_PER_MINUTE, JOB_LEASE_SECONDS, JOB_POLL_INTERVAL, TG_TOKEN
+from ai_api.gemini import api_client
+from ai_api.gemini.api_client import GeminiClient, set_gemini_client
+from db.job_queue import claim_job, extend_lease, finish_job
+from db.worker_metrics_store import save_metric_deltas
+from utils.log_setup import setup_logging, shutdown_logging
+from utils.metrics import ERRORS, take_metric_deltas
+from workers.job_runner import run_job
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the running worker count, see follow_quota_share
+QUOTA_SHARE_INTERVAL = 1.0
+
+class SummaryWorker:
+    """Runs one job at a time and keeps renewing its lease while the job runs.
+
+    A job whose lease can't be renewed was taken over by another worker and is
+    cancelled here. ``idle_exit`` stops the worker after that many seconds
+    without a job (None keeps it running).
+    """
+
+    def __init__(self, bot, worker_id, lease_seconds=JOB_LEASE_SECONDS, poll_interval=JOB_POLL_INTERVAL, idle_exit=None):
+        self.bot = bot
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.idle_exit = idle_exit
+
+    async def run(self, stop_event):
+        idle_since = time.monotonic()
+        while not stop_event.is_set():
+            if await self.run_once():
+                idle_since = time.monotonic()
+                continue
+            if self.idle_exit is not None and time.monotonic() - idle_since >= self.idle_exit:
+                logger.info(f"Worker {self.worker_id} idle for {self.idle_exit} seconds, exiting.")
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    async def run_once(self) -> bool:
+        """Claim and run the next job. Returns False when the queue was empty."""
+        job = claim_job(self.worker_id, self.lease_seconds)
+        if job is None:
+            return False
+
+        logger.info(f"Worker {self.worker_id} running {job!r}.")
+        task = asyncio.create_task(run_job(self.bot, job))
+        heartbeat = asyncio.create_task(self._heartbeat(job, task))
+        try:
+            await task
+            finish_job(job.id, self.worker_id)
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            logger.warning(f"Worker {self.worker_id} lost the lease of {job!r}, dropped it.")
+        except Exception as e:
+            ERRORS.inc(source="summary_job")
+            logger.error(f"Worker {self.worker_id} failed {job!r}: {str(e)}")
+            finish_job(job.id, self.worker_id, error=str(e))
+        finally:
+            heartbeat.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await heartbeat
+            self._report_metrics()
+        return True
+
+    def _report_metrics(self):
+        # The bot process adds them to the metrics it serves, see workers/pool.py
+        try:
+            save_metric_deltas(take_metric_deltas())
+        except Exception as e:
+            logger.error(f"Worker {self.worker_id} failed to report its metrics: {str(e)}")
+
+    async def _heartbeat(self, job, task):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not extend_lease(job.id, self.worker_id, self.lease_seconds):
+                task.cancel()
+                return
+
+def apply_quota_share(workers):
+    """Give this process its part of the Gemini quota while ``workers`` workers are running."""
+    workers = max(workers, 1)
+    api_client.gemini_scheduler.set_quota(max(GEMINI_REQUESTS_PER_MINUTE // workers, 1),
+                                          max(GEMINI_TOKENS_PER_MINUTE // workers, 1))
+
+async def follow_quota_share(live_workers, interval=QUOTA_SHARE_INTERVAL):
+    # The pool updates the worker count as it scales. Right after a new worker
+    # starts the others may still use their larger share for up to a minute.
+    workers = None
+    while True:
+        if live_workers.value != workers:
+            workers = live_workers.value
+            apply_quota_share(workers)
+        await asyncio.sleep(interval)
+
+async def _serve(worker_id, stop_event, idle_exit, live_workers):
+    gemini_client = GeminiClient()
+    set_gemini_client(gemini_client)
+    await gemini_client.start()
+    quota_share = asyncio.create_task(follow_quota_share(live_workers))
+    try:
+        async with Bot(TG_TOKEN) as bot:
+            await SummaryWorker(bot, worker_id, idle_exit=idle_exit).run(stop_event)
+    finally:
+        quota_share.cancel()
+        await gemini_client.close()
+
+def run_worker(worker_id, stop_event, live_workers, idle_exit=None):
+    """Entry point of a worker process. ``live_workers`` is the pool's shared worker count."""
+    setup_logging(file_suffix=f"worker-{worker_id}")
+    logger.info(f"Summary worker {worker_id} started.")
+    try:
+        asyncio.run(_serve(worker_id, stop_event, idle_exit, live_workers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info(f"Summary worker {worker_id} stopped.")
+        shutdown_logging()
@@ -0,0 +1,84 @@
+"""Synthetic group chat data for the benchmarks.
+
+Messages are spread over the threads of THREAD_MAPPING with a skewed
+(Zipf-like) distribution, written by a pool of users of which a few are
+much more active, and made of Russian sentences of varying length with the
+occasional link or emoji, like the real group. Output is deterministic for a
+given seed.
+"""
+import random
+from datetime import datetime, timezone
+from db.db_manager import connect, insert_messages
+from utils.mappers.thread_name_mappings import THREAD_MAPPING
+
+CHAT_ID = -1002261651604
+START_TS = 1704067200  # 2024-01-01 00:00 UTC
+MESSAGES_PER_DAY = 2000
+BATCH_SIZE = 50000
+
+WORDS = (
+    "привет всем кто сегодня идёт на встречу вечером после работы я думаю что это отличная идея "
+    "давайте обсудим релиз новый бот сводка задача проект команда код сервер база данных ошибка "
+    "исправил проверил запустил тесты прошли вроде работает спасибо большое согласен не уверен "
+    "может быть завтра утром в пятницу на выходных погода хорошая бегать парк музыка книга читаю "
+    "посоветуйте пожалуйста кто знает как настроить докер питон телеграм гемини модель промпт "
+    "ссылка статья интересно смешно очень круто поздравляю с днём рождения вопрос ответ помощь"
+).split()
+EXTRAS = ["😂", "👍", "🔥", "🙏", "https://example.com/article", "?", "!", "..."]
+USERNAMES = [f"user{i:03d}" for i in range(150)] + ["stas", "olga", "ivan", "maria", "pasha"]
+
+
+def _weights(count, exponent=1.1):
+    return [1 / (rank + 1) ** exponent for rank in range(count)]
+
+
+class ChatGenerator:
+    def __init__(self, seed=42, chat_id=CHAT_ID, messages_per_day=MESSAGES_PER_DAY):
+        self.random = random.Random(seed)
+        self.chat_id = chat_id
+        self.seconds_per_message = 86400 / messages_per_day
+        self.thread_ids = list(THREAD_MAPPING) + [None]
+        self.thread_weights = _weights(len(self.thread_ids))
+        self.user_weights = _weights(len(USERNAMES), exponent=0.9)
+
+    def sentence(self):
+        words = self.random.choices(WORDS, k=max(1, int(self.random.expovariate(1 / 12))))
+        if self.random.random() < 0.15:
+            words.append(self.random.choice(EXTRAS))
+        text = " ".join(words)
+        return text[0].upper() + text[1:]
+
+    def rows(self, count, start_index=0):
+        """Yield ``count`` rows for db_manager.insert_messages."""
+        choices = self.random.choices
+        for index in range(start_index, start_index + count):
+            ts = START_TS + int(index * self.seconds_per_message)
+            date = datetime.fromtimestamp(ts, timezone.utc).isoformat()
+            thread_id = choices(self.thread_ids, self.thread_weights)[0]
+            username = choices(USERNAMES, self.user_weights)[0]
+            yield (index + 1, date, username, self.sentence(), thread_id, self.chat_id, ts)
+
+    def fetched_rows(self, count):
+        """Return ``count`` rows shaped like the fetchers return them, newest first."""
+        rows = [(message_id, thread_id, username, date, content)
+                for message_id, date, username, content, thread_id, _, _ in self.rows(count)]
+        rows.reverse()
+        return rows
+
+    def summary_text(self, threads):
+        """A Gemini-style summary that labels ``threads`` thread blocks as "Thread <id>"."""
+        blocks = []
+        for index in range(threads):
+            thread_id = self.thread_ids[index % len(self.thread_ids)]
+            blocks.append(f"Thread {thread_id}\n" + " ".join(self.sentence() + "." for _ in range(5)))
+        return "\n\n".join(blocks)
+
+
+def populate(count, seed=42, path=None):
+    """Fill the database at ``path`` (the configured one by default) with ``count`` synthetic messages, in batches."""
+    generator = ChatGenerator(seed)
+    conn = connect(path=path)
+    for start in range(0, count, BATCH_SIZE):
+        insert_messages(conn, list(generator.rows(min(BATCH_SIZE, count - start), start_index=start)))
+    conn.close()
+    return generator
@@ -0,0 +1,211 @@
+"""Benchmarks for the storage and formatting hot paths and the Gemini call overhead.
+
+Run from the repository root:
+
+    python -m tests.benchmarks.run_benchmarks --sizes 10000,100000
+    python -m tests.benchmarks.run_benchmarks --save-baseline       # store the current numbers
+    python -m tests.benchmarks.run_benchmarks --baseline tests/benchmarks/baseline.json
+
+Results are written as JSON (median/min seconds per benchmark) to --output,
+benchmark_results.json in --workdir by default. With a baseline the run
+prints the change per benchmark and exits with status 1 when one got slower
+than --threshold. Generated databases are kept in --workdir, so large sizes
+(up to 10M rows) are only generated once. Every database is passed to the
+db functions explicitly; the bot's configured DB_PATH is never touched.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "pasha-bot"))
+
+from db.db_manager import connect, insert_message, insert_messages, setup_database  # noqa: E402
+from db.fetchers import fetch_last_n_messages, fetch_messages_by_date_range  # noqa: E402
+from ai_api.compaction import compact_messages  # noqa: E402
+from ai_api.gemini import api_client  # noqa: E402
+from ai_api.gemini.api_client import GENERATION_PROFILES, GeminiClient  # noqa: E402
+from ai_api.rate_limiter import GeminiScheduler  # noqa: E402
+from ai_api.gemini.prompt_builder import build_prompt, build_summary_prompt  # noqa: E402
+from utils.formaters.message_formatter import format_messages, replace_thread_ids_with_names  # noqa: E402
+from tests.benchmarks.chat_generator import CHAT_ID, ChatGenerator, populate  # noqa: E402
+from tests.load.fake_gemini import FakeGeminiModel  # noqa: E402
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+FETCH_LAST_N = 1000  # Messages per "Get summary" style fetch
+SINGLE_INSERTS = 500  # insert_message opens a connection per call, keep the count small
+GEMINI_CALLS = 200  # generate_text calls per Gemini overhead benchmark
+
+
+def measure(func, repeat):
+    """Run ``func`` ``repeat`` times and return the timing summary in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {"median": statistics.median(timings), "min": min(timings), "repeat": repeat}
+
+
+def bench_inserts(workdir, repeat):
+    results = {}
+    generator = ChatGenerator(seed=1)
+
+    def single_inserts():
+        path = os.path.join(workdir, f"insert_single_{time.perf_counter_ns()}.db")
+        setup_database(path)
+        for row in generator.rows(SINGLE_INSERTS):
+            insert_message(*row, path=path)
+
+    def batch_insert(rows=list(generator.rows(10000))):
+        path = os.path.join(workdir, f"insert_batch_{time.perf_counter_ns()}.db")
+        setup_database(path)
+        conn = connect(path=path)
+        insert_messages(conn, rows)
+        conn.close()
+
+    results[f"insert_message[{SINGLE_INSERTS}]"] = measure(single_inserts, repeat)
+    results["insert_messages_batch[10000]"] = measure(batch_insert, repeat)
+    for name, rows in ((f"insert_message[{SINGLE_INSERTS}]", SINGLE_INSERTS), ("insert_messages_batch[10000]", 10000)):
+        results[name]["rows_per_second"] = rows / results[name]["median"]
+    return results
+
+
+def bench_fetches(workdir, size, repeat):
+    path = os.path.join(workdir, f"chat_{size}.db")
+    if not os.path.exists(path):
+        setup_database(path)
+        print(f"Generating {size} messages in {path}...", file=sys.stderr)
+        populate(size, path=path)
+    setup_database(path)
+
+    # The last day of messages, like a scheduled digest window
+    conn = connect(path=path)
+    last_ts = conn.execute("SELECT MAX(ts) FROM messages").fetchone()[0]
+    conn.close()
+    end = datetime.fromtimestamp(last_ts, timezone.utc)
+    start = datetime.fromtimestamp(last_ts - 86400, timezone.utc)
+
+    return {
+        f"fetch_last_n_messages[{FETCH_LAST_N}][rows={size}]": measure(lambda: fetch_last_n_messages(FETCH_LAST_N, CHAT_ID, path), repeat),
+        f"fetch_messages_by_date_range[1d][rows={size}]": measure(lambda: fetch_messages_by_date_range(start, end, CHAT_ID, path=path), repeat),
+    }
+
+
+def bench_formatting(window, repeat):
+    generator = ChatGenerator(seed=2)
+    rows = generator.fetched_rows(window)
+    message_block = format_messages(rows)
+    summary = generator.summary_text(threads=window // 10)
+
+    return {
+        f"format_messages[{window}]": measure(lambda: format_messages(rows), repeat),
+        f"replace_thread_ids_with_names[{window // 10} threads]": measure(lambda: replace_thread_ids_with_names(summary), repeat),
+        f"build_prompt[{window}]": measure(lambda: build_prompt(message_block), repeat),
+        f"build_summary_prompt[{window}]": measure(lambda: build_summary_prompt(rows), repeat),
+        f"compact_messages[{window}]": measure(lambda: compact_messages(rows), repeat),
+    }
+
+
+def bench_gemini_overhead(repeat):
+    """Time generate_text against an instant fake model: the scheduler, archive logging and metrics per call."""
+    model = FakeGeminiModel(latency=0)
+    previous_client = api_client.set_gemini_client(GeminiClient(models=dict.fromkeys(GENERATION_PROFILES, model)))
+    previous_scheduler = api_client.gemini_scheduler
+    api_client.gemini_scheduler = GeminiScheduler(max_concurrency=1, requests_per_minute=10 ** 9, tokens_per_minute=10 ** 12)
+    prompt = ChatGenerator(seed=3).summary_text(threads=20)
+
+    async def calls():
+        for _ in range(GEMINI_CALLS):
+            await api_client.generate_text(prompt)
+
+    try:
+        return {f"generate_text[{GEMINI_CALLS} calls]": measure(lambda: asyncio.run(calls()), repeat)}
+    finally:
+        api_client.set_gemini_client(previous_client)
+        api_client.gemini_scheduler = previous_scheduler
+
+
+def run(sizes, window, repeat, workdir):
+    benchmarks = {}
+    benchmarks.update(bench_inserts(workdir, repeat))
+    for size in sizes:
+        benchmarks.update(bench_fetches(workdir, size, repeat))
+    benchmarks.update(bench_formatting(window, repeat))
+    benchmarks.update(bench_gemini_overhead(repeat))
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "sizes": sizes,
+            "window": window,
+        },
+        "benchmarks": benchmarks,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return [(name, baseline_seconds, current_seconds, change)] and whether any got slower than ``threshold``."""
+    rows = []
+    regressed = False
+    for name, current in results["benchmarks"].items():
+        previous = baseline["benchmarks"].get(name)
+        if previous is None:
+            continue
+        change = current["median"] / previous["median"] - 1
+        regressed = regressed or change > threshold
+        rows.append((name, previous["median"], current["median"], change))
+    return rows, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the storage and formatting hot paths.")
+    parser.add_argument("--sizes", default="10000,100000", help="Comma separated table sizes, e.g. 10000,1000000,10000000")
+    parser.add_argument("--window", type=int, default=10000, help="Messages per formatting/prompt benchmark")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workdir", help="Directory for generated databases (kept between runs)")
+    parser.add_argument("--output", help="Results file (default: benchmark_results.json in --workdir)")
+    parser.add_argument("--baseline", help="Results file to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Also write the results to {DEFAULT_BASELINE}")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown before a benchmark counts as a regression")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pasha-bench-")
+    os.makedirs(workdir, exist_ok=True)
+
+    output = args.output or os.path.join(workdir, "benchmark_results.json")
+
+    results = run(sizes, args.window, args.repeat, workdir)
+    for path in [output] + ([DEFAULT_BASELINE] if args.save_baseline else []):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    for name, timing in results["benchmarks"].items():
+        print(f"{name:60} {timing['median'] * 1000:10.2f} ms")
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows, regressed = compare(results, baseline, args.threshold)
+        print()
+        for name, previous, current, change in rows:
+            flag = "  SLOWER" if change > args.threshold else ""
+            print(f"{name:60} {previous * 1000:10.2f} -> {current * 1000:10.2f} ms ({change:+.0%}){flag}")
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
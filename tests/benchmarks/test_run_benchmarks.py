@@ -0,0 +1,25 @@
+import json
+from db import db_manager
+from tests.benchmarks.run_benchmarks import compare, main
+
+
+def test_benchmarks_run_and_compare(tmp_path, monkeypatch):
+    # A tiny run so the suite keeps working as the code changes
+    monkeypatch.chdir(tmp_path)
+    configured_path = db_manager.DB_PATH
+    workdir = tmp_path / "work"
+    assert main(["--sizes", "1000", "--window", "200", "--repeat", "1", "--workdir", str(workdir)]) == 0
+
+    # Results land in the workdir and the configured database is left alone
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["work"]
+    assert db_manager.DB_PATH == configured_path
+    with open(workdir / "benchmark_results.json", encoding="utf-8") as f:
+        results = json.load(f)
+
+    assert "fetch_last_n_messages[1000][rows=1000]" in results["benchmarks"]
+    assert all(timing["median"] > 0 for timing in results["benchmarks"].values())
+
+    slower = {"benchmarks": {name: {"median": timing["median"] / 2} for name, timing in results["benchmarks"].items()}}
+    rows, regressed = compare(results, slower, threshold=0.25)
+    assert regressed and len(rows) == len(results["benchmarks"])
+    assert not compare(results, results, threshold=0.25)[1]
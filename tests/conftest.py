@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+
+# The bot modules import each other from the pasha-bot directory (e.g. `from config import ...`)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pasha-bot"))
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Point the database layer at a fresh file and create the schema."""
+    from db import db_manager
+    from db.chat_store import reset_chat_cache
+
+    path = str(tmp_path / "messages.db")
+    monkeypatch.setattr(db_manager, "DB_PATH", path)
+    db_manager.setup_database()
+    reset_chat_cache()
+    yield path
+    reset_chat_cache()
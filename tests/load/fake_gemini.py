@@ -0,0 +1,72 @@
+"""A local stand-in for genai.GenerativeModel with configurable latency, streaming and errors.
+
+Install it for every generation profile with
+GeminiClient(models=dict.fromkeys(GENERATION_PROFILES, FakeGeminiModel())).
+"""
+import asyncio
+import random
+
+
+class FakeGeminiError(Exception):
+    code = 503  # Looks like an overloaded server, so the call is retried
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeStreamingResponse:
+    def __init__(self, chunks, delay):
+        self._chunks = chunks
+        self._delay = delay
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self._chunks:
+            await asyncio.sleep(self._delay)
+            yield FakeResponse(chunk)
+
+
+class FakeGeminiModel:
+    """Answers every prompt with a canned summary after ``latency`` seconds.
+
+    ``error_rate`` of the calls fail with FakeGeminiError. Streamed responses
+    arrive in ``chunks`` pieces spread over the same latency. ``calls`` counts
+    the requests made.
+    """
+
+    def __init__(self, latency=1.0, error_rate=0.0, chunks=8, seed=7):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.chunks = chunks
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+
+    async def count_tokens_async(self, contents):
+        return None
+
+    async def generate_content_async(self, prompt, stream=False):
+        self.calls += 1
+        latency = self.random.uniform(0.5, 1.5) * self.latency
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            await asyncio.sleep(latency / 2)
+            raise FakeGeminiError("Simulated Gemini failure")
+
+        text = self._summary(prompt)
+        if not stream:
+            await asyncio.sleep(latency)
+            return FakeResponse(text)
+
+        size = max(1, len(text) // self.chunks)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        return FakeStreamingResponse(pieces, latency / len(pieces))
+
+    @staticmethod
+    def _summary(prompt):
+        return (f"Thread 10000\nОбсуждали планы на неделю ({len(prompt)} символов в запросе).\n\n"
+                "Thread 14115\nДоговорились встретиться в четверг вечером.\n")
@@ -0,0 +1,63 @@
+"""A local stand-in for the Telegram Bot API, plugged in as the bot's HTTP layer."""
+import asyncio
+import itertools
+import json
+import time
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 7000000001, "is_bot": True, "first_name": "Pasha", "username": "NokolayDevBot"}
+
+
+class FakeBotApi(BaseRequest):
+    """Answers Bot API calls locally and records them.
+
+    Every call is kept in ``calls`` as (monotonic time, method, parameters).
+    ``latency`` adds a delay per call, like the round trip to Telegram.
+    """
+
+    def __init__(self, latency=0.0, clock=time.monotonic):
+        self.latency = latency
+        self.clock = clock
+        self.calls = []
+        self._message_ids = itertools.count(1000000)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.calls.append((self.clock(), api_method, parameters))
+        return 200, json.dumps({"ok": True, "result": self._result(api_method, parameters)}).encode()
+
+    def calls_to(self, api_method):
+        return [(at, parameters) for at, method, parameters in self.calls if method == api_method]
+
+    def _result(self, api_method, parameters):
+        if api_method == "getMe":
+            return {**BOT_USER, "can_join_groups": True, "can_read_all_group_messages": True,
+                    "supports_inline_queries": False}
+        if api_method in ("sendMessage", "editMessageText"):
+            message_id = parameters.get("message_id") or next(self._message_ids)
+            chat_id = parameters["chat_id"]
+            return {"message_id": message_id, "date": int(time.time()), "text": parameters.get("text", ""),
+                    "chat": {"id": chat_id, "type": "supergroup" if int(chat_id) < 0 else "private"},
+                    "from": BOT_USER}
+        if api_method == "getChatMember":
+            return {"status": "administrator", "user": {"id": parameters["user_id"], "is_bot": False, "first_name": "Admin"},
+                    "can_be_edited": False, "is_anonymous": False, "can_manage_chat": True,
+                    "can_delete_messages": True, "can_manage_video_chats": True, "can_restrict_members": True,
+                    "can_promote_members": False, "can_change_info": True, "can_invite_users": True,
+                    "can_post_stories": False, "can_edit_stories": False, "can_delete_stories": False}
+        # deleteMessage, setWebhook, deleteWebhook, ... only report success
+        return True
@@ -0,0 +1,269 @@
+"""Replay group traffic through the real Application wiring against fake Telegram and Gemini.
+
+Run from the repository root:
+
+    python -m tests.load.replay --rate 50 --duration 30 --summary-users 20 --gemini-latency 3
+    python -m tests.load.replay --updates tests/fixtures/group_updates.json --rate 5
+
+Group messages are replayed at --rate messages per second (synthetic ones
+from the benchmark chat generator, or recorded updates from --updates)
+while --summary-users private users ask for summaries at random moments.
+The report gives p50/p95/p99 update handling latency, summary latency,
+ingestion lag (update received -> row committed) and throughput.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "pasha-bot"))
+
+from telegram import Update  # noqa: E402
+from ai_api.gemini import api_client  # noqa: E402
+from ai_api.gemini.api_client import GENERATION_PROFILES, GeminiClient  # noqa: E402
+from db import db_manager, ingestion  # noqa: E402
+from db.chat_store import reset_chat_cache  # noqa: E402
+from handlers import summary_handler  # noqa: E402
+from handlers.message_handler import BOT_NICKNAME  # noqa: E402
+from handlers.update_processor import ChatOrderedUpdateProcessor  # noqa: E402
+from main import build_application  # noqa: E402
+from tests.benchmarks.chat_generator import CHAT_ID, ChatGenerator  # noqa: E402
+from tests.load.fake_gemini import FakeGeminiModel  # noqa: E402
+from tests.load.fake_telegram import FakeBotApi  # noqa: E402
+from workers import dispatch  # noqa: E402
+
+FAKE_TOKEN = "7000000001:fake-token-for-load-replay"
+SUMMARY_COUNTS = [50, 100, 200, 500, 1000]
+
+
+class TimedUpdateProcessor(ChatOrderedUpdateProcessor):
+    """Records how long each update took from entering the queue until its handlers returned."""
+
+    def __init__(self, max_concurrent_updates, clock=time.monotonic):
+        super().__init__(max_concurrent_updates)
+        self.clock = clock
+        self.received_at = {}  # update_id -> time it was put in the update queue
+        self.latencies = []
+
+    async def do_process_update(self, update, coroutine):
+        try:
+            await super().do_process_update(update, coroutine)
+        finally:
+            received_at = self.received_at.pop(update.update_id, None)
+            if received_at is not None:
+                self.latencies.append(self.clock() - received_at)
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def at(share):
+        return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+    return {"count": len(ordered), "p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": ordered[-1]}
+
+
+def synthetic_group_updates(count, mention_rate, seed):
+    generator = ChatGenerator(seed)
+    rng = random.Random(seed)
+    for message_id, _, username, content, thread_id, chat_id, ts in generator.rows(count):
+        if rng.random() < mention_rate:
+            content = f"{BOT_NICKNAME} {content}"
+        message = {"message_id": message_id, "date": ts, "text": content,
+                   "chat": {"id": chat_id, "type": "supergroup", "title": "Load test", "is_forum": True},
+                   "from": {"id": 10000 + zlib.crc32(username.encode()) % 100000, "is_bot": False, "first_name": username, "username": username}}
+        if thread_id is not None:
+            message.update(message_thread_id=thread_id, is_topic_message=True)
+        yield message
+
+
+def recorded_group_updates(path):
+    with open(path, encoding="utf-8") as f:
+        for data in json.load(f):
+            if "message" in data:
+                yield data["message"]
+
+
+def private_message(user_id, message_id, text):
+    user = {"id": user_id, "is_bot": False, "first_name": f"Reader {user_id}", "username": f"reader{user_id}"}
+    return {"message_id": message_id, "date": int(time.time()), "text": text,
+            "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]}, "from": user}
+
+
+class Replay:
+    def __init__(self, args):
+        self.args = args
+        self.clock = time.monotonic
+        self.update_ids = iter(range(1, 10 ** 9))
+        self.bot_api = FakeBotApi(latency=args.telegram_latency)
+        self.gemini = FakeGeminiModel(latency=args.gemini_latency, error_rate=args.gemini_error_rate, seed=args.seed)
+        self.processor = TimedUpdateProcessor(args.concurrency, self.clock)
+        self.message_received_at = {}  # (chat_id, message_id) -> time
+        self.committed_at = {}  # (chat_id, message_id) -> time the row was committed
+        self.summary_started_at = {}  # user_id -> time the message count was sent
+        self.group_messages = 0
+
+    def setup(self, workdir):
+        db_manager.DB_PATH = os.path.join(workdir, "replay.db")
+        db_manager.setup_database()
+        reset_chat_cache()
+
+        # Record when every row reaches the database
+        insert_messages = ingestion.insert_messages
+
+        def timed_insert_messages(conn, rows):
+            insert_messages(conn, rows)
+            now = self.clock()
+            for message_id, _, _, _, _, chat_id, _ in rows:
+                self.committed_at[(chat_id, message_id)] = now
+
+        ingestion.insert_messages = timed_insert_messages
+        api_client.set_gemini_client(GeminiClient(models=dict.fromkeys(GENERATION_PROFILES, self.gemini)))
+        summary_handler.STREAM_SUMMARIES = self.args.stream
+        # Summaries run in the replayed bot process, not in worker processes
+        dispatch.SUMMARY_WORKERS = False
+        if self.args.gemini_rpm:
+            api_client.gemini_scheduler.requests_per_minute = self.args.gemini_rpm
+
+    async def put(self, application, message):
+        update = Update.de_json({"update_id": next(self.update_ids), "message": message}, application.bot)
+        now = self.clock()
+        self.processor.received_at[update.update_id] = now
+        await application.update_queue.put(update)
+        return now
+
+    async def replay_group(self, application, messages):
+        start = self.clock()
+        for index, message in enumerate(messages):
+            delay = start + index / self.args.rate - self.clock()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            received_at = await self.put(application, message)
+            self.message_received_at[(message["chat"]["id"], message["message_id"])] = received_at
+            self.group_messages += 1
+
+    async def request_summary(self, application, user_id, delay, rng):
+        await asyncio.sleep(delay)
+        await self.put(application, private_message(user_id, 1, "🚀 Get summary"))
+        await asyncio.sleep(self.args.think_time)
+        self.summary_started_at[user_id] = await self.put(application, private_message(user_id, 2, str(rng.choice(SUMMARY_COUNTS))))
+
+    def summary_latencies(self):
+        """Time to the first reply and to the last message sent or edited for each summary request."""
+        first_reply, done = [], []
+        for user_id, started_at in self.summary_started_at.items():
+            replies = [at for at, method, parameters in self.bot_api.calls
+                       if method in ("sendMessage", "editMessageText") and at >= started_at
+                       and int(parameters["chat_id"]) == user_id]
+            if replies:
+                first_reply.append(replies[0] - started_at)
+                done.append(replies[-1] - started_at)
+        return percentiles(first_reply), percentiles(done)
+
+    async def run(self):
+        args = self.args
+        if args.updates:
+            messages = list(recorded_group_updates(args.updates))
+        else:
+            messages = list(synthetic_group_updates(int(args.rate * args.duration), args.mention_rate, args.seed))
+        duration = len(messages) / args.rate
+
+        application = build_application(token=FAKE_TOKEN, request=self.bot_api, update_processor=self.processor)
+        ingestion.start_ingestion()
+        await application.initialize()
+        await application.start()
+
+        rng = random.Random(args.seed)
+        started = self.clock()
+        await asyncio.gather(
+            self.replay_group(application, messages),
+            *(self.request_summary(application, 900000 + user, rng.uniform(0, duration), rng)
+              for user in range(args.summary_users)),
+        )
+        replayed = self.clock() - started
+
+        # Let every update, background task and queued row finish
+        await application.update_queue.join()
+        await application.stop()
+        await application.shutdown()
+        ingestion.stop_ingestion()
+        finished = self.clock() - started
+
+        lags = [self.committed_at[key] - received_at for key, received_at in self.message_received_at.items()
+                if key in self.committed_at]
+        first_reply, summary = self.summary_latencies()
+        return {
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+            "group_messages": self.group_messages,
+            "summary_requests": len(self.summary_started_at),
+            "replay_seconds": replayed,
+            "total_seconds": finished,
+            "throughput_messages_per_second": self.group_messages / replayed if replayed else 0,
+            "update_latency": percentiles(self.processor.latencies),
+            "ingestion_lag": percentiles(lags),
+            "rows_committed": len(lags),
+            "summary_first_reply": first_reply,
+            "summary_latency": summary,
+            "gemini_calls": self.gemini.calls,
+            "gemini_errors": self.gemini.errors,
+            "bot_api_calls": {method: len(self.bot_api.calls_to(method))
+                              for method in sorted({method for _, method, _ in self.bot_api.calls})},
+            "ingestion": ingestion.get_ingestion_stats(),
+        }
+
+
+def print_report(report):
+    print(f"Replayed {report['group_messages']} group messages in {report['replay_seconds']:.1f}s "
+          f"({report['throughput_messages_per_second']:.1f}/s), {report['summary_requests']} summary requests, "
+          f"done after {report['total_seconds']:.1f}s")
+    for name in ("update_latency", "ingestion_lag", "summary_first_reply", "summary_latency"):
+        stats = report[name]
+        if stats["count"]:
+            print(f"{name:22} n={stats['count']:<6} p50={stats['p50'] * 1000:9.1f}ms p95={stats['p95'] * 1000:9.1f}ms "
+                  f"p99={stats['p99'] * 1000:9.1f}ms max={stats['max'] * 1000:9.1f}ms")
+        else:
+            print(f"{name:22} n=0")
+    print(f"Gemini calls: {report['gemini_calls']} ({report['gemini_errors']} failed), Bot API calls: {report['bot_api_calls']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay chat traffic against fake Telegram and Gemini.")
+    parser.add_argument("--rate", type=float, default=20, help="Group messages per second")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of synthetic traffic")
+    parser.add_argument("--updates", help="JSON file with recorded updates to replay instead of synthetic traffic")
+    parser.add_argument("--mention-rate", type=float, default=0.01, help="Share of group messages mentioning the bot")
+    parser.add_argument("--summary-users", type=int, default=5, help="Private users requesting a summary during the replay")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Seconds between 'Get summary' and the message count")
+    parser.add_argument("--stream", action=argparse.BooleanOptionalAction, default=True, help="Stream on-demand summaries")
+    parser.add_argument("--concurrency", type=int, default=64, help="Updates handled at once")
+    parser.add_argument("--gemini-latency", type=float, default=2.0, help="Mean seconds per Gemini call")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-rpm", type=int, help="Override the Gemini requests-per-minute budget")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="Seconds per Bot API call")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(args.log_level)
+    replay = Replay(args)
+    replay.setup(tempfile.mkdtemp(prefix="pasha-replay-"))
+    report = asyncio.run(replay.run())
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+from ai_api.gemini import api_client
+from db import db_manager, ingestion
+from handlers import summary_handler
+from tests.load.replay import main
+from workers import dispatch
+
+
+def test_short_replay_reports_latencies(tmp_path, monkeypatch, capsys):
+    # Replay.setup rewires these module globals, restore them afterwards
+    monkeypatch.setattr(db_manager, "DB_PATH", db_manager.DB_PATH)
+    monkeypatch.setattr(ingestion, "insert_messages", ingestion.insert_messages)
+    monkeypatch.setattr(api_client, "_gemini_client", api_client._gemini_client)
+    monkeypatch.setattr(summary_handler, "STREAM_SUMMARIES", summary_handler.STREAM_SUMMARIES)
+    monkeypatch.setattr(dispatch, "SUMMARY_WORKERS", dispatch.SUMMARY_WORKERS)
+    monkeypatch.setattr("tempfile.mkdtemp", lambda prefix="": str(tmp_path))
+
+    report = main(["--rate", "100", "--duration", "0.5", "--summary-users", "2", "--gemini-latency", "0.05",
+                   "--telegram-latency", "0", "--think-time", "0.05"])
+
+    assert report["group_messages"] == 50
+    assert report["rows_committed"] == 50
+    assert report["update_latency"]["count"] == 54
+    assert report["summary_latency"]["count"] == 2
+    assert "p99" in report["ingestion_lag"]
+    assert "Replayed 50 group messages" in capsys.readouterr().out
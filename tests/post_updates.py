@@ -0,0 +1,36 @@
+"""Post recorded Telegram updates to a running webhook, for trying webhook mode locally.
+
+Usage: python tests/post_updates.py [updates.json] [--url URL] [--secret TOKEN]
+
+Start the bot with BOT_MODE=webhook first. By default the updates in
+tests/fixtures/group_updates.json are posted to the local server using
+WEBHOOK_PORT, WEBHOOK_PATH and WEBHOOK_SECRET_TOKEN from the environment.
+"""
+import argparse
+import json
+import os
+import httpx
+
+DEFAULT_UPDATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "group_updates.json")
+
+
+def main():
+    default_url = f"http://127.0.0.1:{os.getenv('WEBHOOK_PORT', '8080')}/{os.getenv('WEBHOOK_PATH', 'telegram')}"
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("updates", nargs="?", default=DEFAULT_UPDATES, help="JSON file with a list of updates")
+    parser.add_argument("--url", default=default_url)
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET_TOKEN"))
+    args = parser.parse_args()
+
+    with open(args.updates, encoding="utf-8") as f:
+        updates = json.load(f)
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    with httpx.Client(timeout=10) as client:
+        for update in updates:
+            response = client.post(args.url, json=update, headers=headers)
+            print(f"update {update.get('update_id')}: HTTP {response.status_code}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+from datetime import datetime, timezone
+from db.activity_store import fetch_activity_stats
+from db.db_manager import insert_message
+from ai_api.gemini.prompt_builder import build_summary_prompt
+from handlers.commands import format_stats
+
+CHAT_ID = -100
+HOUR = 1732615200  # 2024-11-26 10:00 UTC
+
+
+def store(message_id, thread_id, username, ts, chat_id=CHAT_ID):
+    date = datetime.fromtimestamp(ts, timezone.utc).isoformat()
+    insert_message(message_id, date, username, f"message {message_id}", thread_id, chat_id, ts)
+
+
+def test_ingestion_keeps_hourly_thread_aggregates(db_path):
+    store(1, 7, "ann", HOUR + 60)
+    store(2, 7, "ann", HOUR + 120)
+    store(3, 7, "bob", HOUR + 180)
+    store(4, 8, "bob", HOUR + 3600)
+    store(5, 7, "ann", HOUR + 3660)
+    store(6, 7, "eve", HOUR, chat_id=-200)
+
+    stats = fetch_activity_stats(CHAT_ID, HOUR, top_threads=10)
+
+    assert stats["messages"] == 5
+    assert stats["posters"] == 2
+    assert stats["busiest_hour"] == (HOUR, 3)
+    assert stats["threads"] == [(7, 4, 2), (8, 1, 1)]
+    assert "1. Thread 7: 4 сообщений, 2 участников" in format_stats(stats, 24)
+    assert fetch_activity_stats(CHAT_ID, HOUR + 7200, top_threads=10)["messages"] == 0
+
+
+def test_prompt_orders_threads_by_the_window_alone(db_path):
+    # Thread 8 is busier over the hour, though only one of its messages is in the window
+    for message_id in range(1, 4):
+        store(message_id, 8, "bob", HOUR + message_id * 60)
+    store(4, 7, "ann", HOUR + 600)
+    store(5, 7, "ann", HOUR + 660)
+    store(6, 8, "bob", HOUR + 720)
+    window = [(6, 8, "bob", "2024-11-26T10:12:00+00:00", "message 6"),
+              (5, 7, "ann", "2024-11-26T10:11:00+00:00", "message 5"),
+              (4, 7, "ann", "2024-11-26T10:10:00+00:00", "message 4")]
+
+    prompt = build_summary_prompt(window)
+
+    assert prompt.index("Thread 7") < prompt.index("Thread 8")
@@ -0,0 +1,77 @@
+import asyncio
+from types import SimpleNamespace
+from ai_api import summarizer
+from cron import scheduler
+from db.chat_store import save_chat
+from db.db_manager import insert_message
+from db.fetchers import fetch_backlog_size
+from db.watermark_store import load_watermark, save_watermark
+
+CHAT_ID = -100
+SUMMARY_THREAD_ID = 9
+
+
+def store(count, thread_id=1, text="hello there"):
+    for message_id in range(count):
+        insert_message(message_id, "2024-11-26T10:00:00+00:00", "ann", text, thread_id, CHAT_ID, 1732615200)
+
+
+def test_small_backlog_waits_for_the_next_scheduled_time(db_path, monkeypatch):
+    monkeypatch.setattr(scheduler, "DIGEST_MIN_MESSAGES", 5)
+    save_watermark(CHAT_ID, 0)
+    store(3)
+    store(10, thread_id=SUMMARY_THREAD_ID)  # The summary thread is never digested
+
+    assert fetch_backlog_size(CHAT_ID, 0, 100, SUMMARY_THREAD_ID) == (3, 3 * len("annhello there") // 4)
+    assert not scheduler.due_at_scheduled_time(CHAT_ID, SUMMARY_THREAD_ID)
+
+    store(2)
+    assert scheduler.due_at_scheduled_time(CHAT_ID, SUMMARY_THREAD_ID)
+
+    # A quiet chat still gets a digest once the last one is old enough
+    monkeypatch.setattr(scheduler, "DIGEST_MIN_MESSAGES", 50)
+    monkeypatch.setattr(scheduler, "DIGEST_MAX_SKIP", 0)
+    assert scheduler.due_at_scheduled_time(CHAT_ID, SUMMARY_THREAD_ID)
+
+
+def test_large_backlog_is_digested_early(db_path, monkeypatch):
+    dispatched = []
+
+    async def dispatch_digests(bot, chats):
+        dispatched.extend(chats)
+
+    monkeypatch.setattr(scheduler, "dispatch_digests", dispatch_digests)
+    monkeypatch.setattr(scheduler, "DIGEST_EARLY_MESSAGES", 20)
+    monkeypatch.setattr(scheduler, "DIGEST_EARLY_TOKENS", 1000)
+    save_chat(CHAT_ID, SUMMARY_THREAD_ID)
+    save_watermark(CHAT_ID, 0)
+    context = SimpleNamespace(bot=None)
+
+    store(10)
+    asyncio.run(scheduler.check_digest_backlog(context))
+    assert dispatched == []
+
+    # Few messages, but long ones: the token limit triggers the digest
+    store(2, text="x" * 2000)
+    asyncio.run(scheduler.check_digest_backlog(context))
+    assert (CHAT_ID, SUMMARY_THREAD_ID) in dispatched
+
+
+def test_digest_of_only_noise_moves_the_watermark_without_posting(db_path, monkeypatch):
+    class Bot:
+        sent = []
+
+        async def send_message(self, **kwargs):
+            self.sent.append(kwargs)
+
+    async def unexpected_generate_text(prompt):
+        raise AssertionError("Gemini must not be asked to summarize noise")
+
+    monkeypatch.setattr(summarizer, "generate_text", unexpected_generate_text)
+    save_watermark(CHAT_ID, 0)
+    store(4, text="+")
+
+    asyncio.run(scheduler.send_chat_summary(Bot(), CHAT_ID, SUMMARY_THREAD_ID))
+
+    assert Bot.sent == []
+    assert load_watermark(CHAT_ID)[0] == 4
@@ -0,0 +1,45 @@
+from ai_api.compaction import compact_messages, merge_consecutive
+
+DATE = "2024-11-26T10:00:00+00:00"
+
+
+def rows(*messages):
+    # (username, text, thread_id) oldest first -> fetched rows, newest first
+    return [(row_id, thread_id, username, DATE, text)
+            for row_id, (username, text, thread_id) in enumerate(messages, start=1)][::-1]
+
+
+def test_compaction_drops_noise_bots_and_duplicates():
+    messages = rows(
+        ("stas", "Смотрите https://example.com/doc", 10000),
+        ("olga", "+1", 10000),
+        ("NokolayDevBot", "📋 Summary", 10000),
+        ("ivan", "No text content", 10000),
+        ("ivan", "смотрите https://example.com/doc!", 10000),
+        ("olga", "👍", 10000),
+        ("ivan", "x" * 5000, 10001),
+    )
+
+    compacted, stats = compact_messages(messages, ["exclude_bots", "drop_noise", "truncate", "dedup"])
+
+    assert [row[0] for row in compacted] == [7, 1]
+    assert compacted[0][4].startswith("x" * 1500) and compacted[0][4].endswith("[3500 characters cut]")
+    assert stats["messages_before"] == 7 and stats["messages_after"] == 2
+    assert stats["chars_saved"] > 3500 and stats["tokens_saved"] == stats["chars_saved"] // 4
+
+
+def test_merge_consecutive_keeps_threads_apart():
+    messages = rows(
+        ("stas", "первое", 10000),
+        ("olga", "в другой теме", 10001),
+        ("stas", "второе", 10000),
+        ("olga", "ответ", 10000),
+    )
+
+    merged = merge_consecutive(messages)
+
+    assert [(row[0], row[2], row[4]) for row in merged] == [
+        (4, "olga", "ответ"),
+        (3, "stas", "первое\n    второе"),
+        (2, "olga", "в другой теме"),
+    ]
@@ -0,0 +1,180 @@
+import asyncio
+import datetime
+import time
+from types import SimpleNamespace
+from telegram import ChatMember
+from ai_api import summarizer
+from cron import scheduler
+from db.chat_store import get_summary_thread_id, load_digest_chats, save_chat
+from db.db_manager import connect, insert_message
+from db.watermark_store import load_watermark, save_watermark
+from handlers.commands import digest_here
+from utils.metrics import ERRORS
+
+QUIET_CHAT_ID = -100
+BROKEN_CHAT_ID = -200
+SUMMARY_THREAD_ID = 9
+
+
+class FakeBot:
+    def __init__(self, failing_chat_id=None, status=ChatMember.ADMINISTRATOR):
+        self.failing_chat_id = failing_chat_id
+        self.status = status
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id == self.failing_chat_id:
+            raise ConnectionError("chat unavailable")
+        self.sent.append((chat_id, text))
+
+    async def get_chat_member(self, chat_id, user_id):
+        return SimpleNamespace(status=self.status)
+
+
+def store(chat_id, count):
+    for n in range(count):
+        insert_message(n, "2024-11-26T10:00:00+00:00", "ann", f"сообщение {n}", 1, chat_id, 1732615200 + n)
+
+
+def use_gemini(monkeypatch):
+    async def fake_generate_text(prompt):
+        return "Thread 1\nитоги"
+
+    monkeypatch.setattr(summarizer, "generate_text", fake_generate_text)
+
+
+def test_failing_chat_does_not_stop_the_other_digests(db_path, monkeypatch):
+    use_gemini(monkeypatch)
+    chats = [(BROKEN_CHAT_ID, SUMMARY_THREAD_ID), (QUIET_CHAT_ID, SUMMARY_THREAD_ID)]
+    for chat_id, _ in chats:
+        save_watermark(chat_id, 0)
+    store(BROKEN_CHAT_ID, 3)  # ids 1-3
+    store(QUIET_CHAT_ID, 2)  # ids 4-5
+    bot = FakeBot(failing_chat_id=BROKEN_CHAT_ID)
+    errors = ERRORS.value(source="digest")
+
+    asyncio.run(scheduler.send_digests(bot, chats))
+
+    assert [chat_id for chat_id, _ in bot.sent] == [QUIET_CHAT_ID]
+    # The failed digest is retried next time, the sent one is not repeated
+    assert load_watermark(BROKEN_CHAT_ID)[0] == 0
+    assert load_watermark(QUIET_CHAT_ID)[0] == 5
+    assert ERRORS.value(source="digest") == errors + 1
+
+
+def test_slow_chat_is_cancelled_after_the_timeout(db_path, monkeypatch):
+    finished = []
+
+    async def fake_send_chat_summary(bot, chat_id, summary_thread_id):
+        if chat_id == BROKEN_CHAT_ID:
+            await asyncio.Event().wait()
+        finished.append(chat_id)
+
+    monkeypatch.setattr(scheduler, "send_chat_summary", fake_send_chat_summary)
+    monkeypatch.setattr(scheduler, "DIGEST_CHAT_TIMEOUT", 0.05)
+    monkeypatch.setattr(scheduler, "DIGEST_CONCURRENCY", 1)
+    errors = ERRORS.value(source="digest")
+
+    # With one digest at a time, the hanging chat goes first and must not block the next one
+    asyncio.run(asyncio.wait_for(
+        scheduler.send_digests(None, [(BROKEN_CHAT_ID, SUMMARY_THREAD_ID), (QUIET_CHAT_ID, SUMMARY_THREAD_ID)]), 5))
+
+    assert finished == [QUIET_CHAT_ID]
+    assert ERRORS.value(source="digest") == errors + 1
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, data=None, name=None):
+        self.jobs.append((callback, name, data))
+
+
+def test_chats_that_missed_a_digest_are_caught_up(db_path):
+    stale_chat_id = BROKEN_CHAT_ID
+    for chat_id in (QUIET_CHAT_ID, stale_chat_id):
+        save_chat(chat_id, SUMMARY_THREAD_ID)
+        save_watermark(chat_id, 0)
+    # The bot was down for two days since the stale chat's last digest
+    conn = connect()
+    with conn:
+        conn.execute("UPDATE digest_watermarks SET updated_at = ? WHERE chat_id = ?", (int(time.time()) - 2 * 86400, stale_chat_id))
+    conn.close()
+    application = SimpleNamespace(job_queue=FakeJobQueue())
+
+    scheduler.schedule_missed_digest(application)
+
+    # Chats without a watermark never had a digest to miss
+    assert application.job_queue.jobs == [(scheduler.send_summary, "missed_digest", [(stale_chat_id, SUMMARY_THREAD_ID)])]
+
+
+def test_nothing_is_caught_up_when_no_digest_was_missed(db_path):
+    save_chat(QUIET_CHAT_ID, SUMMARY_THREAD_ID)
+    save_watermark(QUIET_CHAT_ID, 0)
+    application = SimpleNamespace(job_queue=FakeJobQueue())
+
+    scheduler.schedule_missed_digest(application)
+
+    assert application.job_queue.jobs == []
+
+
+def test_first_digest_starts_at_the_previous_scheduled_time(db_path):
+    since = scheduler.previous_scheduled_time(datetime.datetime.now(scheduler.LOCAL_TZ) - datetime.timedelta(seconds=1))
+    for message_id, offset in enumerate([-60, -30, 1]):  # ids 1-3
+        sent = since + datetime.timedelta(seconds=offset)
+        insert_message(message_id, sent.isoformat(), "ann", f"сообщение {message_id}", 1, QUIET_CHAT_ID, int(sent.timestamp()))
+
+    # Without a watermark the digest covers what was said since the last scheduled time
+    assert scheduler._load_or_seed_watermark(QUIET_CHAT_ID) == 2
+    assert scheduler._load_or_seed_watermark(BROKEN_CHAT_ID) == 0
+    # Seeding stores nothing, the first sent digest does
+    assert load_watermark(QUIET_CHAT_ID) is None
+
+    save_watermark(QUIET_CHAT_ID, 3)
+    assert scheduler._load_or_seed_watermark(QUIET_CHAT_ID) == 3
+
+
+def command_update(chat_id, replies, thread_id=None, chat_type="supergroup"):
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+
+    chat = SimpleNamespace(id=chat_id, type=chat_type, GROUP="group", SUPERGROUP="supergroup")
+    message = SimpleNamespace(reply_text=reply_text, message_thread_id=thread_id, is_topic_message=thread_id is not None)
+    return SimpleNamespace(effective_chat=chat, effective_user=SimpleNamespace(id=7), message=message)
+
+
+def test_digest_here_is_for_admins_only(db_path):
+    replies = []
+    context = SimpleNamespace(bot=FakeBot(status=ChatMember.MEMBER), args=[])
+
+    asyncio.run(digest_here(command_update(QUIET_CHAT_ID, replies, thread_id=SUMMARY_THREAD_ID), context))
+
+    assert replies == ["Только администраторы могут настраивать сводки."]
+    assert (QUIET_CHAT_ID, SUMMARY_THREAD_ID) not in load_digest_chats()
+
+
+def test_digest_here_enables_and_disables_digests(db_path):
+    replies = []
+    bot = FakeBot(status=ChatMember.OWNER)
+
+    asyncio.run(digest_here(command_update(QUIET_CHAT_ID, replies, thread_id=SUMMARY_THREAD_ID),
+                            SimpleNamespace(bot=bot, args=[])))
+    assert (QUIET_CHAT_ID, SUMMARY_THREAD_ID) in load_digest_chats()
+
+    asyncio.run(digest_here(command_update(QUIET_CHAT_ID, replies), SimpleNamespace(bot=bot, args=["OFF"])))
+
+    assert replies[-1] == "Сводки для этой группы отключены."
+    assert QUIET_CHAT_ID not in [chat_id for chat_id, _ in load_digest_chats()]
+    # Only the digests are switched off, the chat keeps its summary thread
+    assert get_summary_thread_id(QUIET_CHAT_ID) == SUMMARY_THREAD_ID
+
+
+def test_digest_here_is_rejected_outside_groups(db_path):
+    replies = []
+    context = SimpleNamespace(bot=FakeBot(), args=[])
+
+    asyncio.run(digest_here(command_update(7, replies, chat_type="private"), context))
+
+    assert replies == ["Эта команда работает только в группах."]
+    assert 7 not in [chat_id for chat_id, _ in load_digest_chats()]
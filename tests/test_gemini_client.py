@@ -0,0 +1,156 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from ai_api.gemini import api_client
+from ai_api.gemini.api_client import GENERATION_PROFILES, GeminiClient, generate_result, generate_text, stream_text
+from ai_api.gemini.resilience import GeminiError
+from ai_api.rate_limiter import GeminiScheduler
+
+
+class SlowModel:
+    """Stands in for genai.GenerativeModel, answering after ``seconds`` and tracking the calls in flight."""
+
+    def __init__(self, seconds=0.0):
+        self.seconds = seconds
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.cancelled = 0
+
+    async def generate_content_async(self, prompt, stream=False):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.seconds)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        if stream:
+            return self._stream()
+        return SimpleNamespace(text=f"ответ на {prompt}")
+
+    async def _stream(self):
+        yield SimpleNamespace(text="начало ")
+        await asyncio.sleep(3600)
+        yield SimpleNamespace(text="конец")
+
+
+def use_model(monkeypatch, model, max_concurrency=4):
+    monkeypatch.setattr(api_client, "_gemini_client", GeminiClient(models=dict.fromkeys(GENERATION_PROFILES, model)))
+    scheduler = GeminiScheduler(max_concurrency=max_concurrency, requests_per_minute=1000, tokens_per_minute=10 ** 9)
+    monkeypatch.setattr(api_client, "gemini_scheduler", scheduler)
+    return scheduler
+
+
+def test_calls_beyond_the_concurrency_limit_wait_for_a_slot(monkeypatch):
+    model = SlowModel(0.02)
+    scheduler = use_model(monkeypatch, model, max_concurrency=2)
+
+    async def scenario():
+        return await asyncio.gather(*(generate_text(f"prompt {n}") for n in range(5)))
+
+    texts = asyncio.run(scenario())
+
+    assert texts == [f"ответ на prompt {n}" for n in range(5)]
+    assert model.max_in_flight == 2
+    assert scheduler.in_flight == 0
+
+
+def test_timed_out_call_becomes_a_failed_result(monkeypatch):
+    model = SlowModel(3600)
+    scheduler = use_model(monkeypatch, model)
+
+    result = asyncio.run(asyncio.wait_for(generate_result("prompt", timeout=0.05), 5))
+
+    assert not result.ok and result.timed_out
+    assert model.cancelled >= 1 and model.in_flight == 0
+    assert scheduler.in_flight == 0
+
+
+def test_cancelling_the_caller_cancels_the_request_and_frees_the_slot(monkeypatch):
+    model = SlowModel(3600)
+    scheduler = use_model(monkeypatch, model)
+
+    async def scenario():
+        task = asyncio.create_task(generate_text("prompt"))
+        while not model.in_flight:
+            await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+
+    assert model.cancelled == 1 and model.in_flight == 0
+    assert scheduler.in_flight == 0
+
+
+def test_stream_is_cut_off_at_the_timeout(monkeypatch):
+    scheduler = use_model(monkeypatch, SlowModel())
+    received = []
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            async for text in stream_text("prompt", timeout=0.05):
+                received.append(text)
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+
+    # The text that arrived before the deadline was already handed out
+    assert received == ["начало "]
+    assert scheduler.in_flight == 0
+
+
+class BrokenStreamModel:
+    """Opens a stream that breaks off after its first chunk."""
+
+    async def generate_content_async(self, prompt, stream=False):
+        return self._stream()
+
+    async def _stream(self):
+        yield SimpleNamespace(text="начало ")
+        raise ConnectionError("connection reset")
+
+
+def test_stream_failing_midway_raises_gemini_error(monkeypatch):
+    scheduler = use_model(monkeypatch, BrokenStreamModel())
+    received = []
+
+    async def scenario():
+        async for text in stream_text("prompt"):
+            received.append(text)
+
+    with pytest.raises(GeminiError) as raised:
+        asyncio.run(scenario())
+
+    assert received == ["начало "]
+    assert isinstance(raised.value.result.error, ConnectionError)
+    assert raised.value.result.attempts == 1
+    assert scheduler.in_flight == 0
+
+
+class RecordingTransportClient:
+    """Stands in for glm.GenerativeServiceAsyncClient, answering every request with one text part."""
+
+    def __init__(self):
+        self.requests = []
+
+    async def generate_content(self, request, **kwargs):
+        from google.ai import generativelanguage_v1beta as glm
+        self.requests.append(request)
+        return glm.GenerateContentResponse(candidates=[glm.Candidate(
+            content=glm.Content(parts=[glm.Part(text="ответ")], role="model"), finish_reason=1)])
+
+
+def test_models_send_through_the_shared_transport_client():
+    # GeminiClient relies on the SDK's private GenerativeModel._async_client; this fails when an SDK update drops it
+    pytest.importorskip("google.generativeai")
+    client = GeminiClient(api_key="test")
+    transport = client._transport_client = RecordingTransportClient()
+
+    response = asyncio.run(client.generate("prompt", "summary"))
+
+    assert response.text == "ответ"
+    assert len(transport.requests) == 1
+    assert all(client.model(profile)._async_client is transport for profile in GENERATION_PROFILES)
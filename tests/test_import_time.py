@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+BOT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pasha-bot")
+
+# Importing main measures about 0.35 s locally, the budget leaves room for slower machines
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "1.5"))
+
+# Imported on first use only, see ai_api/gemini/api_client.py
+DEFERRED_MODULES = ("google.generativeai", "google.ai.generativelanguage", "grpc")
+
+
+def import_times(module):
+    """Import ``module`` in a fresh interpreter and return {module name: cumulative seconds}."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=BOT_DIR, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1_000_000
+    return times
+
+
+def test_main_imports_within_budget_without_the_gemini_sdk():
+    times = import_times("main")
+
+    deferred = sorted(name for name in times if name.startswith(DEFERRED_MODULES))
+    assert not deferred, f"Imported at startup: {deferred}"
+    assert times["main"] <= IMPORT_BUDGET_SECONDS, f"Importing main took {times['main']:.2f} s"
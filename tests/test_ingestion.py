@@ -0,0 +1,74 @@
+import time
+from config import DAILY_SUMMARY_CHAT_ID
+from db.db_manager import connect
+from db.ingestion import MessageWriter
+
+CHAT_ID = int(DAILY_SUMMARY_CHAT_ID)
+
+
+def row(n):
+    return (n, f"2024-11-26T10:00:{n:02d}+00:00", "ann", f"m{n}", 10000, CHAT_ID, 1732615200 + n)
+
+
+def stored_texts():
+    conn = connect()
+    texts = [text for text, in conn.execute("SELECT message_content FROM messages ORDER BY id")]
+    conn.close()
+    return texts
+
+
+def test_rows_are_written_in_full_batches(db_path):
+    writer = MessageWriter(batch_size=3, flush_interval=60)
+    writer.start()
+    for n in range(7):
+        writer.submit(row(n))
+    writer.stop(timeout=5)
+
+    # Two full batches, the last row is flushed when the writer stops
+    assert writer.stats()["flush_count"] == 3
+    assert writer.stats()["flushed_messages"] == 7
+    assert stored_texts() == [f"m{n}" for n in range(7)]
+
+
+def test_partial_batch_is_flushed_after_the_interval(db_path):
+    writer = MessageWriter(batch_size=100, flush_interval=0.05)
+    writer.start()
+    writer.submit(row(1))
+    writer.submit(row(2))
+
+    deadline = time.monotonic() + 5
+    while writer.stats()["flushed_messages"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    try:
+        assert writer.running
+        assert stored_texts() == ["m1", "m2"]
+    finally:
+        writer.stop(timeout=5)
+
+
+def test_stop_flushes_without_waiting_for_the_interval(db_path):
+    writer = MessageWriter(batch_size=100, flush_interval=60)
+    writer.start()
+    for n in range(5):
+        writer.submit(row(n))
+
+    started = time.monotonic()
+    writer.stop(timeout=5)
+
+    assert time.monotonic() - started < 5
+    assert not writer.running
+    assert len(stored_texts()) == 5
+
+
+def test_failed_batch_is_counted_and_the_writer_goes_on(db_path):
+    writer = MessageWriter(batch_size=2, flush_interval=60)
+    writer.start()
+    writer.submit(row(1))
+    writer.submit(("not", "a", "row"))
+    writer.submit(row(3))
+    writer.submit(row(4))
+    writer.stop(timeout=5)
+
+    assert writer.stats()["failed_messages"] == 2
+    assert writer.stats()["flushed_messages"] == 2
+    assert stored_texts() == ["m3", "m4"]
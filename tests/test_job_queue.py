@@ -0,0 +1,161 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from ai_api.gemini import api_client
+from ai_api.gemini.api_client import GENERATION_PROFILES, GeminiClient
+from ai_api.rate_limiter import PRIORITY_BACKGROUND, PRIORITY_MENTION, PRIORITY_ON_DEMAND
+from db import job_queue
+from db.db_manager import connect
+from db.job_queue import claim_job, enqueue_job, extend_lease, finish_job, queue_position
+from db.worker_metrics_store import drain_metric_deltas
+from tests.load.fake_gemini import FakeGeminiModel
+from handlers import summary_handler
+from handlers.summary_handler import PROCESSING_ERROR_MESSAGE, QUEUED_MESSAGE, run_or_submit
+from workers import summary_worker
+from utils.metrics import ERRORS, start_metrics_server
+from workers.pool import WorkerPool, collect_worker_metrics
+from workers.summary_worker import SummaryWorker, apply_quota_share
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text, kwargs))
+
+
+def job_status(job_id):
+    conn = connect()
+    status = conn.execute("SELECT status, error FROM summary_jobs WHERE id = ?", (job_id,)).fetchone()
+    conn.close()
+    return status
+
+
+def test_jobs_are_claimed_by_priority_and_deduplicated(db_path):
+    rolling = enqueue_job("rolling", {}, PRIORITY_BACKGROUND, dedupe_key="rolling")
+    summary = enqueue_job("summary", {"chat_id": 1, "message_count": 10}, PRIORITY_ON_DEMAND)
+    mention = enqueue_job("mention", {"chat_id": 1}, PRIORITY_ON_DEMAND - 1)
+
+    # An open job with the same key is not queued twice
+    assert enqueue_job("rolling", {}, PRIORITY_BACKGROUND, dedupe_key="rolling") is None
+    assert queue_position(summary) == 2
+
+    assert [claim_job("w1", 60).id for _ in range(3)] == [mention, summary, rolling]
+    assert claim_job("w1", 60) is None
+
+    # Once the job finished the key is free again
+    finish_job(rolling, "w1")
+    assert enqueue_job("rolling", {}, PRIORITY_BACKGROUND, dedupe_key="rolling") is not None
+
+
+def test_expired_lease_is_redelivered_until_max_attempts(db_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_MAX_ATTEMPTS", 2)
+    job_id = enqueue_job("summary", {"chat_id": 1, "message_count": 10}, PRIORITY_ON_DEMAND)
+
+    assert claim_job("crashed", 0.05).attempts == 1
+    assert claim_job("other", 60) is None  # Still leased
+    time.sleep(0.1)
+
+    job = claim_job("other", 0.05)
+    assert (job.id, job.attempts) == (job_id, 2)
+    # The first worker lost the job and can neither renew nor finish it
+    assert not extend_lease(job_id, "crashed", 60)
+    finish_job(job_id, "crashed")
+    assert job_status(job_id) == ("running", None)
+
+    time.sleep(0.1)
+    assert claim_job("third", 60) is None
+    assert job_status(job_id) == ("failed", "Too many attempts")
+
+
+def test_worker_answers_a_mention_job(db_path, monkeypatch):
+    model = FakeGeminiModel(latency=0)
+    monkeypatch.setattr(api_client, "_gemini_client", GeminiClient(models=dict.fromkeys(GENERATION_PROFILES, model)))
+    job_id = enqueue_job("mention", {"chat_id": 5, "message_id": 42, "text": "@NokolayDevBot hi", "username": "ann"},
+                         PRIORITY_MENTION)
+    bot = FakeBot()
+
+    assert asyncio.run(SummaryWorker(bot, "w1").run_once())
+
+    [(chat_id, text, kwargs)] = bot.sent
+    assert (chat_id, kwargs) == (5, {"reply_to_message_id": 42})
+    assert text
+    assert job_status(job_id) == ("done", None)
+
+
+def test_worker_metrics_reach_the_bot_metrics_endpoint(db_path, monkeypatch):
+    async def failing_job(bot, job):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(summary_worker, "run_job", failing_job)
+    enqueue_job("summary", {"chat_id": 5, "message_count": 10}, PRIORITY_ON_DEMAND)
+    errors = ERRORS.value(source="summary_job")
+
+    asyncio.run(SummaryWorker(FakeBot(), "w1").run_once())
+    # The worker handed its counts over instead of keeping them
+    assert ERRORS.value(source="summary_job") == 0
+
+    collect_worker_metrics()
+
+    async def scrape():
+        server = await start_metrics_server("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = (await reader.read()).decode()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return response
+
+    assert f'\npasha_errors_total{{source="summary_job"}} {errors + 1}\n' in asyncio.run(scrape())
+    assert drain_metric_deltas() == []
+
+
+def test_pool_size_follows_the_queue():
+    pool = WorkerPool(min_workers=1, max_workers=4, jobs_per_worker=2)
+
+    assert pool.target_size(0) == 1
+    assert pool.target_size(5) == 3
+    assert pool.target_size(100) == 4
+
+
+def test_running_workers_share_the_gemini_quota(monkeypatch):
+    monkeypatch.setattr(summary_worker, "GEMINI_REQUESTS_PER_MINUTE", 15)
+    monkeypatch.setattr(summary_worker, "GEMINI_TOKENS_PER_MINUTE", 1000)
+    monkeypatch.setattr(api_client.gemini_scheduler, "requests_per_minute", api_client.gemini_scheduler.requests_per_minute)
+    monkeypatch.setattr(api_client.gemini_scheduler, "tokens_per_minute", api_client.gemini_scheduler.tokens_per_minute)
+
+    apply_quota_share(1)
+    assert (api_client.gemini_scheduler.requests_per_minute, api_client.gemini_scheduler.tokens_per_minute) == (15, 1000)
+    apply_quota_share(2)
+    assert (api_client.gemini_scheduler.requests_per_minute, api_client.gemini_scheduler.tokens_per_minute) == (7, 500)
+
+
+class FakeMessage:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def queue_request(message):
+    update = SimpleNamespace(message=message, effective_chat=SimpleNamespace(id=5))
+    asyncio.run(run_or_submit(update, "summary", {"chat_id": 5, "message_count": 10}, deliver=None))
+
+
+def test_request_is_queued_or_answered_with_an_error(db_path, monkeypatch):
+    monkeypatch.setattr(summary_handler, "use_workers", lambda: True)
+    message = FakeMessage()
+    queue_request(message)
+    assert message.replies == [QUEUED_MESSAGE.format(position=1)]
+
+    def broken_submit(*args):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(summary_handler, "submit_job", broken_submit)
+    message = FakeMessage()
+    queue_request(message)
+    assert message.replies == [PROCESSING_ERROR_MESSAGE]
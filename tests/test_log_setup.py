@@ -0,0 +1,68 @@
+import gzip
+import json
+import logging
+import logging.handlers
+from utils import log_setup
+from utils.log_setup import ARCHIVE_LOGGER_NAME, PAYLOAD, JsonLinesFormatter, PayloadFilter
+
+
+def record(message, name="bot", payload=False):
+    log_record = logging.LogRecord(name, logging.INFO, __file__, 1, message, None, None)
+    if payload:
+        log_record.payload = True
+    return log_record
+
+
+def test_payload_lines_are_sampled(monkeypatch):
+    draws = iter([0.05, 0.5])
+    monkeypatch.setattr(log_setup.random, "random", lambda: next(draws))
+    payload_filter = PayloadFilter(sample_rate=0.1)
+
+    assert payload_filter.filter(record("kept", payload=True))
+    assert not payload_filter.filter(record("dropped", payload=True))
+    # Other lines are never sampled out
+    assert payload_filter.filter(record("status line"))
+
+
+def test_one_sampling_decision_per_record(monkeypatch):
+    draws = iter([0.05, 0.9])
+    monkeypatch.setattr(log_setup.random, "random", lambda: next(draws))
+    payload_filter = PayloadFilter(sample_rate=0.1)
+    shared = record("summary", **PAYLOAD)
+
+    # The console and the file handler see the same record
+    assert payload_filter.filter(shared)
+    assert payload_filter.filter(shared)
+
+
+def test_long_messages_are_truncated_once():
+    payload_filter = PayloadFilter(max_chars=10)
+    long_record = logging.LogRecord("bot", logging.INFO, __file__, 1, "%s", ("x" * 25,), None)
+
+    assert payload_filter.filter(long_record)
+    assert payload_filter.filter(long_record)
+    assert long_record.getMessage() == "xxxxxxxxxx... [truncated 15 chars]"
+
+
+def test_archive_records_stay_out_of_the_normal_log():
+    assert not PayloadFilter().filter(record("prompt", name=ARCHIVE_LOGGER_NAME))
+
+
+def test_archive_rotates_into_gzip_files(tmp_path):
+    path = tmp_path / "gemini_archive.jsonl"
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=200, backupCount=2, encoding="utf-8")
+    handler.namer = log_setup._gzip_namer
+    handler.rotator = log_setup._gzip_rotator
+    handler.setFormatter(JsonLinesFormatter())
+
+    for n in range(10):
+        archived = record(f"запрос {n} " + "x" * 50, name=ARCHIVE_LOGGER_NAME)
+        archived.kind, archived.request_id = "request", f"id{n}"
+        handler.emit(archived)
+    handler.close()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "gemini_archive.jsonl", "gemini_archive.jsonl.1.gz", "gemini_archive.jsonl.2.gz"]
+    with gzip.open(tmp_path / "gemini_archive.jsonl.1.gz", "rt", encoding="utf-8") as archive:
+        entries = [json.loads(line) for line in archive]
+    assert entries and all(entry["kind"] == "request" and entry["text"].startswith("запрос") for entry in entries)
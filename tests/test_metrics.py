@@ -0,0 +1,80 @@
+import asyncio
+from utils import metrics
+from utils.metrics import Counter, Histogram, merge_metric_deltas, render_metrics, start_metrics_server, take_metric_deltas
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = []
+    histogram = Histogram("test_stage_seconds", "Test histogram.", ["stage"], buckets=(0.1, 1), registry=registry)
+    histogram.observe(0.05, stage="fetch")
+    histogram.observe(0.5, stage="fetch")
+    histogram.observe(5, stage="fetch")
+
+    lines = render_metrics(registry).splitlines()
+    assert 'test_stage_seconds_bucket{stage="fetch",le="0.1"} 1' in lines
+    assert 'test_stage_seconds_bucket{stage="fetch",le="1"} 2' in lines
+    assert 'test_stage_seconds_bucket{stage="fetch",le="+Inf"} 3' in lines
+    assert 'test_stage_seconds_sum{stage="fetch"} 5.55' in lines
+    assert 'test_stage_seconds_count{stage="fetch"} 3' in lines
+
+
+def test_deltas_of_another_process_add_up():
+    worker, bot = [], []
+    for registry in (worker, bot):
+        Counter("test_errors_total", "Test counter.", ["source"], registry=registry)
+        Histogram("test_stage_seconds", "Test histogram.", ["stage"], buckets=(0.1, 1), registry=registry)
+    worker[0].inc(source="job")
+    worker[1].observe(0.5, stage="fetch")
+    bot[0].inc(2, source="job")
+    bot[1].observe(0.05, stage="fetch")
+
+    merge_metric_deltas(take_metric_deltas(worker), bot)
+
+    lines = render_metrics(bot).splitlines()
+    assert 'test_errors_total{source="job"} 3' in lines
+    assert 'test_stage_seconds_bucket{stage="fetch",le="0.1"} 1' in lines
+    assert 'test_stage_seconds_bucket{stage="fetch",le="1"} 2' in lines
+    assert 'test_stage_seconds_count{stage="fetch"} 2' in lines
+    # Taken values are not reported twice
+    assert take_metric_deltas(worker) == {}
+
+
+def test_endpoint_serves_metrics():
+    registry = []
+    counter = Counter("test_deletions_total", "Test counter.", registry=registry)
+    counter.inc(2)
+
+    async def scrape(path, registry=None):
+        server = await start_metrics_server("127.0.0.1", 0, registry)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        response = (await reader.read()).decode()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return response
+
+    response = asyncio.run(scrape("/metrics", registry))
+    assert response.startswith("HTTP/1.1 200 OK")
+    assert "\ntest_deletions_total 2\n" in response
+    assert "pasha_summary_stage_seconds" not in response
+    # The bot's own metrics and nothing a test created
+    response = asyncio.run(scrape("/metrics"))
+    assert "# TYPE pasha_summary_stage_seconds histogram" in response
+    assert "test_" not in response
+    assert asyncio.run(scrape("/other")).startswith("HTTP/1.1 404")
+
+
+def test_timed_handler_counts_failures():
+    async def failing_handler(update, context):
+        raise RuntimeError("boom")
+
+    wrapped = metrics.timed_handler(failing_handler)
+    try:
+        asyncio.run(wrapped(None, None))
+    except RuntimeError:
+        pass
+
+    assert metrics.HANDLER_SECONDS.count(handler="failing_handler") == 1
+    assert metrics.ERRORS.value(source="handler.failing_handler") == 1
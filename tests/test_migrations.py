@@ -0,0 +1,143 @@
+import sqlite3
+from datetime import datetime, timezone
+from config import DAILY_SUMMARY_CHAT_ID
+from db import db_manager
+from db.db_manager import connect, insert_message, setup_database
+from db.fetchers import (CHAT_LAST_ID_QUERY, DATE_RANGE_QUERY, DIGEST_BACKLOG_QUERY, LAST_N_MESSAGES_QUERY, fetch_last_n_messages,
+                         fetch_messages_after, fetch_messages_by_date_range, fetch_topic_messages)
+from db.migrations import AUTO_VACUUM_INCREMENTAL, MIGRATIONS, get_schema_version
+
+CHAT_ID = int(DAILY_SUMMARY_CHAT_ID)
+
+
+def query_plan(sql, params):
+    conn = connect()
+    plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+    conn.close()
+    return plan
+
+
+def test_upgrades_legacy_database_in_place(tmp_path, monkeypatch):
+    path = str(tmp_path / "legacy.db")
+    legacy = sqlite3.connect(path)
+    legacy.execute('''CREATE TABLE messages (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        message_id INTEGER,
+                        date TEXT,
+                        username TEXT,
+                        message_content TEXT,
+                        thread_id INTEGER
+                    )''')
+    legacy.execute("INSERT INTO messages (message_id, date, username, message_content, thread_id) VALUES (?, ?, ?, ?, ?)",
+                   (1, "2024-11-26T10:00:00+00:00", "stas", "привет", 10000))
+    legacy.commit()
+    legacy.close()
+
+    monkeypatch.setattr(db_manager, "DB_PATH", path)
+    setup_database()
+
+    conn = connect()
+    assert get_schema_version(conn) == len(MIGRATIONS)
+    # The existing file was rebuilt once so retention can free pages incrementally
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+    assert conn.execute("SELECT ts, chat_id FROM messages").fetchone() == (1732615200, CHAT_ID)
+    # The activity aggregates count the messages stored before they existed
+    assert conn.execute("SELECT chat_id, thread_id, hour, message_count, poster_count FROM thread_activity").fetchall() == [
+        (CHAT_ID, 10000, 1732615200, 1, 1)]
+    conn.close()
+
+    # Running setup again is a no-op
+    setup_database()
+    assert fetch_last_n_messages(10) == [(1, 10000, "stas", "2024-11-26T10:00:00+00:00", "привет")]
+
+
+def test_date_range_uses_numeric_timestamps(db_path):
+    for minute in range(5):
+        insert_message(minute, f"2024-11-26T10:0{minute}:00+00:00", "stas", f"m{minute}", 10000, CHAT_ID)
+    insert_message(99, "2024-11-26T10:02:30+00:00", "bot", "summary", 20284, CHAT_ID)
+
+    start = datetime(2024, 11, 26, 10, 1, tzinfo=timezone.utc)
+    end = datetime(2024, 11, 26, 10, 3, tzinfo=timezone.utc)
+    rows = fetch_messages_by_date_range(start, end)
+
+    assert [row[4] for row in rows] == ["m3", "m2", "m1"]
+
+
+def test_fetch_last_n_is_index_range_scan(db_path):
+    plan = query_plan(LAST_N_MESSAGES_QUERY, (CHAT_ID, 100))
+
+    assert any("USING INDEX idx_messages_chat_ts (chat_id=?)" in step for step in plan), plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+
+
+def test_fetch_by_date_range_is_index_range_scan(db_path):
+    plan = query_plan(DATE_RANGE_QUERY, (CHAT_ID, 0, 1, 20284))
+
+    assert any("USING INDEX idx_messages_chat_ts (chat_id=? AND ts>? AND ts<?)" in step for step in plan), plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+
+
+def test_chat_last_id_walks_the_chat_index(db_path):
+    plan = query_plan(CHAT_LAST_ID_QUERY, (CHAT_ID, 100))
+
+    assert any("USING COVERING INDEX idx_messages_chat_ts (chat_id=?)" in step for step in plan), plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+
+
+def test_thread_window_is_index_range_scan(db_path):
+    plan = query_plan("SELECT id FROM messages WHERE thread_id = ? AND ts > ?", (10000, 0))
+
+    assert any("USING COVERING INDEX idx_messages_thread_ts (thread_id=? AND ts>?)" in step for step in plan), plan
+
+
+def test_digest_backlog_is_primary_key_range_scan(db_path):
+    plan = query_plan(DIGEST_BACKLOG_QUERY, (0, CHAT_ID, 100))
+
+    assert any("USING INTEGER PRIMARY KEY (rowid>?)" in step for step in plan), plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+
+
+def test_fetch_messages_after_skips_summary_thread(db_path):
+    for minute in range(4):
+        insert_message(minute, f"2024-11-26T10:0{minute}:00+00:00", "stas", f"m{minute}", 10000, CHAT_ID)
+    insert_message(99, "2024-11-26T10:05:00+00:00", "bot", "summary", 20284, CHAT_ID)
+
+    messages, last_id = fetch_messages_after(CHAT_ID, 1, 10)
+
+    assert [row[4] for row in messages] == ["m3", "m2", "m1"]
+    assert last_id == 5
+
+
+def test_topic_search_returns_matches_with_thread_context(db_path):
+    texts = ["привет", "обсудим бюджет", "бюджета не хватит", "согласен", "пока", "кофе"]
+    for minute, text in enumerate(texts):
+        insert_message(minute, f"2024-11-26T10:0{minute}:00+00:00", "stas", text, 10000, CHAT_ID)
+    insert_message(50, "2024-11-26T10:02:30+00:00", "olga", "бюджет в другой теме", 30000, CHAT_ID)
+    insert_message(99, "2024-11-26T10:09:00+00:00", "bot", "бюджет в сводке", 20284, CHAT_ID)
+
+    rows = fetch_topic_messages("Бюджет", context=1)
+
+    assert [row[4] for row in rows] == ["бюджет в другой теме", "согласен", "бюджета не хватит", "обсудим бюджет", "привет"]
+
+
+def test_topic_search_excludes_the_chat_summary_thread(db_path):
+    insert_message(1, "2024-11-26T10:00:00+00:00", "stas", "обсудим бюджет", 10000, -100)
+    insert_message(2, "2024-11-26T10:01:00+00:00", "bot", "бюджет в сводке", 9, -100)
+
+    rows = fetch_topic_messages("бюджет", -100, 9, context=0)
+
+    assert [row[4] for row in rows] == ["обсудим бюджет"]
+
+
+def test_topic_index_follows_edits_and_deletes(db_path):
+    insert_message(1, "2024-11-26T10:00:00+00:00", "stas", "обсудим бюджет", 10000, CHAT_ID)
+    conn = connect()
+    with conn:
+        conn.execute("UPDATE messages SET message_content = 'обсудим отпуск'")
+    assert fetch_topic_messages("бюджет", context=0) == []
+    assert len(fetch_topic_messages("отпуск", context=0)) == 1
+
+    with conn:
+        conn.execute("DELETE FROM messages")
+    conn.close()
+    assert fetch_topic_messages("отпуск", context=0) == []
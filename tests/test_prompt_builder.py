@@ -0,0 +1,84 @@
+import asyncio
+from ai_api import summarizer
+from ai_api.compaction import compact_messages
+from ai_api.gemini.prompt_builder import SUMMARY_INSTRUCTIONS, build_summary_prompt
+from utils.formaters import message_formatter
+from utils.formaters.message_formatter import replace_thread_ids_with_names
+
+# Rows as returned by the fetchers: newest first
+ROWS = [
+    (6, 14133, "anna", "2024-11-26T10:06:00+00:00", "и ещё"),
+    (5, 10000, "stas", "2024-11-26T10:05:00+00:00", "второе"),
+    (4, 14133, "oleg", "2024-11-26T10:04:00+00:00", "ответ"),
+    (3, 14133, "anna", "2024-11-26T10:03:00+00:00", "вопрос"),
+    (2, 10000, "stas", "2024-11-26T10:02:00+00:00", "первое"),
+    (1, 99999, "ivan", "2024-11-26T10:01:00+00:00", "где это?"),
+]
+
+
+def test_builds_prompt_from_a_row_generator():
+    prompt = build_summary_prompt(row for row in ROWS)
+
+    assert prompt == SUMMARY_INSTRUCTIONS + (
+        "🚀 Паша-бот\n"
+        "  - anna: вопрос\n"
+        "  - oleg: ответ\n"
+        "  - anna: и ещё\n"
+        "\n"
+        "☕️ Женераль\n"
+        "  - stas: первое\n"
+        "  - stas: второе\n"
+        "\n"
+        "Thread 99999\n"
+        "  - ivan: где это?\n"
+        "\n"
+    )
+
+
+def test_thread_names_are_resolved_once_per_thread(monkeypatch):
+    calls = []
+
+    def counting_get_thread_name(thread_id):
+        calls.append(thread_id)
+        return f"name-{thread_id}"
+
+    monkeypatch.setattr(message_formatter, "get_thread_name", counting_get_thread_name)
+    build_summary_prompt(iter(ROWS))
+
+    assert sorted(calls) == [10000, 14133, 99999]
+
+
+def test_summary_prompt_is_sent_without_further_wrapping(monkeypatch):
+    sent_prompts = []
+
+    async def fake_generate_text(prompt):
+        sent_prompts.append(prompt)
+        return "summary"
+
+    monkeypatch.setattr(summarizer, "generate_text", fake_generate_text)
+    assert asyncio.run(summarizer.summarize_window(ROWS)) == "summary"
+
+    # stas's two messages in thread 10000 are merged by the compaction stage
+    assert sent_prompts == [build_summary_prompt(compact_messages(ROWS)[0])]
+    assert "  - stas: первое\n    второе\n" in sent_prompts[0]
+    assert sent_prompts[0].count(SUMMARY_INSTRUCTIONS) == 1
+
+
+def test_window_of_only_noise_is_not_sent(monkeypatch):
+    async def unexpected_generate_text(prompt):
+        raise AssertionError("Gemini must not be asked to summarize noise")
+
+    async def collect(stream):
+        return [text async for text in stream]
+
+    monkeypatch.setattr(summarizer, "generate_text", unexpected_generate_text)
+    noise = [(2, 10000, "stas", "2024-11-26T10:02:00+00:00", "ок"), (1, 10000, "ivan", "2024-11-26T10:01:00+00:00", "👍")]
+
+    assert asyncio.run(summarizer.summarize_window(noise)) is None
+    assert asyncio.run(collect(summarizer.stream_window(noise))) == []
+
+
+def test_replaces_thread_labels_in_one_pass():
+    summary = "Thread 10000\nок\n\nThread 1000\n?\n\nThread 14133\nда"
+
+    assert replace_thread_ids_with_names(summary) == "☕️ Женераль\nок\n\nThread 1000\n?\n\n🚀 Паша-бот\nда"
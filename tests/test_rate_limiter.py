@@ -0,0 +1,193 @@
+import asyncio
+from ai_api.rate_limiter import (BUDGET_WINDOW, PRIORITY_BACKGROUND, PRIORITY_MENTION, PRIORITY_ON_DEMAND,
+                                 PRIORITY_SCHEDULED, GeminiScheduler, UserRateLimiter, request_context)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+async def settle():
+    # Let the queued tasks run up to their next await
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_queued_calls_are_admitted_in_priority_order():
+    scheduler = GeminiScheduler(max_concurrency=1, requests_per_minute=100, tokens_per_minute=10000, clock=FakeClock())
+    admitted = []
+
+    async def call(name, priority):
+        with request_context(priority):
+            async with scheduler.slot(10):
+                admitted.append(name)
+
+    async def scenario():
+        await scheduler.acquire(10)
+        tasks = [asyncio.create_task(call(name, priority)) for name, priority in [
+            ("rolling", PRIORITY_BACKGROUND), ("first", PRIORITY_ON_DEMAND), ("mention", PRIORITY_MENTION),
+            ("digest", PRIORITY_SCHEDULED), ("second", PRIORITY_ON_DEMAND)]]
+        await settle()
+        assert scheduler.queue_depth == 5
+        scheduler.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+
+    # FIFO within a priority
+    assert admitted == ["digest", "first", "second", "mention", "rolling"]
+    assert scheduler.in_flight == 0
+
+
+def test_request_budget_wakes_the_queue_when_the_window_moves():
+    clock = FakeClock()
+    scheduler = GeminiScheduler(max_concurrency=5, requests_per_minute=1, tokens_per_minute=10000, clock=clock)
+
+    async def scenario():
+        async with scheduler.slot(10):
+            pass
+        # Just before the first call leaves the window, so the wakeup is due almost at once
+        clock.now = BUDGET_WINDOW - 0.05
+        waiting = asyncio.create_task(scheduler.acquire(10))
+        await settle()
+        assert not waiting.done() and scheduler.queue_depth == 1
+
+        clock.now = BUDGET_WINDOW
+        await asyncio.wait_for(waiting, 1)
+
+    asyncio.run(scenario())
+
+    assert scheduler.in_flight == 1
+
+
+def test_token_budget_holds_calls_until_tokens_leave_the_window():
+    clock = FakeClock()
+    scheduler = GeminiScheduler(max_concurrency=5, requests_per_minute=100, tokens_per_minute=100, clock=clock)
+
+    async def scenario():
+        await scheduler.acquire(80)
+        await scheduler.acquire(20)
+        clock.now = BUDGET_WINDOW - 0.05
+        waiting = asyncio.create_task(scheduler.acquire(50))
+        await settle()
+        assert not waiting.done()
+        assert not scheduler.can_admit_now(1)
+
+        clock.now = BUDGET_WINDOW
+        await asyncio.wait_for(waiting, 1)
+
+    asyncio.run(scenario())
+
+    assert scheduler.in_flight == 3
+
+
+def test_prompt_larger_than_the_token_budget_runs_alone():
+    scheduler = GeminiScheduler(max_concurrency=5, requests_per_minute=100, tokens_per_minute=100, clock=FakeClock())
+
+    async def scenario():
+        await scheduler.acquire(500)
+
+    asyncio.run(scenario())
+
+    assert scheduler.in_flight == 1
+    assert not scheduler.can_admit_now(1)
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    scheduler = GeminiScheduler(max_concurrency=1, requests_per_minute=100, tokens_per_minute=10000, clock=FakeClock())
+
+    async def scenario():
+        await scheduler.acquire(10)
+        cancelled = asyncio.create_task(scheduler.acquire(10))
+        waiting = asyncio.create_task(scheduler.acquire(10))
+        await settle()
+        assert scheduler.queue_depth == 2
+
+        cancelled.cancel()
+        await settle()
+        assert scheduler.queue_depth == 1
+
+        scheduler.release()
+        await asyncio.wait_for(waiting, 1)
+        assert cancelled.cancelled()
+
+    asyncio.run(scenario())
+
+    # Only the call that was admitted holds the slot
+    assert scheduler.in_flight == 1
+    assert scheduler._waiters == []
+
+
+def test_on_queued_reports_the_position_once():
+    scheduler = GeminiScheduler(max_concurrency=1, requests_per_minute=100, tokens_per_minute=10000, clock=FakeClock())
+    positions = []
+
+    async def on_queued(position):
+        positions.append(position)
+
+    async def queued_call(priority, notify):
+        with request_context(priority, on_queued if notify else None):
+            async with scheduler.slot(10):
+                pass
+            async with scheduler.slot(10):
+                pass
+
+    async def scenario():
+        await scheduler.acquire(10)
+        ahead = asyncio.create_task(queued_call(PRIORITY_SCHEDULED, False))
+        await settle()
+        reported = asyncio.create_task(queued_call(PRIORITY_ON_DEMAND, True))
+        await settle()
+        assert positions == [2]
+
+        scheduler.release()
+        await asyncio.gather(ahead, reported)
+
+    asyncio.run(scenario())
+
+    assert positions == [2]
+
+
+def test_on_queued_is_not_called_when_admitted_at_once():
+    scheduler = GeminiScheduler(max_concurrency=1, requests_per_minute=100, tokens_per_minute=10000, clock=FakeClock())
+    positions = []
+
+    async def on_queued(position):
+        positions.append(position)
+
+    async def scenario():
+        with request_context(PRIORITY_ON_DEMAND, on_queued):
+            async with scheduler.slot(10):
+                pass
+
+    asyncio.run(scenario())
+
+    assert positions == []
+
+
+def test_user_limiter_refills_over_the_period():
+    clock = FakeClock()
+    limiter = UserRateLimiter(2, 60, clock=clock)
+
+    assert [limiter.allow(1) for _ in range(3)] == [True, True, False]
+    clock.now = 30
+    assert limiter.allow(1)
+    assert not limiter.allow(1)
+
+
+def test_user_limiter_drops_the_least_recently_seen_user():
+    limiter = UserRateLimiter(1, 60, max_users=2, clock=FakeClock())
+
+    assert limiter.allow(1) and limiter.allow(2)
+    assert not limiter.allow(1)  # Marks user 1 as recently seen
+    assert limiter.allow(3)
+
+    assert list(limiter._buckets) == [1, 3]
+    assert not limiter.allow(1)
+    # User 2 was dropped and starts over with a full bucket
+    assert limiter.allow(2)
+    assert len(limiter._buckets) == 2
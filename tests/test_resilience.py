@@ -0,0 +1,127 @@
+import asyncio
+from ai_api.gemini import api_client, resilience
+from ai_api.gemini.api_client import GENERATION_PROFILES, GeminiClient
+from ai_api.gemini.resilience import LatencyTracker, call_with_fallback, hedged
+from handlers.message_handler import MENTION_ERROR_REPLY, handle_bot_mention
+
+
+class ServiceUnavailable(Exception):
+    code = 503
+
+
+class InvalidArgument(Exception):
+    code = 400
+
+
+class FakeModels:
+    """Answers per model name from a script of ("ok", seconds), ("fail", error) or ("hang",) steps."""
+
+    def __init__(self, **scripts):
+        self.scripts = {name: list(steps) for name, steps in scripts.items()}
+        self.calls = []
+
+    async def __call__(self, model_name):
+        self.calls.append(model_name)
+        step = self.scripts[model_name].pop(0)
+        if step[0] == "fail":
+            raise step[1]
+        await asyncio.sleep(step[1] if step[0] == "ok" else 3600)
+        return f"{model_name} answer"
+
+
+def run(call, **kwargs):
+    return asyncio.run(call_with_fallback(call, ["flash", "flash-8b"], **kwargs))
+
+
+def test_retries_retryable_errors_with_backoff(monkeypatch):
+    monkeypatch.setattr(resilience, "GEMINI_RETRY_BASE_DELAY", 0.01)
+    models = FakeModels(flash=[("fail", ServiceUnavailable()), ("fail", ServiceUnavailable()), ("ok", 0)])
+
+    response, result = run(models, timeout=5)
+
+    assert response == "flash answer"
+    assert result.ok and result.model == "flash" and result.attempts == 3
+
+
+def test_falls_back_to_the_next_model_when_the_deadline_passes(monkeypatch):
+    monkeypatch.setattr(resilience, "GEMINI_MODEL_DEADLINE", 0.05)
+    models = FakeModels(flash=[("hang",)], **{"flash-8b": [("ok", 0)]})
+
+    response, result = run(models, timeout=5)
+
+    assert response == "flash-8b answer"
+    assert models.calls == ["flash", "flash-8b"]
+    assert result.ok and result.model == "flash-8b"
+
+
+def test_reports_failures_instead_of_raising():
+    models = FakeModels(flash=[("fail", InvalidArgument("bad prompt"))])
+
+    response, result = run(models, timeout=5)
+
+    assert response is None
+    assert not result.ok and isinstance(result.error, InvalidArgument)
+    assert models.calls == ["flash"]
+
+    models = FakeModels(flash=[("hang",)], **{"flash-8b": [("hang",)]})
+    response, result = run(models, timeout=0.05)
+    assert response is None and result.timed_out
+
+
+def test_hedged_request_answers_for_a_slow_first_request():
+    models = FakeModels(flash=[("hang",), ("ok", 0)])
+
+    response, sent_hedge = asyncio.run(hedged(lambda: models("flash"), delay=0.02, timeout=5))
+
+    assert response == "flash answer" and sent_hedge
+    assert len(models.calls) == 2
+
+
+def test_hedge_is_skipped_without_a_free_slot():
+    models = FakeModels(flash=[("ok", 0.05), ("ok", 0)])
+
+    response, sent_hedge = asyncio.run(hedged(lambda: models("flash"), delay=0.01, timeout=5, can_hedge=lambda: False))
+
+    assert response == "flash answer" and not sent_hedge
+    assert len(models.calls) == 1
+
+
+def test_only_first_attempt_successes_set_the_hedge_delay(monkeypatch):
+    monkeypatch.setattr(resilience, "GEMINI_RETRY_BASE_DELAY", 0.05)
+    tracker = LatencyTracker(min_samples=1)
+
+    run(FakeModels(flash=[("fail", ServiceUnavailable()), ("ok", 0)]), timeout=5, latencies=tracker)
+    assert tracker.percentile(0.5) is None
+
+    run(FakeModels(flash=[("ok", 0)]), timeout=5, latencies=tracker)
+    assert tracker.percentile(0.5) < 0.05
+
+
+def test_latency_tracker_waits_for_enough_samples():
+    tracker = LatencyTracker(min_samples=10)
+    for seconds in range(1, 10):
+        tracker.observe(seconds)
+    assert tracker.percentile(0.95) is None
+
+    for seconds in range(10, 101):
+        tracker.observe(seconds)
+    assert tracker.percentile(0.95) == 96
+
+
+class BlockedResponse:
+    @property
+    def text(self):
+        raise ValueError("The response was blocked")
+
+
+class BlockedModel:
+    async def generate_content_async(self, prompt, stream=False):
+        return BlockedResponse()
+
+
+def test_blocked_response_becomes_an_error_reply(monkeypatch):
+    monkeypatch.setattr(api_client, "_gemini_client", GeminiClient(models=dict.fromkeys(GENERATION_PROFILES, BlockedModel())))
+
+    result = asyncio.run(api_client.generate_result("prompt"))
+    assert not result.ok and isinstance(result.error, ValueError)
+    assert asyncio.run(handle_bot_mention("@bot hi")) == MENTION_ERROR_REPLY
@@ -0,0 +1,67 @@
+from datetime import datetime, timezone
+from config import DAILY_SUMMARY_CHAT_ID
+from db.db_manager import AUTO_VACUUM_INCREMENTAL, connect, insert_message
+from db import fetchers
+from db.fetchers import fetch_last_n_messages, fetch_messages_by_date_range
+from db.retention import archive_batch, fetch_archived_messages_by_date_range
+
+CHAT_ID = int(DAILY_SUMMARY_CHAT_ID)
+
+
+def test_archive_moves_old_rows_in_batches(db_path):
+    for day in range(1, 6):
+        insert_message(day, f"2024-11-0{day}T10:00:00+00:00", "stas", f"m{day}", 10000, CHAT_ID)
+    cutoff = int(datetime(2024, 11, 4, tzinfo=timezone.utc).timestamp())
+
+    assert archive_batch(cutoff, 2) == 2
+    assert archive_batch(cutoff, 2) == 1
+    assert archive_batch(cutoff, 2) == 0
+
+    assert [row[4] for row in fetch_last_n_messages(10)] == ["m5", "m4"]
+    start = datetime(2024, 11, 1, tzinfo=timezone.utc)
+    end = datetime(2024, 11, 30, tzinfo=timezone.utc)
+    archived = fetch_archived_messages_by_date_range(start, end, CHAT_ID, 20284)
+    assert [(row[0], row[4]) for row in archived] == [(3, "m3"), (2, "m2"), (1, "m1")]
+
+
+def test_date_range_continues_in_archive(db_path):
+    for day in range(1, 6):
+        insert_message(day, f"2024-11-0{day}T10:00:00+00:00", "stas", f"m{day}", 10000, CHAT_ID)
+    archive_batch(int(datetime(2024, 11, 4, tzinfo=timezone.utc).timestamp()), 10)
+
+    start = datetime(2024, 11, 2, tzinfo=timezone.utc)
+    end = datetime(2024, 11, 30, tzinfo=timezone.utc)
+    rows = fetch_messages_by_date_range(start, end)
+
+    assert [row[4] for row in rows] == ["m5", "m4", "m3", "m2"]
+
+
+def test_date_range_skips_the_archive_without_retention(db_path, monkeypatch):
+    for day in range(1, 3):
+        insert_message(day, f"2024-11-0{day}T10:00:00+00:00", "stas", f"m{day}", 10000, CHAT_ID)
+    archive_batch(int(datetime(2024, 11, 2, tzinfo=timezone.utc).timestamp()), 10)
+    monkeypatch.setattr(fetchers, "RETENTION_DAYS", 0)
+
+    start = datetime(2024, 11, 1, tzinfo=timezone.utc)
+    end = datetime(2024, 11, 30, tzinfo=timezone.utc)
+
+    assert [row[4] for row in fetch_messages_by_date_range(start, end)] == ["m2"]
+
+
+def test_date_range_excludes_the_chat_summary_thread(db_path):
+    for day, thread_id in [(1, 10000), (2, 9), (4, 10000), (5, 9)]:
+        insert_message(day, f"2024-11-0{day}T10:00:00+00:00", "stas", f"m{day}", thread_id, -100)
+    archive_batch(int(datetime(2024, 11, 3, tzinfo=timezone.utc).timestamp()), 10)
+
+    start = datetime(2024, 11, 1, tzinfo=timezone.utc)
+    end = datetime(2024, 11, 30, tzinfo=timezone.utc)
+    rows = fetch_messages_by_date_range(start, end, -100, 9)
+
+    # Both the hot and the archived summaries are left out
+    assert [row[4] for row in rows] == ["m4", "m1"]
+
+
+def test_database_uses_incremental_vacuum(db_path):
+    conn = connect()
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+    conn.close()
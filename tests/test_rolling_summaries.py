@@ -0,0 +1,123 @@
+import asyncio
+from ai_api import rolling_summaries
+from ai_api.rolling_summaries import apply_thread_summaries, consume_thread_summaries, update_rolling_summaries
+from db.chat_store import save_chat
+from db.db_manager import insert_message
+from db.fetchers import fetch_messages_after
+from db.thread_summary_store import load_thread_summaries, save_thread_summary
+
+CHAT_ID = -100
+OTHER_CHAT_ID = -200
+SUMMARY_THREAD_ID = 9
+
+
+def store(chat_id, thread_id, count, text="обсуждаем релиз"):
+    for n in range(count):
+        insert_message(n, "2024-11-26T10:00:00+00:00", "ann", f"{text} {n}", thread_id, chat_id, 1732615200 + n)
+
+
+def rows(chat_id):
+    return fetch_messages_after(chat_id, 0, 1000, SUMMARY_THREAD_ID)[0]
+
+
+def use_gemini(monkeypatch, reply="обновлённая сводка"):
+    prompts = []
+
+    async def fake_generate_text(prompt, profile=None):
+        prompts.append(prompt)
+        return reply
+
+    monkeypatch.setattr(rolling_summaries, "generate_text", fake_generate_text)
+    return prompts
+
+
+def test_summary_inside_the_window_replaces_its_rows(db_path):
+    store(CHAT_ID, 1, 4)  # ids 1-4
+    store(CHAT_ID, 2, 2)  # ids 5-6
+    save_thread_summary(CHAT_ID, 1, "сводка темы", 2, 4)
+    save_thread_summary(CHAT_ID, 2, "вне окна", 5, 7)  # Reaches past the window, not used
+
+    remaining, summaries = apply_thread_summaries(CHAT_ID, rows(CHAT_ID))
+
+    assert [row[0] for row in remaining] == [6, 5, 1]
+    assert summaries == {1: ("сводка темы", 3)}
+
+
+def test_window_starting_after_the_summary_keeps_its_rows(db_path):
+    store(CHAT_ID, 1, 4)
+    save_thread_summary(CHAT_ID, 1, "сводка темы", 1, 3)
+
+    window = [row for row in rows(CHAT_ID) if row[0] >= 2]
+    remaining, summaries = apply_thread_summaries(CHAT_ID, window)
+
+    assert remaining == window
+    assert summaries == {}
+
+
+def test_consumed_summaries_start_over_after_the_digest(db_path):
+    store(CHAT_ID, 1, 3)  # ids 1-3
+    store(CHAT_ID, 2, 2)  # ids 4-5
+    save_thread_summary(CHAT_ID, 1, "сводка", 1, 2)
+    save_thread_summary(CHAT_ID, 2, "сводка", 4, 5)
+    save_thread_summary(CHAT_ID, 3, "", None, 7)
+
+    consume_thread_summaries(CHAT_ID, rows(CHAT_ID))
+
+    # Summaries are cleared and never fold in messages the digest already covered
+    assert load_thread_summaries(CHAT_ID) == {1: ("", None, 3), 2: ("", None, 5), 3: ("", None, 7)}
+
+
+def test_update_waits_for_the_delta_threshold(db_path, monkeypatch):
+    prompts = use_gemini(monkeypatch)
+    monkeypatch.setattr(rolling_summaries, "ROLLING_SUMMARY_THRESHOLD", 5)
+    store(CHAT_ID, 1, 4)
+
+    assert not asyncio.run(rolling_summaries.update_thread_summary(CHAT_ID, 1, "", None, 0))
+    assert prompts == []
+
+    store(CHAT_ID, 1, 1)
+    assert asyncio.run(rolling_summaries.update_thread_summary(CHAT_ID, 1, "", None, 0))
+    assert len(prompts) == 1
+    assert load_thread_summaries(CHAT_ID)[1] == ("обновлённая сводка", 1, 5)
+
+
+def test_update_folds_in_at_most_the_max_delta(db_path, monkeypatch):
+    use_gemini(monkeypatch)
+    monkeypatch.setattr(rolling_summaries, "ROLLING_SUMMARY_THRESHOLD", 2)
+    monkeypatch.setattr(rolling_summaries, "ROLLING_SUMMARY_MAX_DELTA", 3)
+    store(CHAT_ID, 1, 5)
+    save_thread_summary(CHAT_ID, 1, "старая сводка", 1, 1)
+
+    assert asyncio.run(rolling_summaries.update_thread_summary(CHAT_ID, 1, "старая сводка", 1, 1))
+
+    # The first range id is kept, the rest follow in the next update
+    assert load_thread_summaries(CHAT_ID)[1] == ("обновлённая сводка", 1, 4)
+
+
+def test_noise_only_delta_moves_on_without_gemini(db_path, monkeypatch):
+    prompts = use_gemini(monkeypatch)
+    monkeypatch.setattr(rolling_summaries, "ROLLING_SUMMARY_THRESHOLD", 2)
+    store(CHAT_ID, 1, 1)  # id 1
+    for n, text in enumerate(["+", "спасибо", "No text content"]):  # ids 2-4
+        insert_message(n, "2024-11-26T10:05:00+00:00", "ann", text, 1, CHAT_ID, 1732615500 + n)
+    save_thread_summary(CHAT_ID, 1, "старая сводка", 1, 1)
+
+    assert not asyncio.run(rolling_summaries.update_thread_summary(CHAT_ID, 1, "старая сводка", 1, 1))
+
+    assert prompts == []
+    assert load_thread_summaries(CHAT_ID)[1] == ("старая сводка", 1, 4)
+
+
+def test_new_threads_are_tracked_from_their_own_chat(db_path, monkeypatch):
+    prompts = use_gemini(monkeypatch)
+    monkeypatch.setattr(rolling_summaries, "DIGEST_MAX_MESSAGES", 5)
+    save_chat(CHAT_ID, SUMMARY_THREAD_ID)
+    store(CHAT_ID, 1, 3)  # ids 1-3
+    store(OTHER_CHAT_ID, 2, 10)  # ids 4-13, a busier chat without digests
+
+    asyncio.run(update_rolling_summaries())
+
+    # The busy chat neither hides the quiet chat's threads nor moves their starting point
+    assert load_thread_summaries(CHAT_ID) == {1: ("", None, 3)}
+    assert load_thread_summaries(OTHER_CHAT_ID) == {}
+    assert prompts == []
@@ -0,0 +1,183 @@
+import asyncio
+import functools
+from types import SimpleNamespace
+from ai_api.gemini import api_client
+from ai_api.gemini.api_client import GENERATION_PROFILES, GeminiClient
+from ai_api.summary_cache import SummaryCache
+from handlers import summary_handler
+from handlers.streaming_reply import PLACEHOLDER_TEXT, StreamingReply
+
+
+class FakeBot:
+    """Records the Bot API calls a StreamingReply makes."""
+
+    def __init__(self):
+        self.sent = []
+        self.edits = []
+        self.texts = {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        message = SimpleNamespace(message_id=len(self.sent) + 1)
+        self.sent.append(text)
+        self.texts[message.message_id] = text
+        return message
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        self.edits.append((message_id, text))
+        self.texts[message_id] = text
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeStreamingModel:
+    """Stands in for genai.GenerativeModel, streaming a response in fixed chunks."""
+
+    def __init__(self, chunks, clock=None, seconds_per_chunk=0.0):
+        self.chunks = chunks
+        self.clock = clock
+        self.seconds_per_chunk = seconds_per_chunk
+        self.prompts = []
+
+    async def generate_content_async(self, prompt, stream=False):
+        assert stream
+        self.prompts.append(prompt)
+        return self._stream()
+
+    async def _stream(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(0)
+            if self.clock is not None:
+                self.clock.now += self.seconds_per_chunk
+            yield SimpleNamespace(text=chunk)
+
+
+def use_model(monkeypatch, model):
+    monkeypatch.setattr(api_client, "_gemini_client", GeminiClient(models=dict.fromkeys(GENERATION_PROFILES, model)))
+
+
+async def deliver(reply, prompt):
+    await reply.start()
+    async for text in api_client.stream_text(prompt):
+        await reply.append(text)
+    await reply.finish()
+
+
+def test_streams_into_placeholder_with_throttled_edits(monkeypatch):
+    clock = FakeClock()
+    chunks = [f"часть {i}\n" for i in range(20)]
+    model = FakeStreamingModel(chunks, clock, seconds_per_chunk=0.5)
+    use_model(monkeypatch, model)
+
+    bot = FakeBot()
+    reply = StreamingReply(bot, chat_id=1, prefix="Итоги:\n\n", min_edit_interval=2.0, clock=clock)
+    asyncio.run(deliver(reply, "prompt"))
+
+    assert model.prompts == ["prompt"]
+    assert bot.sent == [PLACEHOLDER_TEXT]
+    # 20 chunks over 10 seconds with at most one edit per 2 seconds, plus the final edit
+    assert 1 < len(bot.edits) <= 7
+    assert bot.texts[1] == "Итоги:\n\n" + "".join(chunks)
+
+
+def test_rolls_over_into_new_messages_at_the_length_limit(monkeypatch):
+    chunks = [f"строка номер {i}\n" for i in range(30)]
+    use_model(monkeypatch, FakeStreamingModel(chunks))
+
+    bot = FakeBot()
+    reply = StreamingReply(bot, chat_id=1, min_edit_interval=0, limit=100, clock=FakeClock())
+    asyncio.run(deliver(reply, "prompt"))
+
+    texts = [bot.texts[message.message_id] for message in reply.messages]
+    assert len(texts) > 1
+    assert all(len(text) <= 100 for text in texts)
+    assert "\n".join(texts) == "".join(chunks)
+
+
+class FailingStreamingModel(FakeStreamingModel):
+    async def _stream(self):
+        async for chunk in super()._stream():
+            yield chunk
+        raise ConnectionError("stream reset")
+
+
+WINDOW = [(2, 14133, "ann", "2024-11-26T10:01:00+00:00", "второе сообщение"),
+          (1, 14133, "bob", "2024-11-26T10:00:00+00:00", "первое сообщение")]
+
+
+def use_cache(monkeypatch):
+    monkeypatch.setattr(summary_handler, "summary_cache", SummaryCache(persist=False))
+    # Every append is edited in, so the tests see each step
+    monkeypatch.setattr(summary_handler, "StreamingReply", functools.partial(StreamingReply, min_edit_interval=0))
+
+
+def test_streamed_summary_shows_thread_names_while_streaming(db_path, monkeypatch):
+    use_cache(monkeypatch)
+    use_model(monkeypatch, FakeStreamingModel(["Thr", "ead 14133\nОбсуж", "дали бота\n"]))
+    bot = FakeBot()
+
+    asyncio.run(summary_handler.stream_summary(bot, 1, WINDOW))
+
+    # The edit after the first complete line already carries the name
+    assert any("🚀 Паша-бот" in text and "Обсуж" not in text for _, text in bot.edits)
+    assert all("Thread 14133" not in text for _, text in bot.edits)
+    assert bot.texts[1] == f"{summary_handler.SUMMARY_RESPONSE_PREFIX}🚀 Паша-бот\nОбсуждали бота\n"
+
+
+def test_concurrent_requests_for_one_window_share_the_stream(db_path, monkeypatch):
+    use_cache(monkeypatch)
+    model = FakeStreamingModel(["Thread 14133\n", "Итог\n"])
+    use_model(monkeypatch, model)
+    streaming_bot, waiting_bot = FakeBot(), FakeBot()
+
+    async def scenario():
+        await asyncio.gather(summary_handler.stream_summary(streaming_bot, 1, WINDOW),
+                             summary_handler.stream_summary(waiting_bot, 2, WINDOW))
+
+    asyncio.run(scenario())
+
+    assert len(model.prompts) == 1
+    assert waiting_bot.sent == [f"{summary_handler.SUMMARY_RESPONSE_PREFIX}🚀 Паша-бот\nИтог\n"]
+
+
+def test_interrupted_stream_keeps_the_text_with_a_notice(db_path, monkeypatch):
+    use_cache(monkeypatch)
+    use_model(monkeypatch, FailingStreamingModel(["Thread 14133\n", "Начало итога\n"]))
+    bot = FakeBot()
+
+    asyncio.run(summary_handler.stream_summary(bot, 1, WINDOW))
+
+    assert "Начало итога" in bot.texts[1]
+    assert bot.texts[1].endswith(summary_handler.STREAM_INTERRUPTED_MESSAGE)
+
+
+def test_window_of_only_noise_is_reported_as_not_found(db_path, monkeypatch):
+    use_cache(monkeypatch)
+    model = FakeStreamingModel(["Итог\n"])
+    use_model(monkeypatch, model)
+    bot = FakeBot()
+    noise = [(2, 14133, "ann", "2024-11-26T10:01:00+00:00", "+"), (1, 14133, "bob", "2024-11-26T10:00:00+00:00", "ок")]
+
+    asyncio.run(summary_handler.stream_summary(bot, 1, noise))
+
+    assert model.prompts == []
+    assert bot.texts[1] == summary_handler.SUMMARY_NOT_FOUND_MESSAGE
+
+
+def test_topic_matches_of_only_noise_are_reported_as_not_found(db_path, monkeypatch):
+    use_cache(monkeypatch)
+    model = FakeStreamingModel(["Итог\n"])
+    use_model(monkeypatch, model)
+    noise = [(2, 14133, "ann", "2024-11-26T10:01:00+00:00", "+"), (1, 14133, "bob", "2024-11-26T10:00:00+00:00", "ок")]
+    monkeypatch.setattr(summary_handler, "fetch_topic_messages", lambda *args: noise)
+    bot = FakeBot()
+
+    asyncio.run(summary_handler.deliver_topic_summary(bot, 1, "бюджет"))
+
+    assert model.prompts == []
+    assert bot.sent[0] == summary_handler.TOPIC_NOT_FOUND_MESSAGE
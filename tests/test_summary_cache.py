@@ -0,0 +1,85 @@
+import asyncio
+from ai_api.summary_cache import SummaryCache
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+async def put(cache, key, summary):
+    async def produce():
+        return summary
+    await cache.get_or_create(key, produce)
+
+
+async def get(cache, key):
+    # A miss produces nothing, which is never cached
+    async def missing():
+        return None
+    return await cache.get_or_create(key, missing)
+
+
+def test_evicts_least_recently_used_and_expired_entries():
+    clock = FakeClock()
+    cache = SummaryCache(max_entries=2, ttl=60, persist=False, clock=clock)
+
+    async def scenario():
+        await put(cache, "a", "summary a")
+        await put(cache, "b", "summary b")
+        assert await get(cache, "a") == "summary a"  # "b" is now the least recently used
+        await put(cache, "c", "summary c")
+        assert await get(cache, "b") is None
+        assert cache.evictions == 1
+
+        clock.now += 61
+        assert await get(cache, "a") is None
+
+    asyncio.run(scenario())
+
+
+def test_entries_survive_a_restart_until_they_expire(db_path):
+    clock = FakeClock()
+    asyncio.run(put(SummaryCache(persist=True, ttl=60, clock=clock), "key", "persisted"))
+
+    assert asyncio.run(get(SummaryCache(persist=True, ttl=60, clock=clock), "key")) == "persisted"
+    clock.now += 61
+    assert asyncio.run(get(SummaryCache(persist=True, ttl=60, clock=clock), "key")) is None
+
+
+def test_concurrent_requests_share_one_call():
+    cache = SummaryCache(persist=False)
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "summary"
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_create("key", factory) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["summary"] * 5
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_failures_are_shared_but_not_cached():
+    cache = SummaryCache(persist=False)
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("Gemini down")
+
+    async def scenario():
+        results = await asyncio.gather(*(cache.get_or_create("key", failing) for _ in range(2)), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+        async def working():
+            return "summary"
+        assert await cache.get_or_create("key", working) == "summary"
+
+    asyncio.run(scenario())
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import os
+from telegram import Update
+from handlers.update_processor import ChatOrderedUpdateProcessor
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load_updates():
+    with open(os.path.join(FIXTURES, "group_updates.json"), encoding="utf-8") as f:
+        return [Update.de_json(data, None) for data in json.load(f)]
+
+
+def test_updates_run_in_order_per_chat_and_concurrently_across_chats():
+    updates = load_updates()
+    first_chat = updates[0].effective_chat.id
+    finished = []
+
+    async def handle(update):
+        # The first update of the first chat is slow, e.g. a long Gemini call
+        await asyncio.sleep(0.05 if update.update_id == 1 else 0)
+        finished.append((update.effective_chat.id, update.update_id))
+
+    async def main():
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=16)
+        async with processor:
+            # Application feeds updates in arrival order, each in its own task
+            tasks = [asyncio.create_task(processor.process_update(update, handle(update))) for update in updates]
+            await asyncio.gather(*tasks)
+        return processor
+
+    processor = asyncio.run(main())
+
+    assert [update_id for chat_id, update_id in finished if chat_id == first_chat] == [1, 2, 4]
+    # The other chat didn't wait for the slow one
+    assert [update_id for _, update_id in finished[:2]] == [3, 5]
+    assert processor._chats == {}
+
+
+def test_updates_waiting_for_their_chat_do_not_hold_a_slot():
+    updates = load_updates()
+    first_chat = updates[0].effective_chat.id
+    busy = [update for update in updates if update.effective_chat.id == first_chat]
+    other = next(update for update in updates if update.effective_chat.id != first_chat)
+    release = asyncio.Event()
+    running = []
+    max_running = 0
+
+    async def handle(update):
+        nonlocal max_running
+        running.append(update.update_id)
+        max_running = max(max_running, len(running))
+        if update is not other:
+            await release.wait()
+        running.remove(update.update_id)
+
+    async def main():
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=2)
+        async with processor:
+            # More updates of one chat than there are slots, all stuck behind a slow first one
+            tasks = [asyncio.create_task(processor.process_update(update, handle(update))) for update in busy]
+            await asyncio.sleep(0)
+            await asyncio.wait_for(processor.process_update(other, handle(other)), 1)
+            release.set()
+            await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+
+    assert len(busy) > 2
+    assert max_running == 2